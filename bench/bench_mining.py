@@ -0,0 +1,65 @@
+"""
+Compares the cost of hashing block headers while mining, and the hash
+rates of the mining engines in core.mine.
+
+Run from the repository root with:
+    python -m bench.bench_mining
+"""
+import time
+from typing import Callable
+
+from core import block, mine, transaction
+from core.settings import MAX_TRANSACTIONS_PER_BLOCK
+
+from Crypto.PublicKey import RSA
+
+HASHES = 100000
+ENGINE_DIFFICULTY = 16  # Bits
+ENGINE_BLOCKS = 5
+
+
+def timeHashes(hashNoonce: Callable[[int], str]) -> float:
+    """
+    Returns the number of seconds per hash for the given hash function.
+    """
+    start = time.perf_counter()
+    for noonce in range(HASHES):
+        hashNoonce(noonce)
+    return (time.perf_counter() - start) / HASHES
+
+
+def main() -> None:
+    address = RSA.generate(2048).publickey().exportKey('DER').hex()
+    transactions = [
+        transaction.createTransaction([address], [1000], time.time() + i)
+        for i in range(MAX_TRANSACTIONS_PER_BLOCK)
+    ]
+    previousHash = block.genesisBlock().hash
+
+    def hashBlock(noonce: int) -> str:
+        return block.hashBlock(1, time.time(), transactions, noonce, previousHash)
+
+    header = block.MiningHeader(1, time.time(), transactions, previousHash)
+
+    baseline = timeHashes(hashBlock)
+    midstate = timeHashes(header.hash)
+
+    print("hashBlock:    {:8.3f} us/hash".format(baseline * 1e6))
+    print("MiningHeader: {:8.3f} us/hash".format(midstate * 1e6))
+    print("Speedup:      {:8.2f}x".format(baseline / midstate))
+
+    genesis = block.genesisBlock()
+    for mode in mine.MINERS:
+        miner = mine.createMiner(mode)
+        hashCount = 0
+        elapsed = 0.0
+        for _ in range(ENGINE_BLOCKS):
+            miner.generateNextBlock(genesis, transactions, ENGINE_DIFFICULTY)
+            hashCount += miner.hashCount
+            elapsed += miner.elapsed
+        print("{:8} miner: {:10.0f} hashes/s".format(
+            mode, hashCount / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the size and encode/decode speed of the JSON and binary block
+formats.
+
+Run from the repository root with:
+    python -m bench.bench_serialization
+"""
+import json
+import time
+from typing import Callable
+
+from core import block, transaction
+from core.settings import MAX_TRANSACTIONS_PER_BLOCK
+
+from Crypto.PublicKey import RSA
+
+ITERATIONS = 2000
+
+
+def timeCall(function: Callable[[], object]) -> float:
+    """
+    Returns the number of seconds per call of the function.
+    """
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        function()
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+def createBlock() -> block.Block:
+    """
+    Creates a full block of transactions that each spend two outputs to
+    two addresses.
+    """
+    private = RSA.generate(2048)
+    address = private.publickey().exportKey('DER').hex()
+
+    coinbase = transaction.createTransaction([address], [1000], time.time())
+    transactions = [coinbase]
+    for i in range(MAX_TRANSACTIONS_PER_BLOCK - 1):
+        transactions.append(transaction.createTransaction(
+            outputAddresses=[address, address],
+            outputAmounts=[400, 600],
+            timestamp=time.time(),
+            previousTransactionHashes=[coinbase.hash, coinbase.hash],
+            previousOutputIndices=[0, 1],
+            privateKeys=[private, private]))
+
+    genesis = block.genesisBlock()
+    return block.Block(1, time.time(), transactions, 12345, genesis.hash)
+
+
+def main() -> None:
+    b = createBlock()
+
+    formats = [
+        (
+            "JSON",
+            b.asJSON,
+            block.createFromJSON,
+        ),
+        (
+            "compact JSON",
+            lambda: json.dumps(b.asDict(), separators=(",", ":")),
+            lambda data: block.createFromDictionary(json.loads(data)),
+        ),
+        (
+            "binary",
+            b.asBytes,
+            block.createFromBytes,
+        ),
+    ]
+
+    print("{:14} {:>8} {:>12} {:>12}".format(
+        "format", "bytes", "encode us", "decode us"))
+    for name, encode, decode in formats:
+        data = encode()
+        encodeTime = timeCall(encode)
+        decodeTime = timeCall(lambda: decode(data))
+        print("{:14} {:8d} {:12.1f} {:12.1f}".format(
+            name, len(data), encodeTime * 1e6, decodeTime * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the memory used by a million unspent outputs in the compact UTXO
+layout, which keeps one output per outpoint, and the previous layout,
+which kept every transaction with an unspent output along with a set of
+its unspent indices. Both layouts use the same transaction classes, so
+the difference comes from the layout alone.
+
+Run from the repository root with:
+    python -m bench.bench_utxo
+"""
+import gc
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, Set, Tuple
+
+from core import chain, transaction
+
+from Crypto.PublicKey import RSA
+
+UTXO_COUNT = 1000000
+ADDRESS_COUNT = 100
+
+
+def createTransactions(addresses) -> Iterator[transaction.Transaction]:
+    """
+    Yields transactions with one signed input and one output. Signatures
+    are random bytes of the size of a 2048 bit RSA signature, since only
+    their size matters here.
+    """
+    previousHash = "00" * 32
+    for i in range(UTXO_COUNT):
+        tInput = transaction.TransactionInput(
+            previousHash, 0, os.urandom(256).hex())
+        tOutput = transaction.TransactionOutput(
+            1000, addresses[i % len(addresses)])
+        tx = transaction.Transaction([tInput], [tOutput], float(i))
+        previousHash = tx.hash
+        yield tx
+
+
+def buildCompact(addresses) -> chain.UTXOManager:
+    manager = chain.UTXOManager()
+    for tx in createTransactions(addresses):
+        # The same entries that UTXOManager.spend adds for the outputs.
+        for i in range(len(tx.outputs)):
+            manager.utxo[(tx.hash, i)] = tx.outputs[i]
+    return manager
+
+
+def buildPrevious(addresses) \
+        -> Dict[str, Tuple[transaction.Transaction, Set[int]]]:
+    utxo: Dict[str, Tuple[transaction.Transaction, Set[int]]] = {}
+    for tx in createTransactions(addresses):
+        utxo[tx.hash] = (tx, set(range(len(tx.outputs))))
+    return utxo
+
+
+def measure(build: Callable[[], object]) -> Tuple[int, float]:
+    """
+    Returns the bytes allocated by the structure that the function builds,
+    and the seconds taken to build it.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structure
+    return size, elapsed
+
+
+def main() -> None:
+    # Addresses are created before measuring, since they are shared by
+    # both layouts.
+    addresses = [
+        RSA.generate(1024).publickey().exportKey('DER').hex()
+        for i in range(ADDRESS_COUNT)]
+
+    print("{:10} {:>12} {:>14} {:>10}".format(
+        "layout", "MiB", "bytes per utxo", "seconds"))
+    for name, build in [
+            ("previous", lambda: buildPrevious(addresses)),
+            ("compact", lambda: buildCompact(addresses))]:
+        size, elapsed = measure(build)
+        print("{:10} {:12.1f} {:14.1f} {:10.1f}".format(
+            name, size / 2 ** 20, size / UTXO_COUNT, elapsed))
+
+
+if __name__ == '__main__':
+    main()
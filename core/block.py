@@ -1,6 +1,15 @@
+import hashlib
 import json
 from typing import List, cast
-from core.transaction import Transaction, createTransaction, createFromDictionary
+from core.encoding import SERIALIZATION_VERSION, readVersion, DecodeException
+from core.encoding import writeVarint, readVarint, writeHex, readHex
+from core.encoding import writeNumber, readNumber
+from core.merkle import MerkleProof, computeMerkleRoot, getMerkleProof
+from core.merkle import verifyMerkleProof
+from core.settings import INITIAL_DIFFICULTY
+from core.transaction import Transaction, createTransaction
+from core.transaction import createFromDictionary as createTransactionFromDictionary
+from core.transaction import readTransaction
 
 from Crypto.Hash import SHA256
 
@@ -12,6 +21,12 @@ class BlockException(Exception):
 class Block:
     """
     A Block that exists in the blockchain.
+
+    The difficulty is the number of leading zero bits its hash must have.
+    It is not part of the hash, since the chain derives the expected
+    difficulty from the block's ancestors. The transactions are committed
+    to by the transaction root, the root of a Merkle tree over their
+    hashes, which is computed once per block.
     """
     def __init__(
             self,
@@ -19,27 +34,68 @@ class Block:
             timestamp: float,
             transactions: List[Transaction],
             noonce: int,
-            previousHash: str) -> None:
+            previousHash: str,
+            difficulty: int = INITIAL_DIFFICULTY) -> None:
 
         self.index = index
         self.timestamp = timestamp
         self.transactions = transactions
         self.previousHash = previousHash
         self.noonce = noonce
-        self.hash = hashBlock(
+        self.difficulty = difficulty
+        self.transactionsRoot = hashTransactions(transactions)
+        self.hash = hashHeader(
             index=index,
             timestamp=timestamp,
-            transactions=transactions,
+            transactionsRoot=self.transactionsRoot,
             noonce=noonce,
             previousHash=previousHash)
-    
+
+    def getHeader(self) -> "BlockHeader":
+        """
+        Returns the header of the block, which has the same hash.
+        """
+        return BlockHeader(
+            index=self.index,
+            timestamp=self.timestamp,
+            noonce=self.noonce,
+            previousHash=self.previousHash,
+            transactionsRoot=self.transactionsRoot,
+            difficulty=self.difficulty)
+
+    def getTransactionProof(self, transactionHash: str) -> MerkleProof:
+        """
+        Returns the Merkle proof that a transaction of the block is
+        committed to by its transaction root.
+        """
+        hashes = [transaction.hash for transaction in self.transactions]
+        try:
+            index = hashes.index(transactionHash)
+        except ValueError:
+            raise BlockException("Transaction is not in the block.")
+
+        return getMerkleProof(hashes, index)
+
+    def verifyTransactionProof(
+            self,
+            transactionHash: str,
+            proof: MerkleProof) -> bool:
+        """
+        Verifies that a Merkle proof shows the transaction is in the block.
+        """
+        return verifyMerkleProof(transactionHash, proof, self.transactionsRoot)
+
     def asJSON(self) -> str:
+        return json.dumps(self.asDict(), indent=4)
+
+    def asDict(self) -> dict:
         d = {
             "hash": self.hash,
             "index": self.index,
             "timestamp": self.timestamp,
             "noonce": self.noonce,
             "previousHash": self.previousHash,
+            "difficulty": self.difficulty,
             "transactions": [],
         }
 
@@ -47,7 +103,27 @@ class Block:
             dTransactions = cast(List[Transaction], d["transactions"])
             dTransactions.append(transaction.asDict())
 
-        return json.dumps(d, indent=4)
+        return d
+
+    def asBytes(self) -> bytes:
+        """
+        Encodes the block in the versioned binary format. The block hash is
+        included so that corrupt data can be detected when decoding, but
+        transaction hashes are derived from the transaction data.
+        """
+        buffer = bytearray([SERIALIZATION_VERSION])
+        writeHex(buffer, self.hash)
+        writeVarint(buffer, self.index)
+        writeNumber(buffer, self.timestamp)
+        writeVarint(buffer, self.noonce)
+        writeVarint(buffer, self.difficulty)
+        writeHex(buffer, self.previousHash)
+
+        writeVarint(buffer, len(self.transactions))
+        for transaction in self.transactions:
+            transaction.encodeInto(buffer)
+
+        return bytes(buffer)
 
     def __repr__(self) -> str:
         return self.asJSON()
@@ -74,6 +150,83 @@ class Block:
         return NotImplemented
 
 
+class BlockHeader:
+    """
+    The fields of a block without its transactions, which are committed
+    to by the transaction root. A header is enough to check the block's
+    hash, its proof of work and where it goes in the chain, so the shape
+    of a chain can be validated before any transactions are downloaded.
+    """
+    __slots__ = (
+        "index", "timestamp", "noonce", "previousHash", "transactionsRoot",
+        "difficulty", "hash")
+
+    def __init__(
+            self,
+            index: int,
+            timestamp: float,
+            noonce: int,
+            previousHash: str,
+            transactionsRoot: str,
+            difficulty: int = INITIAL_DIFFICULTY) -> None:
+        self.index = index
+        self.timestamp = timestamp
+        self.noonce = noonce
+        self.previousHash = previousHash
+        self.transactionsRoot = transactionsRoot
+        self.difficulty = difficulty
+        self.hash = hashHeader(
+            index=index,
+            timestamp=timestamp,
+            transactionsRoot=transactionsRoot,
+            noonce=noonce,
+            previousHash=previousHash)
+
+    def asDict(self) -> dict:
+        return {
+            "hash": self.hash,
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "noonce": self.noonce,
+            "previousHash": self.previousHash,
+            "transactionsRoot": self.transactionsRoot,
+            "difficulty": self.difficulty,
+        }
+
+    def asBytes(self) -> bytes:
+        """
+        Encodes the header in the versioned binary format, laid out like
+        the start of an encoded block followed by the transaction root.
+        """
+        buffer = bytearray([SERIALIZATION_VERSION])
+        writeHex(buffer, self.hash)
+        writeVarint(buffer, self.index)
+        writeNumber(buffer, self.timestamp)
+        writeVarint(buffer, self.noonce)
+        writeVarint(buffer, self.difficulty)
+        writeHex(buffer, self.previousHash)
+        writeHex(buffer, self.transactionsRoot)
+        return bytes(buffer)
+
+    def verifyTransactionProof(
+            self,
+            transactionHash: str,
+            proof: MerkleProof) -> bool:
+        """
+        Verifies that a Merkle proof shows the transaction is in the block,
+        without needing the block's transactions.
+        """
+        return verifyMerkleProof(transactionHash, proof, self.transactionsRoot)
+
+    def __repr__(self) -> str:
+        return json.dumps(self.asDict(), indent=4)
+
+    def __eq__(self, other: object):
+        if isinstance(other, BlockHeader):
+            return self.hash == other.hash
+        return NotImplemented
+
+
 def hashBlock(
         index: int,
         timestamp: float,
@@ -83,21 +236,144 @@ def hashBlock(
     """
     Generates a SHA256 hash for the given data inside a block.
     """
-    # Serialize the block's data by encoding it using utf8.
-    combinedTransaction = \
-        "".join([transaction.hash for transaction in transactions])
+    return hashHeader(
+        index,
+        timestamp,
+        hashTransactions(transactions),
+        noonce,
+        previousHash)
+
 
+def hashHeader(
+        index: int,
+        timestamp: float,
+        transactionsRoot: str,
+        noonce: int,
+        previousHash: str) -> str:
+    """
+    Generates a SHA256 hash for the given header data.
+    """
+    # Serialize the block's data by encoding it using utf8.
     serialized = \
-        "{}{}{}{}".format(
-            index,
-            timestamp,
-            combinedTransaction,
-            noonce,
-            previousHash) \
-        .encode('utf-8')
+        serializeHeaderPrefix(
+            index, timestamp, previousHash, transactionsRoot) + \
+        str(noonce).encode('utf-8')
     return SHA256.new(serialized).hexdigest()
 
 
+def hashTransactions(transactions: List[Transaction]) -> str:
+    """
+    Returns the transaction root of a block, which is the root of the
+    Merkle tree over its transaction hashes.
+    """
+    return computeMerkleRoot(
+        [transaction.hash for transaction in transactions])
+
+
+def serializeHeaderPrefix(
+        index: int,
+        timestamp: float,
+        previousHash: str,
+        transactionsRoot: str) -> bytes:
+    """
+    Serializes the part of the block data that is hashed before the noonce.
+    The previous hash is included so that a header's proof of work also
+    commits to where it is in the chain.
+    """
+    return "{}{}{}{}".format(
+        index,
+        timestamp,
+        previousHash,
+        transactionsRoot) \
+        .encode('utf-8')
+
+
+class MiningHeader:
+    """
+    The invariant part of a block header that is being mined.
+
+    Only the noonce changes between mining attempts, so the header prefix
+    is serialized once and the SHA256 state after consuming it (the
+    midstate) is kept. Hashing a noonce copies the midstate and feeds it
+    the noonce bytes only, giving the same result as hashBlock. The prefix
+    holds the transaction root instead of the transactions, so its size
+    and the cost of each hash do not depend on the number of transactions.
+    """
+    def __init__(
+            self,
+            index: int,
+            timestamp: float,
+            transactions: List[Transaction],
+            previousHash: str,
+            difficulty: int = INITIAL_DIFFICULTY) -> None:
+        self.index = index
+        self.timestamp = timestamp
+        self.transactions = transactions
+        self.previousHash = previousHash
+        self.difficulty = difficulty
+        self._updatePrefix()
+
+    def hash(self, noonce: int) -> str:
+        """
+        Returns the block hash for the given noonce.
+        """
+        state = self.midstate.copy()
+        state.update(str(noonce).encode('utf-8'))
+        return state.hexdigest()
+
+    def digest(self, noonce: int) -> bytes:
+        """
+        Returns the raw block hash bytes for the given noonce.
+        """
+        state = self.midstate.copy()
+        state.update(str(noonce).encode('utf-8'))
+        return state.digest()
+
+    def extend(self, transaction: Transaction) -> "MiningHeader":
+        """
+        Returns a header with a transaction appended. Only the transaction
+        root and the short prefix are hashed again, and a block holds few
+        enough transactions that rebuilding its Merkle tree is cheap.
+        """
+        extended = MiningHeader.__new__(MiningHeader)
+        extended.index = self.index
+        extended.timestamp = self.timestamp
+        extended.transactions = self.transactions + [transaction]
+        extended.previousHash = self.previousHash
+        extended.difficulty = self.difficulty
+        extended._updatePrefix()
+        return extended
+
+    def createBlock(self, noonce: int) -> Block:
+        return Block(
+            index=self.index,
+            timestamp=self.timestamp,
+            transactions=self.transactions,
+            noonce=noonce,
+            previousHash=self.previousHash,
+            difficulty=self.difficulty)
+
+    def __getstate__(self) -> dict:
+        # Hash objects cannot be pickled, so the midstate is recomputed
+        # when a header is sent to a worker process.
+        state = self.__dict__.copy()
+        del state["midstate"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.midstate = hashlib.sha256(self.prefix)
+
+    def _updatePrefix(self) -> None:
+        self.transactionsRoot = hashTransactions(self.transactions)
+        self.prefix = serializeHeaderPrefix(
+            self.index,
+            self.timestamp,
+            self.previousHash,
+            self.transactionsRoot)
+        self.midstate = hashlib.sha256(self.prefix)
+
+
 def genesisBlock() -> Block:
     """
     Returns the hard-coded genesis block, which is the first Block in
@@ -124,20 +400,95 @@ def genesisBlock() -> Block:
 
 
 def createFromJSON(jsonBlock: str) -> Block:
-    deserialized = json.loads(jsonBlock)
+    return createFromDictionary(json.loads(jsonBlock))
 
+
+def createFromDictionary(deserialized: dict) -> Block:
+    """
+    Creates a block from a dictionary object, verifying that the
+    serialized hash matches the block data.
+    """
     transactions: List[Transaction] = []
     for transactionDict in deserialized["transactions"]:
-        transactions.append(createFromDictionary(transactionDict)) 
+        transactions.append(createTransactionFromDictionary(transactionDict))
 
     obj = Block(
         index=deserialized["index"],
         transactions=transactions,
         timestamp=deserialized["timestamp"],
         noonce=deserialized["noonce"],
-        previousHash=deserialized["previousHash"])
+        previousHash=deserialized["previousHash"],
+        difficulty=deserialized.get("difficulty", INITIAL_DIFFICULTY))
 
     if deserialized["hash"] != obj.hash:
         raise BlockException("Serialized block hash is invalid.")
 
     return obj
+
+
+def createFromBytes(data: bytes) -> Block:
+    """
+    Creates a block from the binary format written by asBytes, verifying
+    that the encoded hash matches the block data.
+    """
+    offset = readVersion(data)
+    expectedHash, offset = readHex(data, offset)
+    index, offset = readVarint(data, offset)
+    timestamp, offset = readNumber(data, offset)
+    noonce, offset = readVarint(data, offset)
+    difficulty, offset = readVarint(data, offset)
+    previousHash, offset = readHex(data, offset)
+
+    transactions: List[Transaction] = []
+    transactionCount, offset = readVarint(data, offset)
+    for i in range(transactionCount):
+        transaction, offset = readTransaction(data, offset)
+        transactions.append(transaction)
+
+    if offset != len(data):
+        raise DecodeException("Unexpected data after the block.")
+
+    obj = Block(
+        index=index,
+        transactions=transactions,
+        timestamp=timestamp,
+        noonce=noonce,
+        previousHash=previousHash,
+        difficulty=difficulty)
+
+    if expectedHash != obj.hash:
+        raise BlockException("Serialized block hash is invalid.")
+
+    return obj
+
+
+def createHeaderFromBytes(data: bytes) -> BlockHeader:
+    """
+    Creates a header from the binary format written by
+    BlockHeader.asBytes, verifying that the encoded hash matches the
+    header data.
+    """
+    offset = readVersion(data)
+    expectedHash, offset = readHex(data, offset)
+    index, offset = readVarint(data, offset)
+    timestamp, offset = readNumber(data, offset)
+    noonce, offset = readVarint(data, offset)
+    difficulty, offset = readVarint(data, offset)
+    previousHash, offset = readHex(data, offset)
+    transactionsRoot, offset = readHex(data, offset)
+
+    if offset != len(data):
+        raise DecodeException("Unexpected data after the header.")
+
+    obj = BlockHeader(
+        index=index,
+        timestamp=timestamp,
+        noonce=noonce,
+        previousHash=previousHash,
+        transactionsRoot=transactionsRoot,
+        difficulty=difficulty)
+
+    if expectedHash != obj.hash:
+        raise BlockException("Serialized header hash is invalid.")
+
+    return obj
@@ -1,10 +1,29 @@
-from typing import Dict, Tuple, List, cast, Set
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Tuple, List, MutableMapping
+from typing import Optional, Union, cast, Set
 
 from core.settings import MIN_TRANSACTION_AMOUNT, COINBASE_REWARD
-from core.settings import MAX_TRANSACTIONS_PER_BLOCK
+from core.settings import MAX_TRANSACTIONS_PER_BLOCK, RETARGET_WINDOW
+from core.settings import MAX_FUTURE_BLOCK_TIME, MAX_LOCATOR_HASHES
+from core.settings import MIN_DIFFICULTY, ORPHAN_DIFFICULTY_MARGIN
+from core.settings import UTXO_FLUSH_SIZE
 import core.block as block
+from core.difficulty import DifficultyWindow, getWork
+from core.encoding import SERIALIZATION_VERSION, DecodeException, readVersion
+from core.encoding import readHex, readVarint, writeHex, writeVarint
 from core.mine import hasProofOfWork
+from core.orphans import OrphanPool
+from core.snapshot import SnapshotException, readSnapshot, writeSnapshot
+from core.store import BlockMap, BlockStore, StoredHeader
 import core.transaction as transaction
+from core.transaction import Outpoint
+from core.utxodb import MemoryBackend
+from core.verify import SignatureVerifier
+
+# Headers are checked on full blocks and on headers alike.
+Header = Union[block.Block, block.BlockHeader]
 
 
 class ChainException(Exception):
@@ -17,6 +36,13 @@ class NoParentException(ChainException):
     pass
 
 
+class OrphanBlockException(NoParentException):
+    """
+    Raised when a block's previous block is not known yet. The block is
+    kept in the orphan pool and added once its previous block is.
+    """
+
+
 class DuplicateBlockException(ChainException):
     pass
 
@@ -25,256 +51,1099 @@ class UTXOException(ChainException):
     pass
 
 
+class BlockUndo:
+    """
+    Records the exact UTXO changes made when a block was connected, so that
+    it can be disconnected and connected again without re-verifying it.
+
+    Spent holds the outpoints consumed by the block's inputs along with
+    the outputs that were removed from the UTXO for them, in order.
+    Created holds the hash, number of inputs and number of outputs of each
+    of the block's transactions, whose outputs were added to the UTXO.
+    """
+    def __init__(self) -> None:
+        self.spent: List[Tuple[Outpoint, transaction.TransactionOutput]] = []
+        self.created: List[Tuple[str, int, int]] = []
+
+    def asBytes(self) -> bytes:
+        """
+        Encodes the undo record in the versioned binary format.
+        """
+        buffer = bytearray([SERIALIZATION_VERSION])
+        writeVarint(buffer, len(self.spent))
+        for (txHash, index), output in self.spent:
+            writeHex(buffer, txHash)
+            writeVarint(buffer, index)
+            writeVarint(buffer, output.amount)
+            writeHex(buffer, output.address)
+
+        writeVarint(buffer, len(self.created))
+        for txHash, inputCount, outputCount in self.created:
+            writeHex(buffer, txHash)
+            writeVarint(buffer, inputCount)
+            writeVarint(buffer, outputCount)
+
+        return bytes(buffer)
+
+
+def createUndoFromBytes(data: bytes) -> BlockUndo:
+    """
+    Creates an undo record from the binary format written by asBytes.
+    """
+    undo = BlockUndo()
+    offset = readVersion(data)
+
+    spentCount, offset = readVarint(data, offset)
+    for i in range(spentCount):
+        txHash, offset = readHex(data, offset)
+        index, offset = readVarint(data, offset)
+        amount, offset = readVarint(data, offset)
+        address, offset = readHex(data, offset)
+        undo.spent.append(
+            ((txHash, index), transaction.TransactionOutput(amount, address)))
+
+    createdCount, offset = readVarint(data, offset)
+    for i in range(createdCount):
+        txHash, offset = readHex(data, offset)
+        inputCount, offset = readVarint(data, offset)
+        outputCount, offset = readVarint(data, offset)
+        undo.created.append((txHash, inputCount, outputCount))
+
+    if offset != len(data):
+        raise DecodeException("Unexpected data after the undo record.")
+    return undo
+
+
+class UndoMap:
+    """
+    A mapping from block hash to undo record that is backed by the block
+    store of a BlockMap, so undo records are kept on disk next to their
+    blocks instead of in memory. A block must be stored before its undo
+    record, and the record is removed along with the block.
+    """
+    def __init__(self, blockMap: BlockMap) -> None:
+        self.blockMap = blockMap
+
+    def __contains__(self, blockHash: object) -> bool:
+        return self.blockMap.hasUndo(cast(str, blockHash))
+
+    def __getitem__(self, blockHash: str) -> BlockUndo:
+        if not self.blockMap.hasUndo(blockHash):
+            raise KeyError(blockHash)
+        return createUndoFromBytes(self.blockMap.getUndo(blockHash))
+
+    def __setitem__(self, blockHash: str, undo: BlockUndo) -> None:
+        self.blockMap.setUndo(blockHash, undo.asBytes())
+
+    def pop(self, blockHash: str, default: BlockUndo = None) -> BlockUndo:
+        # Undo records are removed from the store with their block.
+        if not self.blockMap.hasUndo(blockHash):
+            return default
+        return self[blockHash]
+
+
+class ChainListener:
+    """
+    Receives the blocks connected to and disconnected from the main chain.
+    Listeners are notified once the UTXO has been updated for the new head.
+    On a reorganization, the old branch's blocks are disconnected before
+    the new branch's blocks are connected. Both are given from the oldest
+    to the newest, so transactions of disconnected blocks come after the
+    transactions they depend on.
+    """
+    def blockConnected(self, connectedBlock: block.Block) -> None:
+        pass
+
+    def blockDisconnected(self, disconnectedBlock: block.Block) -> None:
+        pass
+
+
+class AddressIndex:
+    """
+    Maps each address to the (transaction hash, output index) pairs of its
+    unspent outputs, and to the hashes of the transactions that paid to or
+    spent from it in the order they were connected.
+    """
+    def __init__(self) -> None:
+        self.unspent: Dict[str, Set[Outpoint]] = {}
+        self.history: Dict[str, List[str]] = {}
+
+    def addOutput(self, address: str, outpoint: Outpoint) -> None:
+        self.unspent.setdefault(address, set()).add(outpoint)
+
+    def removeOutput(self, address: str, outpoint: Outpoint) -> None:
+        outpoints = self.unspent.get(address, None)
+        if outpoints is None:
+            return
+
+        outpoints.discard(outpoint)
+        if len(outpoints) == 0:
+            del self.unspent[address]
+
+    def addHistory(self, address: str, transactionHash: str) -> None:
+        self.history.setdefault(address, []).append(transactionHash)
+
+    def removeHistory(self, address: str, transactionHash: str) -> None:
+        hashes = self.history.get(address, None)
+        if hashes is None:
+            return
+
+        # Transactions are almost always removed from the newest to the
+        # oldest, so the hash is usually the last one.
+        if hashes[-1] == transactionHash:
+            hashes.pop()
+        elif transactionHash in hashes:
+            hashes.remove(transactionHash)
+
+        if len(hashes) == 0:
+            del self.history[address]
+
+
 class UTXOManager:
     """
-    The UTXO manager provides access to get referenced transactions from
+    The UTXO manager provides access to the unspent outputs referenced by
     new transactions.
 
-    It is implelmented as a dictionary mapping from transation hash to
-    a tuple pair of transaction and a list of unspent indices.
+    It is implemented as a dictionary mapping from the outpoint (the
+    transaction hash and output index) of each unspent output to the
+    output, which only holds an amount and an address. Spent outputs are
+    removed, and nothing else about a transaction, such as its inputs and
+    their signatures, is kept.
+
+    The dictionary is given by a backend, which defaults to keeping it in
+    memory. A backend can instead keep it on disk, as long as it behaves
+    like a dictionary, has blockBoundary, flush and close methods and has
+    a bestBlock attribute with the hash of the block it is for.
+
+    If indexAddresses is true, an address index of the unspent outputs
+    and transaction history of each address is kept up to date as
+    transactions and blocks are connected and disconnected.
 
     Note: None of these methods validate that the transaction's hash
     matches the corresponding data.
     """
-    def __init__(self):
-        self.utxo: Dict[str, Tuple[transaction.Transaction, Set[int]]] = {}
+    def __init__(
+            self,
+            indexAddresses: bool = False,
+            backend: MutableMapping = None):
+        if backend is None:
+            backend = MemoryBackend()
+        self.utxo: MutableMapping[Outpoint, transaction.TransactionOutput] = \
+            backend
+        self.addresses: AddressIndex = None
+        if indexAddresses:
+            self.addresses = AddressIndex()
+
+    def loadOutputs(
+            self,
+            outputs: Iterable[
+                Tuple[Outpoint, transaction.TransactionOutput]]) -> None:
+        """
+        Replaces the UTXO with the given unspent outputs, such as those of
+        a snapshot. The outputs are iterated once, and are written to the
+        backend every UTXO_FLUSH_SIZE outputs, so a disk backend does not
+        hold all of them in memory. The address index is rebuilt for the
+        outputs, but has no history for the transactions before them.
+        """
+        self.clear()
+        count = 0
+        for outpoint, output in outputs:
+            self.utxo[outpoint] = output
+            if self.addresses is not None:
+                self.addresses.addOutput(output.address, outpoint)
+
+            count += 1
+            if count % UTXO_FLUSH_SIZE == 0:
+                self.utxo.flush()  # type: ignore
+
+    def clear(self) -> None:
+        """
+        Removes every output, along with the address index.
+        """
+        self.utxo.clear()
+        if self.addresses is not None:
+            self.addresses = AddressIndex()
+
+    def blockBoundary(self, blockHash: str) -> None:
+        """
+        Tells the backend that the UTXO is consistent with a block, which
+        is when a disk backend may write its changes.
+        """
+        self.utxo.blockBoundary(blockHash)  # type: ignore
+
+    def getBestBlock(self) -> str:
+        """
+        Returns the hash of the block the backend's UTXO is for, or None if
+        it is not for any block.
+        """
+        return self.utxo.bestBlock  # type: ignore
 
-    def spend(self, newTransaction: transaction.Transaction) -> None:
+    def close(self) -> None:
+        """
+        Writes any pending changes and closes the backend.
+        """
+        self.utxo.close()  # type: ignore
+
+    def spend(
+            self,
+            newTransaction: transaction.Transaction) \
+            -> List[Tuple[Outpoint, transaction.TransactionOutput]]:
         """
         Spends a transaction and updates the internal cache of utxos.
+        Returns the outpoints that were spent along with their outputs,
+        which are needed to revert the transaction.
 
         A transaction should be verified before it is spent. If this is not
         the case, then it could create an invalid and confusing utxo state.
         Spent transactions are invalid.
 
         """
-        for tInput in newTransaction.inputs:
-            self._spendInput(tInput)
-
-        unspentOutputIndices = set(range(len(newTransaction.outputs)))
-        self.utxo[newTransaction.hash] = (newTransaction, unspentOutputIndices)
+        spent: List[Tuple[Outpoint, transaction.TransactionOutput]] = []
+        try:
+            for tInput in newTransaction.inputs:
+                spent.append(self._spendInput(tInput))
+        except UTXOException:
+            # Inputs spent before the missing one are put back, so a
+            # transaction is either spent entirely or not at all.
+            for outpoint, output in spent:
+                self.utxo[outpoint] = output
+            raise
+
+        for i in range(len(newTransaction.outputs)):
+            self.utxo[(newTransaction.hash, i)] = newTransaction.outputs[i]
+
+        self._indexTransaction(
+            newTransaction.hash, spent, newTransaction.outputs, True)
+        return spent
 
     def canSpend(
             self,
-            newTransaction: transaction.Transaction) -> Tuple[bool, str]:
+            newTransaction: transaction.Transaction,
+            checkSignatures: bool = True) -> Tuple[bool, str]:
         """
         Verifies if a transaction can be spent based on the current UTXO cache.
         This does not account for duplicate inputs, since that can be
-        done elsewhere.
+        done elsewhere. Signatures are not verified if checkSignatures is
+        false, for when they were verified in bulk beforehand.
         """
-        inputAmounts = 0
-        isCoinbase = len(newTransaction.inputs) == 0 \
-            and len(newTransaction.outputs) == 1
+        return canSpendReferences(
+            newTransaction, self._getReference, checkSignatures)
 
-        for i in range(len(newTransaction.inputs)):
-            tInput = newTransaction.inputs[i]
-            referenced = self._getReference(tInput)
-            if referenced is None:
-                return False, "Referenced UTXO does not exist."
+    def hasUnspentOutputs(self, tx: transaction.Transaction) -> bool:
+        """
+        Returns true if any output of the transaction is unspent.
+        """
+        for i in range(len(tx.outputs)):
+            if (tx.hash, i) in self.utxo:
+                return True
+        return False
 
-            # Verify that the signature is correct
-            isValid, msg = transaction.verifyTransactionInput(
-                referenced, newTransaction, i)
-            if not isValid:
-                return False, msg
+    def revert(
+            self,
+            tx: transaction.Transaction,
+            spent: List[Tuple[Outpoint, transaction.TransactionOutput]]) \
+            -> None:
+        """
+        Reverts the effect of a transaction from a UTXO, given the spent
+        outputs returned when it was spent.
+        If the transaction has not been "spent" yet, then using this method
+        may cause the internal cache to become invalid.
+        """
+        created: List[transaction.TransactionOutput] = []
+        for i in range(len(tx.outputs)):
+            output = self.utxo.pop((tx.hash, i), None)
+            if output is None:
+                raise UTXOException(
+                    "Output of reverted transaction is already spent.")
+            created.append(output)
 
-            inputAmounts += \
-                referenced.outputs[tInput.referencedOutputIndex].amount
+        for outpoint, output in spent:
+            if outpoint in self.utxo:
+                raise UTXOException("Transaction index is already inspent.")
+            self.utxo[outpoint] = output
 
-        outputAmounts = \
-            sum([output.amount for output in newTransaction.outputs])
+        self._indexTransaction(tx.hash, spent, created, False)
 
-        if not isCoinbase and inputAmounts != outputAmounts:
-            return False, "Input amounts to do not match output amounts"
+    def connectBlock(
+            self,
+            transactions: List[transaction.Transaction],
+            verify: bool = True,
+            verifier: SignatureVerifier = None) -> BlockUndo:
+        """
+        Spends all the transactions of a block and returns the undo record
+        for them. If verify is true, each transaction is checked with
+        canSpend first, and a UTXOException is raised if one can not be
+        spent. If a verifier is given, all of the block's signatures are
+        verified concurrently before that. On any error, the block's
+        changes are undone before the exception is raised.
+
+        Blocks that were verified before can be connected again on the
+        same parent with verify set to false.
+        """
+        checkSignatures = True
+        if verify and verifier is not None:
+            checks = self.getSignatureChecks(transactions)
+
+            start = time.perf_counter()
+            isValid = verifier.verifyAll(list(checks.values()))
+            transaction.signatureCache.recordVerification(
+                time.perf_counter() - start, len(checks))
+            if not isValid:
+                raise UTXOException("Signature not valid")
+
+            for txHash, inputIndex in checks:
+                transaction.signatureCache.add(txHash, inputIndex)
+            checkSignatures = False
+
+        undo = BlockUndo()
+        try:
+            for tx in transactions:
+                if verify:
+                    canSpend, msg = self.canSpend(tx, checkSignatures)
+                    if not canSpend:
+                        raise UTXOException(msg)
+
+                undo.spent.extend(self.spend(tx))
+                undo.created.append(
+                    (tx.hash, len(tx.inputs), len(tx.outputs)))
+        except Exception:
+            self.disconnectBlock(undo)
+            raise
+
+        return undo
+
+    def getSignatureChecks(
+            self,
+            transactions: List[transaction.Transaction]) \
+            -> Dict[Tuple[str, int], transaction.SignatureCheck]:
+        """
+        Returns the signature checks for the inputs of a block's
+        transactions, keyed by transaction hash and input index. Inputs can
+        reference the UTXO or an earlier transaction in the same block.
+        Inputs in the signature cache are skipped, as are inputs whose
+        reference can not be found, since canSpend rejects them anyway.
+        """
+        blockTransactions: Dict[str, transaction.Transaction] = {}
+        checks: Dict[Tuple[str, int], transaction.SignatureCheck] = {}
+        for tx in transactions:
+            for i in range(len(tx.inputs)):
+                tInput = tx.inputs[i]
+                referenced = self._getReference(tInput)
+                if referenced is None:
+                    blockTransaction = blockTransactions.get(
+                        tInput.referencedHash, None)
+                    index = tInput.referencedOutputIndex
+                    if blockTransaction is not None and \
+                            0 <= index < len(blockTransaction.outputs):
+                        referenced = blockTransaction.outputs[index]
+
+                if referenced is None:
+                    continue
+
+                if transaction.signatureCache.contains(tx.hash, i):
+                    continue
+
+                checks[(tx.hash, i)] = \
+                    transaction.createSignatureCheck(referenced, tx, i)
+
+            blockTransactions[tx.hash] = tx
+
+        return checks
+
+    def disconnectBlock(self, undo: BlockUndo) -> None:
+        """
+        Reverts the changes recorded in a block's undo record. This is the
+        inverse of connectBlock, and does no verification. Transactions
+        are reverted from the last to the first, since later transactions
+        can spend the outputs of earlier ones.
+        """
+        end = len(undo.spent)
+        for txHash, inputCount, outputCount in reversed(undo.created):
+            created: List[transaction.TransactionOutput] = []
+            for i in range(outputCount):
+                output = self.utxo.pop((txHash, i), None)
+                if output is None:
+                    raise UTXOException(
+                        "Output from disconnected block does not exist.")
+                created.append(output)
+
+            spent = undo.spent[end - inputCount:end]
+            end -= inputCount
+            for outpoint, output in spent:
+                self.utxo[outpoint] = output
+
+            self._indexTransaction(txHash, spent, created, False)
+
+    def getUnspentOutputs(self, address: str) -> List[Outpoint]:
+        """
+        Returns the (transaction hash, output index) pairs of the unspent
+        outputs paying to an address. Requires the address index.
+        """
+        return list(self._getAddressIndex().unspent.get(address, ()))
 
-        return True, ""
+    def getBalance(self, address: str) -> int:
+        """
+        Returns the sum of the unspent outputs paying to an address.
+        Requires the address index.
+        """
+        balance = 0
+        for outpoint in self._getAddressIndex().unspent.get(address, ()):
+            balance += self.utxo[outpoint].amount
+        return balance
 
-    def revert(self, tx: transaction.Transaction):
+    def getHistory(self, address: str) -> List[str]:
         """
-        Reverts the effect of a transaction from a UTXO.
-        If the transaction has not been "spent" yet, then using this method
-        may cause the internal cache to become invalid.
+        Returns the hashes of the transactions that paid to or spent from
+        an address, from the oldest to the newest. Requires the address
+        index.
         """
-        for tInput in tx.inputs:
-            entry = self.utxo.get(tInput.referencedHash, None)
-            if entry is None:
-                raise UTXOException(
-                    "Reference from reverted transaction does not exist.")
+        return list(self._getAddressIndex().history.get(address, ()))
 
-            unspentOutputIndices = cast(Set[int], entry[1])
-            if tInput.referencedOutputIndex in unspentOutputIndices:
-                raise UTXOException("Transaction index is already inspent.")
+    def _getAddressIndex(self) -> AddressIndex:
+        if self.addresses is None:
+            raise UTXOException("Addresses are not indexed.")
+        return self.addresses
 
-            unspentOutputIndices.add(tInput.referencedOutputIndex)
+    def _indexTransaction(
+            self,
+            txHash: str,
+            spent: List[Tuple[Outpoint, transaction.TransactionOutput]],
+            created: List[transaction.TransactionOutput],
+            isConnected: bool) -> None:
+        """
+        Updates the address index for a transaction that is being
+        connected, or disconnected if isConnected is false, given the
+        outputs it spends and creates.
+        """
+        if self.addresses is None:
+            return
 
-        del self.utxo[tx.hash]
+        addresses: List[str] = []
+        for outpoint, output in spent:
+            if isConnected:
+                self.addresses.removeOutput(output.address, outpoint)
+            else:
+                self.addresses.addOutput(output.address, outpoint)
+            addresses.append(output.address)
+
+        for i in range(len(created)):
+            address = created[i].address
+            if isConnected:
+                self.addresses.addOutput(address, (txHash, i))
+            else:
+                self.addresses.removeOutput(address, (txHash, i))
+            addresses.append(address)
+
+        # An address appears once in the history of a transaction, even if
+        # several of its inputs or outputs are for that address.
+        for address in dict.fromkeys(addresses):
+            if isConnected:
+                self.addresses.addHistory(address, txHash)
+            else:
+                self.addresses.removeHistory(address, txHash)
 
     def _getReference(
             self,
             transactionInput: transaction.TransactionInput) \
-            -> transaction.Transaction:
+            -> transaction.TransactionOutput:
         """
-        Gets a referenced transaction from the transaction input.
+        Gets the unspent output referenced by a transaction input.
 
         When spending a transaction input - do NOT use this method.
         This does not update the internal cache of utxo objects. Instead,
         use the spend() method instead.
         """
-        entry = self.utxo.get(transactionInput.referencedHash, None)
-        if entry is None:
-            return None
-
-        tx = entry[0]
-        unspentOutputIndices = cast(Set[int], entry[1])
-
-        if transactionInput.referencedOutputIndex in unspentOutputIndices:
-            return tx
-
-        return None
+        return self.utxo.get(
+            (transactionInput.referencedHash,
+                transactionInput.referencedOutputIndex),
+            None)
 
-    def _spendInput(self, transactionInput: transaction.TransactionInput):
+    def _spendInput(
+            self,
+            transactionInput: transaction.TransactionInput) \
+            -> Tuple[Outpoint, transaction.TransactionOutput]:
         """
         Spends a UTXO. Will update the internal cache.
         """
-        entry = self.utxo.get(transactionInput.referencedHash, None)
-        if entry is None:
-            raise UTXOException("Input can not be spent: Invalid hash.")
-
-        tx = entry[0]
-        unspentOutputIndices = cast(Set[int], entry[1])
-        if transactionInput.referencedOutputIndex in unspentOutputIndices:
-            unspentOutputIndices.remove(transactionInput.referencedOutputIndex)
-        else:
+        outpoint = (
+            transactionInput.referencedHash,
+            transactionInput.referencedOutputIndex)
+        output = self.utxo.pop(outpoint, None)
+        if output is None:
             raise UTXOException(
                 "Input can not be spent: matching " +
                 "hash does not have spendable index.")
 
+        return outpoint, output
+
 
 class Chain:
     def __init__(
-            self, persistentFilename=None) -> None:
-        # Blocks is a mapping from block hash to block objects
+            self,
+            persistentFilename=None,
+            verifier: SignatureVerifier = None,
+            indexAddresses: bool = False,
+            utxoBackend: MutableMapping = None,
+            snapshotFilename: str = None) -> None:
+        # Blocks is a mapping from block hash to block objects. If a
+        # persistent directory is given, the blocks are kept in a block
+        # store there and only their headers are held in memory.
         self.blocks: Dict[str, block.Block] = {}
-
-        # UTXO is a mapping from transaction hash to transaction objects
-        self.utxo = UTXOManager()
+        if persistentFilename is not None:
+            self.blocks = cast(
+                Dict[str, block.Block],
+                BlockMap(BlockStore(persistentFilename)))
+
+        # UTXO is a mapping from outpoints to unspent outputs, kept by the
+        # UTXO backend. If indexAddresses is true, it also indexes them by
+        # address. A backend's existing outputs are kept if they are for a
+        # block of the stored main chain, and rebuilt from the blocks
+        # otherwise.
+        self.utxo = UTXOManager(indexAddresses, utxoBackend)
+
+        # If a signature verifier is given, the signatures of new blocks
+        # are verified concurrently with it.
+        self.verifier = verifier
 
         # The head should always point to the longest and
         # oldest chain.
         self.head = block.genesisBlock()
         self.blocks[self.head.hash] = self.head
 
-        for tx in self.head.transactions:
-            self.utxo.spend(tx)
+        # Windows maps the hash of each chain tip to the timestamps of the
+        # blocks leading up to it, which are used for retargeting.
+        self.windows: Dict[str, DifficultyWindow] = {}
+        self.windows[self.head.hash] = DifficultyWindow([self.head.timestamp])
+
+        # Chain work maps each block hash to the total work of the blocks
+        # from the genesis block up to and including that block. It also
+        # holds the work of blocks that only have a header so far.
+        self.chainWork: Dict[str, int] = {}
+        self.chainWork[self.head.hash] = getWork(self.head.difficulty)
+
+        # Undo maps the hash of every block that has been connected to the
+        # main chain to its undo record. A block with an undo record has
+        # already been verified against the UTXO on its branch. With a
+        # block store, undo records are kept in it next to their blocks.
+        self.undo: Dict[str, BlockUndo] = {}
+        if isinstance(self.blocks, BlockMap):
+            self.undo = cast(Dict[str, BlockUndo], UndoMap(self.blocks))
+
+        # Main chain holds the hash of the main chain's block at each
+        # height, from the genesis block to the head.
+        self.mainChain: List[str] = [self.head.hash]
+
+        # Orphans holds blocks that arrived before their previous block.
+        self.orphans = OrphanPool()
+
+        # Listeners are notified when blocks are connected to or
+        # disconnected from the main chain.
+        self.listeners: List[ChainListener] = []
+
+        # Headers maps the hash of each block whose header was added ahead
+        # of its transactions to the header, until the block is added. The
+        # best header is the tip of the header chain with the most work,
+        # and header windows holds the difficulty windows of header tips.
+        self.headers: Dict[str, block.BlockHeader] = {}
+        self.headerWindows: Dict[str, DifficultyWindow] = {}
+        self.bestHeader = self.head.getHeader()
+
+        # Missing blocks holds the hashes of the best header chain's headers
+        # from the oldest to the newest. Added blocks are only dropped from
+        # the front once they are asked for, which is where they are since
+        # a block is only added after its previous block.
+        self.missingBlocks: "deque[str]" = deque()
+
+        if isinstance(self.blocks, BlockMap):
+            self._loadStoredBlocks(snapshotFilename)
+            self.bestHeader = self.head.getHeader()
+        elif snapshotFilename is not None:
+            raise ChainException("UTXO snapshots require a block store.")
+        else:
+            # Without a block store, the blocks a backend's outputs are
+            # for are gone, so it starts over from the genesis block.
+            self.utxo.clear()
+            self.undo[self.head.hash] = \
+                self.utxo.connectBlock(self.head.transactions, verify=False)
+        self.utxo.blockBoundary(self.head.hash)
+
+    def _loadStoredBlocks(self, snapshotFilename: str = None) -> None:
+        """
+        Restores the chain from the headers in the block store. The chain
+        work of each block is computed from the headers alone, and the UTXO
+        is rebuilt by connecting the blocks of the main chain, which are
+        read from disk one at a time. Blocks with an undo record were
+        verified when they were connected, so they are not verified again.
+        Blocks without one, such as a block stored just before a crash,
+        are verified, and an invalid block is removed along with the
+        blocks built on it.
+
+        If the UTXO backend is already at a block of the main chain, only
+        the blocks after that block are connected. Otherwise, if a snapshot
+        of the UTXO at a block of the main chain is given, the UTXO is
+        loaded from it and only the blocks after that block are connected.
+        The backend is only kept without an address index, since the
+        index is held in memory and is rebuilt from the blocks.
+        """
+        blockMap = cast(BlockMap, self.blocks)
+
+        bestHash = self.head.hash
+        orphaned: List[str] = []
+        for header in blockMap.headers.values():
+            if header.hash in self.chainWork:
+                continue
+
+            parentWork = self.chainWork.get(header.previousHash, None)
+            if parentWork is None:
+                orphaned.append(header.hash)
+                continue
+
+            work = parentWork + getWork(header.difficulty)
+            self.chainWork[header.hash] = work
+            if work > self.chainWork[bestHash]:
+                bestHash = header.hash
+
+        # Blocks whose parent was removed as invalid can not be connected.
+        for blockHash in orphaned:
+            del blockMap[blockHash]
+
+        headerChain = blockMap.getHeaderChain(bestHash)
+        start = 0
+        if self.utxo.addresses is None:
+            start = self._getResumeHeight(headerChain)
+        if start == 0 and snapshotFilename is not None and \
+                os.path.exists(snapshotFilename):
+            start = self._loadSnapshot(snapshotFilename, headerChain)
+        if start == 0:
+            self.utxo.clear()
+
+        for height in range(start, len(headerChain)):
+            header = headerChain[height]
+            storedBlock = self.blocks[header.hash]
+            try:
+                self.undo[header.hash] = self.utxo.connectBlock(
+                    storedBlock.transactions,
+                    verify=height > 0 and header.hash not in self.undo,
+                    verifier=self.verifier)
+            except Exception:
+                self._removeStoredBranch(header.hash)
+                headerChain = headerChain[:height]
+                break
+            self.utxo.blockBoundary(header.hash)
+
+        self.head = self.blocks[headerChain[-1].hash]
+        self.mainChain = [header.hash for header in headerChain]
+
+        # If an invalid block was removed, another branch may now have the
+        # most work. Moving to it verifies its blocks, and removes them if
+        # they are invalid too.
+        while True:
+            bestHash = max(blockMap.headers, key=self.chainWork.__getitem__)
+            if self.chainWork[bestHash] <= self.chainWork[self.head.hash]:
+                break
+            try:
+                self._updateUTXOAndHead(self.blocks[bestHash])
+            except ChainException:
+                continue
+
+    def _removeStoredBranch(self, blockHash: str) -> None:
+        """
+        Removes an invalid stored block and every stored block built on it
+        while the chain is being restored.
+        """
+        blockMap = cast(BlockMap, self.blocks)
+
+        # Blocks are stored after their previous block, so a single pass in
+        # the order they were stored finds every descendant.
+        removed = {blockHash}
+        for header in list(blockMap.headers.values()):
+            if header.previousHash in removed:
+                removed.add(header.hash)
+
+        for removedHash in removed:
+            del blockMap[removedHash]
+            self.chainWork.pop(removedHash, None)
+
+    def _getResumeHeight(self, headerChain: List[StoredHeader]) -> int:
+        """
+        Returns the height of the first block to connect after the block
+        the UTXO backend is at, or 0 if the backend is not at a block of
+        the main chain.
+        """
+        bestBlock = self.utxo.getBestBlock()
+        header = cast(BlockMap, self.blocks).headers.get(bestBlock, None)
+        if header is None or header.index >= len(headerChain) or \
+                headerChain[header.index].hash != bestBlock:
+            return 0
+
+        return header.index + 1
+
+    def _loadSnapshot(
+            self,
+            snapshotFilename: str,
+            headerChain: List[StoredHeader]) -> int:
+        """
+        Loads the UTXO from a snapshot if it is for a block of the main
+        chain, returning the height of the first block to connect after
+        it. A snapshot that is invalid or for another chain is ignored,
+        and 0 is returned so that every block is connected instead.
+        """
+        try:
+            blockHash, blockIndex, outputs = readSnapshot(snapshotFilename)
+        except SnapshotException:
+            return 0
+
+        if blockIndex >= len(headerChain) or \
+                headerChain[blockIndex].hash != blockHash:
+            return 0
+
+        # Blocks up to the snapshot that were never connected here have no
+        # undo records, so the main chain can not be reorganized past them.
+        # Malformed outputs are only found while loading, in which case the
+        # outputs loaded so far are cleared by the caller.
+        try:
+            self.utxo.loadOutputs(outputs)
+        except SnapshotException:
+            return 0
+        return blockIndex + 1
+
+    def writeSnapshot(self, snapshotFilename: str) -> None:
+        """
+        Writes a snapshot of the UTXO at the head of the chain.
+        """
+        writeSnapshot(
+            self.utxo.utxo, self.head.hash, self.head.index, snapshotFilename)
+
+    def close(self) -> None:
+        """
+        Closes the block store, if the chain has one, and the UTXO
+        backend.
+        """
+        if isinstance(self.blocks, BlockMap):
+            self.blocks.close()
+        self.utxo.close()
+
+    def addListener(self, listener: ChainListener) -> None:
+        self.listeners.append(listener)
+
+    def removeListener(self, listener: ChainListener) -> None:
+        self.listeners.remove(listener)
 
     def addBlock(self, nextBlock: block.Block) -> None:
         """
         Adds a single block to the chain.
+
+        If the block's previous block is not in the chain, the block is
+        kept in the orphan pool and an OrphanBlockException is raised.
+        Once a block is added, the orphans waiting for it, and in turn the
+        orphans waiting for those, are added as well.
         """
+        self._addBlockAndOrphans(nextBlock)
+
+    def _addBlockAndOrphans(self, nextBlock: block.Block) -> List[str]:
+        """
+        Adds a block and then the orphans waiting for it, returning the
+        hashes of every block that was added.
+        """
+        self._addBlock(nextBlock)
+        added = [nextBlock.hash]
+
+        # Orphans are connected with a stack instead of recursion, so a
+        # long run of orphans does not exhaust the recursion limit.
+        parents = [nextBlock.hash]
+        while len(parents) > 0:
+            for orphan in self.orphans.popChildren(parents.pop()):
+                try:
+                    self._addBlock(orphan)
+                except ChainException:
+                    continue
+                added.append(orphan.hash)
+                parents.append(orphan.hash)
+
+        return added
+
+    def _addBlock(self, nextBlock: block.Block) -> None:
         if nextBlock.hash in self.blocks:
             raise DuplicateBlockException(
                 "Duplicate block found when adding to chain.")
 
         previousBlock = self.getPreviousBlock(nextBlock)
         if previousBlock is None:
-            raise NoParentException(
+            # The difficulty changes by at most a bit per block, so blocks
+            # shortly after the head have about the head's difficulty.
+            minDifficulty = max(
+                MIN_DIFFICULTY,
+                self.head.difficulty - ORPHAN_DIFFICULTY_MARGIN)
+            if not self.orphans.add(nextBlock, minDifficulty=minDifficulty):
+                raise ChainException(
+                    "Orphan block does not have a valid proof of work.")
+            raise OrphanBlockException(
                 "New block's previous block is not in the current chain.")
 
-        isVerified, msg = verifyNextBlock(previousBlock, nextBlock)
+        window = self._getWindow(previousBlock)
+        isVerified, msg = verifyNextBlock(
+            previousBlock,
+            nextBlock,
+            window.nextDifficulty(
+                previousBlock.difficulty, previousBlock.index + 1),
+            window.medianTime())
         if not isVerified:
             raise ChainException(
                 "New block could not be verified." +
                 "\n" + "Message: " + msg)
 
         # Creates a new fork in the chain if the next block's previous block
-        # does exists in the current chain.
-        self.blocks[nextBlock.hash] = nextBlock
-
-        if nextBlock.index > self.head.index:
-            self._updateUTXOAndHead(nextBlock)
-
+        # does exists in the current chain. A block that becomes the head
+        # is only kept once it has been connected.
+        self.headers.pop(nextBlock.hash, None)
+        self._extendWindow(previousBlock, nextBlock)
+        self.chainWork[nextBlock.hash] = \
+            self.chainWork[previousBlock.hash] + getWork(nextBlock.difficulty)
+        if self.chainWork[nextBlock.hash] > \
+                self.chainWork[self.bestHeader.hash]:
+            self._setBestHeader(nextBlock.getHeader())
+
+        # The head moves to the fork with the most work. Ties are kept by
+        # the block that was seen first.
+        if self.chainWork[nextBlock.hash] > self.chainWork[self.head.hash]:
+            try:
+                self._updateUTXOAndHead(nextBlock)
+            finally:
+                self.utxo.blockBoundary(self.head.hash)
+        else:
+            self.blocks[nextBlock.hash] = nextBlock
 
     def _updateUTXOAndHead(self, nextBlock):
         """
-        Updated the UTXO for a block being added to the the end of the chain
-        of the main chain.
+        Updated the UTXO for a block that has more cumulative work than
+        the current head.
 
-        When a fork becomes the main chain, the UTXO from the current main chain
-        are reverted and the new forks outputs are spent.
+        When a fork becomes the main chain, the blocks from the current main
+        chain are disconnected with their undo records and the new fork's
+        blocks are connected.
         """
-        if nextBlock.index != self.head.index + 1:
-            raise ChainException("Block added to block chain index is invalid")
+        if self.chainWork[nextBlock.hash] <= self.chainWork[self.head.hash]:
+            raise ChainException("Block added does not have the most work")
 
+        self._reorganize(nextBlock)
+
+    def _reorganize(self, newHead: block.Block) -> None:
+        """
+        Moves the head to another block, disconnecting the blocks of the
+        current main chain back to the last block both share and connecting
+        the new head's blocks after it.
+        """
         # Handle the fork in the rare case where the forked chain becomes
-        # the main chain.
+        # the main chain. Since the fork is chosen by work instead of
+        # length, either branch can be longer than the other.
         oldChain: List[block.Block] = []
         newChain: List[block.Block] = []
-        newChain.append(nextBlock)
 
         oldParent = self.head
-        newParent = self.getPreviousBlock(nextBlock)
+        newParent = newHead
         while oldParent.hash != newParent.hash:
-            for tx in reversed(oldParent.transactions):
-                self.utxo.revert(tx)
+            if oldParent.index >= newParent.index:
+                oldChain.append(oldParent)
+                oldParent = self.getPreviousBlock(oldParent)
+            else:
+                newChain.append(newParent)
+                newParent = self.getPreviousBlock(newParent)
+
+        # Blocks connected before the UTXO was loaded from a snapshot have
+        # no undo records, so they can not be disconnected. The new block
+        # is removed so that the fork does not become the head later.
+        for oldBlock in oldChain:
+            if oldBlock.hash not in self.undo:
+                self._removeBlock(newHead.hash)
+                raise ChainException(
+                    "Can not disconnect blocks from before the UTXO snapshot.")
+
+        # Disconnecting the old branch and reconnecting blocks that were
+        # connected before only replays their undo records. Only blocks
+        # that have never been connected are verified.
+        for oldBlock in oldChain:
+            self.utxo.disconnectBlock(self.undo[oldBlock.hash])
+
+        connected: List[BlockUndo] = []
+        for i in range(len(newChain) - 1, -1, -1):
+            newBlock = newChain[i]
+            try:
+                connected.append(self.utxo.connectBlock(
+                    newBlock.transactions,
+                    verify=newBlock.hash not in self.undo,
+                    verifier=self.verifier))
+            except Exception as e:
+                # An invalid transaction was found. This means that
+                # the new blocks need to be disconnected, the invalid
+                # block deleted and the old ones connected again.
+                for undo in reversed(connected):
+                    self.utxo.disconnectBlock(undo)
+
+                # Delete the children blocks from the invalid block
+                # as well as the invalid block itself from the chain.
+                for k in range(i, -1, -1):
+                    self._removeBlock(newChain[k].hash)
+
+                for oldBlock in reversed(oldChain):
+                    self.undo[oldBlock.hash] = self.utxo.connectBlock(
+                        oldBlock.transactions, verify=False)
+
+                if isinstance(e, ChainException):
+                    raise
+                raise ChainException(
+                    "New block could not be connected." +
+                    "\n" + "Message: " + repr(e)) from e
+
+        # The new head is only stored now that its branch is connected.
+        for newBlock, undo in zip(reversed(newChain), connected):
+            self.blocks[newBlock.hash] = newBlock
+            self.undo[newBlock.hash] = undo
+
+        self.head = newHead
+        del self.mainChain[newParent.index + 1:]
+        self.mainChain.extend(newBlock.hash for newBlock in reversed(newChain))
+
+        for listener in self.listeners:
+            for oldBlock in reversed(oldChain):
+                listener.blockDisconnected(oldBlock)
+            for newBlock in reversed(newChain):
+                listener.blockConnected(newBlock)
+
+    def addHeader(self, nextHeader: block.BlockHeader) -> None:
+        """
+        Adds the header of a block ahead of its transactions. The header
+        is verified for its linkage and proof of work like a block, and
+        the best header moves to the header chain with the most work. The
+        main chain only changes once the blocks themselves are added.
+        """
+        if nextHeader.hash in self.headers or nextHeader.hash in self.blocks:
+            raise DuplicateBlockException(
+                "Duplicate header found when adding to chain.")
 
-            oldChain.append(oldParent)
-            newChain.append(newParent)
+        previousHeader = self.getPreviousHeader(nextHeader)
+        if previousHeader is None:
+            raise NoParentException(
+                "New header's previous header is not in the current chain.")
+
+        isVerified, msg = extendHeaderChain(
+            previousHeader,
+            nextHeader,
+            self.headerWindows,
+            self.chainWork,
+            self.getPreviousHeader)
+        if not isVerified:
+            raise ChainException(
+                "New header could not be verified." +
+                "\n" + "Message: " + msg)
 
-            oldParent = self.getPreviousBlock(oldParent)
-            newParent = self.getPreviousBlock(newParent)
+        self.headers[nextHeader.hash] = nextHeader
+        if self.chainWork[nextHeader.hash] > \
+                self.chainWork[self.bestHeader.hash]:
+            self._setBestHeader(nextHeader)
 
-        for i in range(len(newChain) - 1, -1, -1):
-            transactions = newChain[i].transactions
-            for j in range(len(transactions)):
-                tx = transactions[j]
-                canSpend, msg = self.utxo.canSpend(tx)
-                if canSpend:
-                    self.utxo.spend(tx)
-                else:
-                    # An invalid transaction was found. This means that
-                    # all the new transactions need to be reverted,
-                    # the old ones respent, and the invalid block deleted.
-
-                    # Revert the transactions just added from the current block.
-                    for txIndex in range(j - 1, -1, -1):
-                        self.utxo.revert(transactions[txIndex])
-                    
-                    # Revert the transacation from the blocks added earlier.
-                    for blockIndex in range(i + 1, len(newChain)):
-                        for tx in reversed(newChain[blockIndex].transactions):
-                            self.utxo.revert(tx)
-                    
-                    # Delete the children blocks from the invalid block
-                    # as well as the :nvalid block itself from the chain.
-                    for k in range(i, -1, -1):
-                        del self.blocks[newChain[k].hash]
-                    
-                    for oldBlock in reversed(oldChain):
-                        for tx in reversed(oldBlock.transactions):
-                            self.utxo.spend(tx)
-                    
-                    raise UTXOException(msg)
-
-        # If the new block increases the length of the current chain, then have
-        # head point to this block. The verifyNextBlock method should check 
-        # that the new index is not out too large.
-        self.head = nextBlock
+    def addHeaders(self, newHeaders: List[block.BlockHeader]) -> None:
+        """
+        Adds a list of headers in the order of appearance in the list.
+        Headers that were already added are skipped.
+        """
+        for newHeader in newHeaders:
+            if newHeader.hash in self.headers or \
+                    newHeader.hash in self.blocks:
+                continue
+            self.addHeader(newHeader)
 
+    def getMissingBlocks(self, n: int = -1) -> List[str]:
+        """
+        Returns the hashes of the blocks of the best header chain that have
+        not been added yet, from the oldest to the newest. If n is not
+        negative, at most n hashes are returned. Blocks that are waiting
+        in the orphan pool are not returned.
+
+        The blocks can be downloaded in parallel and added in any order,
+        since blocks that arrive before their previous block are connected
+        from the orphan pool once it is added.
+        """
+        while len(self.missingBlocks) > 0 and \
+                self.missingBlocks[0] not in self.headers:
+            self.missingBlocks.popleft()
+
+        missing: List[str] = []
+        for blockHash in self.missingBlocks:
+            if 0 <= n <= len(missing):
+                break
+            if blockHash in self.headers and blockHash not in self.orphans:
+                missing.append(blockHash)
+        return missing
+
+    def _setBestHeader(self, header: block.BlockHeader) -> None:
+        """
+        Moves the best header, extending the missing blocks if the header
+        follows the previous best header, and finding them again by walking
+        back from the header if the best header chain changed.
+        """
+        if header.previousHash == self.bestHeader.hash and \
+                header.hash in self.headers:
+            self.missingBlocks.append(header.hash)
+        else:
+            missing: List[str] = []
+            current = self.headers.get(header.hash, None)
+            while current is not None:
+                missing.append(current.hash)
+                current = self.headers.get(current.previousHash, None)
+            missing.reverse()
+            self.missingBlocks = deque(missing)
+
+        self.bestHeader = header
+
+    def getLocator(self) -> List[str]:
+        return getLocator(self.mainChain)
+
+    def getHeadersAfter(
+            self,
+            locator: List[str],
+            n: int = -1) -> List[block.BlockHeader]:
+        """
+        Returns the main chain's headers after the first block of the
+        locator that is in the main chain, or after the genesis block if
+        there is none, oldest first. If n is not negative, at most n
+        headers are returned.
+        """
+        start = 1
+        for blockHash in locator:
+            if blockHash in self.blocks and \
+                    self.isInMainChain(self.blocks[blockHash]):
+                start = self.blocks[blockHash].index + 1
+                break
+
+        end = len(self.mainChain) if n < 0 else start + n
+        return [
+            self.blocks[blockHash].getHeader()
+            for blockHash in self.mainChain[start:end]
+        ]
 
     def addBlocks(self, newBlocks: List[block.Block]) -> None:
         """
-        Adds. a list of blocks to the chain. They will be applied in
+        Adds a list of blocks to the chain. They will be applied in
         the order of appearance in the list. In the case where the list
-        is corrupt, the blocks will be removed from the chain.
+        is corrupt, the head is moved back to where it was with the undo
+        records of the connected blocks, and the blocks added from the
+        list, along with any orphans added after them, are removed.
         """
-        for i in range(len(newBlocks)):
-            newBlock = newBlocks[i]
+        originalHead = self.head
+        added: List[str] = []
+        for newBlock in newBlocks:
             try:
-                self.addBlock(newBlock)
-            except ChainException as e:
-                for j in range(i):
-                    del self.blocks[newBlocks[i].hash]
-                raise e
+                added.extend(self._addBlockAndOrphans(newBlock))
+            except ChainException:
+                if self.head.hash != originalHead.hash:
+                    try:
+                        self._reorganize(originalHead)
+                    finally:
+                        self.utxo.blockBoundary(self.head.hash)
+
+                for blockHash in reversed(added):
+                    self._removeBlock(blockHash)
+                raise
 
     def getChildren(self, parent: block.Block) -> List[block.Block]:
         """
@@ -291,15 +1160,8 @@ class Chain:
         if parent.index < 0:
             raise ChainException("Parent index is negative.")
 
-        children: List[block.Block]
-        children = []
-        child = self.head
-        while child.index > 0 and parent.hash != child.hash:
-            children.append(child)
-            child = self.getPreviousBlock(child)
-
-        children.reverse()
-        return children
+        start = parent.index + 1 if self.isInMainChain(parent) else 1
+        return [self.blocks[blockHash] for blockHash in self.mainChain[start:]]
 
     def getAncestors(self, child: block.Block, n=-1) -> List[block.Block]:
         """
@@ -313,7 +1175,9 @@ class Chain:
         if n == 0:
             return longestChain
 
-        while n != 0 and child.index > 0:
+        # Blocks off the main chain are walked back until the main chain
+        # is reached, after which the height index is used.
+        while n != 0 and child.index > 0 and not self.isInMainChain(child):
             longestChain.append(child)
 
             child = self.getPreviousBlock(child)
@@ -322,8 +1186,28 @@ class Chain:
                     "Ancestors of block do not exist in chain")
             n -= 1
 
+        if n != 0 and child.index > 0:
+            start = 1 if n < 0 else max(1, child.index - n + 1)
+            for height in range(child.index, start - 1, -1):
+                longestChain.append(self.blocks[self.mainChain[height]])
+
         return longestChain
 
+    def getBlockAtHeight(self, height: int) -> block.Block:
+        """
+        Returns the main chain's block at a height, or None if the main
+        chain is not that long.
+        """
+        if height < 0 or height >= len(self.mainChain):
+            return None
+
+        return self.blocks[self.mainChain[height]]
+
+    def isInMainChain(self, currentBlock: block.Block) -> bool:
+        height = currentBlock.index
+        return 0 <= height < len(self.mainChain) and \
+            self.mainChain[height] == currentBlock.hash
+
     def getPreviousBlock(self, currentBlock: block.Block) -> block.Block:
         """
         Returns the previous block if it is in the chain
@@ -334,38 +1218,292 @@ class Chain:
 
         return None
 
+    def getPreviousHeader(
+            self,
+            currentHeader: Union[block.Block, block.BlockHeader]) \
+            -> block.BlockHeader:
+        """
+        Returns the previous header, whether or not its block was added,
+        if it is in the chain.
+        """
+        previousHash = currentHeader.previousHash
+        previousHeader = self.headers.get(previousHash, None)
+        if previousHeader is None and previousHash in self.blocks:
+            previousHeader = self.blocks[previousHash].getHeader()
+
+        return previousHeader
+
+    def getNextDifficulty(self, previousBlock: block.Block) -> int:
+        """
+        Returns the difficulty required for a block added after the
+        previous block.
+        """
+        return self._getWindow(previousBlock).nextDifficulty(
+            previousBlock.difficulty, previousBlock.index + 1)
+
+    def _getWindow(self, previousBlock: block.Block) -> DifficultyWindow:
+        """
+        Returns the difficulty window ending at a block, building it from
+        the block's ancestors if the block is not a tip.
+        """
+        window = self.windows.get(previousBlock.hash, None)
+        if window is None:
+            window = self._buildWindow(previousBlock)
+        return window
+
+    def _extendWindow(
+            self,
+            previousBlock: block.Block,
+            nextBlock: block.Block) -> None:
+        """
+        Moves the difficulty window of the previous block to the next block,
+        which is the new tip. If the previous block was not a tip, then the
+        next block starts a fork and gets its own window.
+        """
+        window = self.windows.pop(previousBlock.hash, None)
+        if window is None:
+            window = self._buildWindow(previousBlock)
+
+        window.push(nextBlock.timestamp)
+        self.windows[nextBlock.hash] = window
+
+    def _buildWindow(self, tip: block.Block) -> DifficultyWindow:
+        return buildWindow(tip, self.getPreviousBlock)
+
+    def _removeBlock(self, blockHash: str) -> None:
+        """
+        Removes an invalid block from the chain.
+        """
+        if blockHash in self.blocks:
+            del self.blocks[blockHash]
+        self.windows.pop(blockHash, None)
+        self.chainWork.pop(blockHash, None)
+        self.undo.pop(blockHash, None)
+        self._removeHeaders(blockHash)
+
+    def _removeHeaders(self, blockHash: str) -> None:
+        """
+        Removes the headers that build on a removed block, and moves the
+        best header back to the remaining header chain with the most work.
+        """
+        removed = {blockHash}
+        self.headers.pop(blockHash, None)
+        self.headerWindows.pop(blockHash, None)
+
+        # Headers are only added after their previous header, so a single
+        # pass in insertion order finds every descendant.
+        for header in list(self.headers.values()):
+            if header.previousHash in removed:
+                removed.add(header.hash)
+                del self.headers[header.hash]
+                self.headerWindows.pop(header.hash, None)
+                self.chainWork.pop(header.hash, None)
+
+        if self.bestHeader.hash not in removed:
+            return
+
+        bestHeader = self.head.getHeader()
+        for header in self.headers.values():
+            if self.chainWork[header.hash] > \
+                    self.chainWork[bestHeader.hash]:
+                bestHeader = header
+        self._setBestHeader(bestHeader)
+
+
+def canSpendReferences(
+        newTransaction: transaction.Transaction,
+        getReference: Callable[
+            [transaction.TransactionInput], transaction.TransactionOutput],
+        checkSignatures: bool = True) -> Tuple[bool, str]:
+    """
+    Verifies if a transaction can be spent, given a function returning the
+    unspent output referenced by an input or None if there is none. This
+    lets views of the UTXO, such as one with pending transactions, share
+    the checks of UTXOManager.canSpend.
+    """
+    inputAmounts = 0
+    isCoinbase = len(newTransaction.inputs) == 0 \
+        and len(newTransaction.outputs) == 1
+
+    for i in range(len(newTransaction.inputs)):
+        tInput = newTransaction.inputs[i]
+        referenced = getReference(tInput)
+        if referenced is None:
+            return False, "Referenced UTXO does not exist."
+
+        # Verify that the signature is correct
+        if checkSignatures:
+            isValid, msg = transaction.verifyInputSignature(
+                referenced, newTransaction, i)
+            if not isValid:
+                return False, msg
+
+        inputAmounts += referenced.amount
+
+    outputAmounts = \
+        sum([output.amount for output in newTransaction.outputs])
+
+    if not isCoinbase and inputAmounts != outputAmounts:
+        return False, "Input amounts to do not match output amounts"
+
+    return True, ""
+
+
+def buildWindow(
+        tip: Header,
+        getPrevious: Callable[[Header], Optional[Header]]) \
+        -> DifficultyWindow:
+    """
+    Builds the difficulty window for a block that is not a tip by walking
+    back at most RETARGET_WINDOW blocks with getPrevious.
+    """
+    timestamps: List[float] = []
+    current: Optional[Header] = tip
+    while current is not None and len(timestamps) < RETARGET_WINDOW:
+        timestamps.append(current.timestamp)
+        current = getPrevious(current)
+
+    timestamps.reverse()
+    return DifficultyWindow(timestamps)
+
+
+def extendHeaderChain(
+        previousHeader: Header,
+        nextHeader: Header,
+        windows: Dict[str, DifficultyWindow],
+        chainWork: Dict[str, int],
+        getPrevious: Callable[[Header], Optional[Header]]) \
+        -> Tuple[bool, str]:
+    """
+    Verifies a header following a previous one against the difficulty
+    window of the previous header, which is built with getPrevious if it
+    is not a tip. If it is valid, the window moves to the new header and
+    its cumulative work is recorded. This is shared by full chains and SPV
+    clients, so both follow the same difficulty and timestamp rules.
+    """
+    window = windows.pop(previousHeader.hash, None)
+    if window is None:
+        window = buildWindow(previousHeader, getPrevious)
+
+    isVerified, msg = verifyNextHeader(
+        previousHeader,
+        nextHeader,
+        window.nextDifficulty(
+            previousHeader.difficulty, previousHeader.index + 1),
+        window.medianTime())
+    if not isVerified:
+        windows[previousHeader.hash] = window
+        return False, msg
+
+    window.push(nextHeader.timestamp)
+    windows[nextHeader.hash] = window
+    chainWork[nextHeader.hash] = \
+        chainWork[previousHeader.hash] + getWork(nextHeader.difficulty)
+    return True, ""
+
+
+def getLocator(mainChain: List[str]) -> List[str]:
+    """
+    Returns hashes of a main chain going back from its head, dense near the
+    head and exponentially further apart towards the genesis block, which
+    is always last. Another node finds the last block both chains share
+    from the first of these hashes that is in its own main chain.
+    """
+    locator: List[str] = []
+    height = len(mainChain) - 1
+    step = 1
+    while height > 0 and len(locator) < MAX_LOCATOR_HASHES - 1:
+        locator.append(mainChain[height])
+        if len(locator) >= 10:
+            step *= 2
+        height -= step
+
+    locator.append(mainChain[0])
+    return locator
+
 
 def verifyNextBlock(
         previousBlock: block.Block,
-        nextBlock: block.Block) -> Tuple[bool, str]:
+        nextBlock: block.Block,
+        difficulty: int,
+        medianTime: float,
+        now: float = None) -> Tuple[bool, str]:
     """
     Verifies whether a block can syntactically can be added to the chain.
     Once a block is added to the chain with this method called, the only
     remaining check is the "canSpend" method in the UTXO.
+
+    The difficulty is the expected difficulty of the next block, and the
+    median time is the median timestamp of the difficulty window, which
+    are both computed by the chain from the previous blocks.
+    """
+    isVerified, msg = verifyNextHeader(
+        previousBlock, nextBlock, difficulty, medianTime, now)
+    if not isVerified:
+        return isVerified, msg
+
+    transactionsRoot = block.hashTransactions(nextBlock.transactions)
+    if transactionsRoot != nextBlock.transactionsRoot:
+        return False, "Invalid transaction root. Current {}, Expected {}" \
+            .format(nextBlock.transactionsRoot, transactionsRoot)
+
+    return verifyTransactionsSyntax(nextBlock.transactions)
+
+
+def verifyNextHeader(
+        previousHeader: Union[block.Block, block.BlockHeader],
+        nextHeader: Union[block.Block, block.BlockHeader],
+        difficulty: int,
+        medianTime: float,
+        now: float = None) -> Tuple[bool, str]:
+    """
+    Verifies whether a header can follow the previous header, which
+    checks its index, previous hash, hash, timestamp, difficulty and proof
+    of work. The transactions are committed to by the transaction root,
+    so they are not needed.
+
+    The timestamp must be after the median time of the difficulty window
+    and at most MAX_FUTURE_BLOCK_TIME seconds after now, which defaults to
+    the current time.
     """
-    if nextBlock.index != previousBlock.index + 1:
+    if now is None:
+        now = time.time()
+
+    if nextHeader.index != previousHeader.index + 1:
         return False, "Invalid index. Current: {}, Next {}".format(
-            previousBlock.index, nextBlock.index)
+            previousHeader.index, nextHeader.index)
 
-    if nextBlock.previousHash != previousBlock.hash:
+    if nextHeader.previousHash != previousHeader.hash:
         return False, "Invalid previous hash. Current {}, Next {}".format(
-            previousBlock.hash, nextBlock.previousHash)
+            previousHeader.hash, nextHeader.previousHash)
 
-    nextHash = block.hashBlock(
-        index=previousBlock.index + 1,
-        timestamp=nextBlock.timestamp,
-        transactions=nextBlock.transactions,
-        noonce=nextBlock.noonce,
-        previousHash=previousBlock.hash)
+    nextHash = block.hashHeader(
+        index=previousHeader.index + 1,
+        timestamp=nextHeader.timestamp,
+        transactionsRoot=nextHeader.transactionsRoot,
+        noonce=nextHeader.noonce,
+        previousHash=previousHeader.hash)
 
-    if nextHash != nextBlock.hash:
+    if nextHash != nextHeader.hash:
         return False, "Invalid block hash. Current {}, Expected {}".format(
-            nextBlock.hash, nextHash)
+            nextHeader.hash, nextHash)
+
+    if nextHeader.timestamp <= medianTime:
+        return False, "Timestamp {} is not after the median time {}".format(
+            nextHeader.timestamp, medianTime)
 
-    if not hasProofOfWork(nextBlock.hash):
+    if nextHeader.timestamp > now + MAX_FUTURE_BLOCK_TIME:
+        return False, "Timestamp {} is too far in the future.".format(
+            nextHeader.timestamp)
+
+    if nextHeader.difficulty != difficulty:
+        return False, "Invalid difficulty. Current {}, Expected {}".format(
+            nextHeader.difficulty, difficulty)
+
+    if not hasProofOfWork(nextHeader.hash, nextHeader.difficulty):
         return False, "Block does not have a valid proof of work."
 
-    return verifyTransactionsSyntax(nextBlock.transactions)
+    return True, ""
 
 
 def verifyTransactionsSyntax(
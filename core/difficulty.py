@@ -0,0 +1,85 @@
+import math
+from collections import deque
+from typing import Iterable
+
+from core.settings import MAX_RETARGET_BITS, MIN_DIFFICULTY, RETARGET_WINDOW
+from core.settings import TARGET_BLOCK_INTERVAL
+
+
+class DifficultyWindow:
+    """
+    A rolling window over the timestamps of the last RETARGET_WINDOW
+    blocks ending at a chain tip.
+
+    Extending a tip by one block pushes a single timestamp, so the next
+    difficulty can be computed in constant time without walking back
+    through the block's ancestors.
+    """
+    def __init__(self, timestamps: Iterable[float] = ()) -> None:
+        self.timestamps = deque(timestamps, maxlen=RETARGET_WINDOW)
+
+    def push(self, timestamp: float) -> None:
+        """
+        Adds the timestamp of a new tip, dropping the oldest one once the
+        window is full.
+        """
+        self.timestamps.append(timestamp)
+
+    def copy(self) -> "DifficultyWindow":
+        return DifficultyWindow(self.timestamps)
+
+    def medianTime(self) -> float:
+        """
+        Returns the median of the window's timestamps. A block must have a
+        later timestamp than this, so that timestamps can only be moved
+        back by a few blocks and can not be used to lower the difficulty.
+        """
+        timestamps = sorted(self.timestamps)
+        return timestamps[len(timestamps) // 2]
+
+    def nextDifficulty(self, difficulty: int, index: int) -> int:
+        """
+        Returns the difficulty of the block at the given index following
+        the window's tip, given the difficulty of the tip itself. The
+        difficulty only changes at every RETARGET_WINDOW-th block, so the
+        window only measures blocks mined at the current difficulty.
+        """
+        if index % RETARGET_WINDOW != 0 or \
+                len(self.timestamps) < RETARGET_WINDOW:
+            return difficulty
+
+        return retarget(
+            difficulty,
+            self.timestamps[0],
+            self.timestamps[-1],
+            len(self.timestamps) - 1)
+
+
+def getWork(difficulty: int) -> int:
+    """
+    Returns the expected number of hashes needed to mine a block with
+    the given difficulty.
+    """
+    return 1 << difficulty
+
+
+def retarget(
+        difficulty: int,
+        firstTimestamp: float,
+        lastTimestamp: float,
+        intervals: int) -> int:
+    """
+    Adjusts the difficulty by the whole number of bits (each twice or half
+    the work) that the given block intervals were shorter or longer than
+    TARGET_BLOCK_INTERVAL, at most MAX_RETARGET_BITS. Intervals less than
+    twice as short or as long as the target keep the difficulty.
+    """
+    expected = TARGET_BLOCK_INTERVAL * intervals
+    actual = lastTimestamp - firstTimestamp
+    if actual <= 0:
+        change = MAX_RETARGET_BITS
+    else:
+        change = int(math.log2(expected / actual))
+        change = max(-MAX_RETARGET_BITS, min(MAX_RETARGET_BITS, change))
+
+    return max(MIN_DIFFICULTY, difficulty + change)
@@ -0,0 +1,131 @@
+import struct
+from typing import Tuple, Union
+
+# Version of the binary format written by Block.asBytes and
+# Transaction.asBytes.
+SERIALIZATION_VERSION = 1
+
+DOUBLE = struct.Struct("<d")
+
+# Tags for numbers that may be either integers or floats, such as
+# timestamps. The type matters since it changes the hashed string.
+NUMBER_INT = 0
+NUMBER_FLOAT = 1
+
+
+class DecodeException(ValueError):
+    """
+    Raised when binary data is truncated or malformed.
+    """
+
+
+def writeVarint(buffer: bytearray, value: int) -> None:
+    """
+    Appends an unsigned integer using 7 bits per byte, with the high bit
+    set on every byte except the last.
+    """
+    if value < 0:
+        raise ValueError("Varints can not be negative: {}".format(value))
+
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def readVarint(data: bytes, offset: int) -> Tuple[int, int]:
+    """
+    Reads an unsigned varint. Returns the value and the offset after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise DecodeException("Varint is truncated.")
+
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def writeBytes(buffer: bytearray, value: bytes) -> None:
+    """
+    Appends a varint length followed by the bytes.
+    """
+    writeVarint(buffer, len(value))
+    buffer += value
+
+
+def readBytes(data: bytes, offset: int) -> Tuple[bytes, int]:
+    length, offset = readVarint(data, offset)
+    end = offset + length
+    if end > len(data):
+        raise DecodeException("Byte string is truncated.")
+    return data[offset:end], end
+
+
+def writeHex(buffer: bytearray, value: str) -> None:
+    """
+    Appends a lowercase hex string (hashes, keys and signatures) as the
+    raw bytes it represents.
+    """
+    raw = bytes.fromhex(value)
+    if raw.hex() != value:
+        raise ValueError("Not a lowercase hex string: {}".format(value))
+    writeBytes(buffer, raw)
+
+
+def readHex(data: bytes, offset: int) -> Tuple[str, int]:
+    raw, offset = readBytes(data, offset)
+    return raw.hex(), offset
+
+
+def writeNumber(buffer: bytearray, value: Union[int, float]) -> None:
+    """
+    Appends an integer as a tagged zigzag varint, or a float as a tagged
+    8 byte double.
+    """
+    if isinstance(value, int):
+        buffer.append(NUMBER_INT)
+        writeVarint(buffer, (value << 1) if value >= 0 else (-value << 1) - 1)
+    else:
+        buffer.append(NUMBER_FLOAT)
+        buffer += DOUBLE.pack(value)
+
+
+def readNumber(data: bytes, offset: int) -> Tuple[Union[int, float], int]:
+    if offset >= len(data):
+        raise DecodeException("Number is truncated.")
+
+    tag = data[offset]
+    offset += 1
+    if tag == NUMBER_INT:
+        zigzag, offset = readVarint(data, offset)
+        value = (zigzag >> 1) if zigzag & 1 == 0 else -((zigzag + 1) >> 1)
+        return value, offset
+
+    if tag == NUMBER_FLOAT:
+        end = offset + DOUBLE.size
+        if end > len(data):
+            raise DecodeException("Float is truncated.")
+        return DOUBLE.unpack_from(data, offset)[0], end
+
+    raise DecodeException("Unknown number tag: {}".format(tag))
+
+
+def readVersion(data: bytes) -> int:
+    """
+    Checks the version byte at the start of encoded data, returning the
+    offset after it.
+    """
+    if len(data) == 0:
+        raise DecodeException("Encoded data is empty.")
+
+    if data[0] != SERIALIZATION_VERSION:
+        raise DecodeException(
+            "Unsupported serialization version: {}".format(data[0]))
+
+    return 1
@@ -0,0 +1,376 @@
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, List, Set, Tuple
+
+import core.block as block
+from core.chain import Chain, ChainListener, UTXOManager, canSpendReferences
+from core.settings import COINBASE_REWARD, MAX_TRANSACTIONS_PER_BLOCK
+from core.settings import MEMPOOL_MAX_SIZE, MIN_TRANSACTION_AMOUNT
+import core.transaction as transaction
+
+
+class MempoolException(Exception):
+    """
+    Exception class for transactions that can not be added to the mempool
+    """
+
+
+class PendingUTXOView:
+    """
+    A view of the UTXO with pending transactions layered on top of the
+    confirmed UTXO manager, which is neither copied nor modified.
+
+    References are looked up in the confirmed UTXO first, and then in the
+    pending transactions. Whether an output is already spent by another
+    pending transaction is checked by the mempool's spenders index.
+    """
+    def __init__(
+            self,
+            confirmed: UTXOManager,
+            pending: Dict[str, transaction.Transaction]) -> None:
+        self.confirmed = confirmed
+        self.pending = pending
+
+    def canSpend(
+            self,
+            newTransaction: transaction.Transaction,
+            checkSignatures: bool = True) -> Tuple[bool, str]:
+        """
+        Verifies if a transaction can be spent against the confirmed UTXO
+        and the pending transactions, like UTXOManager.canSpend.
+        """
+        return canSpendReferences(
+            newTransaction, self._getReference, checkSignatures)
+
+    def _getReference(
+            self,
+            transactionInput: transaction.TransactionInput) \
+            -> transaction.TransactionOutput:
+        referenced = self.confirmed._getReference(transactionInput)
+        if referenced is not None:
+            return referenced
+
+        pending = self.pending.get(transactionInput.referencedHash, None)
+        if pending is None:
+            return None
+
+        index = transactionInput.referencedOutputIndex
+        if index < 0 or index >= len(pending.outputs):
+            return None
+
+        return pending.outputs[index]
+
+
+class MempoolListener:
+    """
+    Receives the transactions added to and removed from a mempool.
+    """
+    def transactionAdded(
+            self,
+            addedTransaction: transaction.Transaction) -> None:
+        pass
+
+    def transactionRemoved(
+            self,
+            removedTransaction: transaction.Transaction) -> None:
+        pass
+
+
+class Mempool(ChainListener):
+    """
+    The mempool holds transactions that are waiting to be included in a
+    block.
+
+    Transactions have no fees, so they are prioritized by arrival: the
+    oldest pending transaction is the first to be put in a block. The pool
+    is an insertion ordered dictionary from transaction hash to transaction,
+    and spenders maps every (transaction hash, output index) spent by a
+    pending transaction to the hash of the transaction spending it, so
+    double spends are found without scanning the pool.
+
+    Pending transactions can spend the outputs of other pending
+    transactions. Parents and children map each pending transaction to the
+    pending transactions it spends from and that spend from it. A child is
+    always added after its parents, so every prefix of the pool can be put
+    in a block, and removing a transaction also removes its descendants.
+
+    The mempool listens to the chain. Transactions confirmed by a new block
+    are removed, as are pending transactions that conflict with it, and
+    transactions from disconnected blocks are added back when still valid.
+    """
+    def __init__(self, chain: Chain, maxSize: int = MEMPOOL_MAX_SIZE) -> None:
+        self.chain = chain
+        self.maxSize = maxSize
+        self.transactions: "OrderedDict[str, transaction.Transaction]" = \
+            OrderedDict()
+        self.spenders: Dict[Tuple[str, int], str] = {}
+        self.parents: Dict[str, Set[str]] = {}
+        self.children: Dict[str, Set[str]] = {}
+        self.view = PendingUTXOView(chain.utxo, self.transactions)
+
+        # Arrivals maps each pending transaction to the order it was added
+        # in, which is used to add removed transactions back in order.
+        self.arrivals: Dict[str, int] = {}
+        self._nextArrival = 0
+
+        # Listeners are notified when transactions are added or removed.
+        self.listeners: List[MempoolListener] = []
+
+        chain.addListener(self)
+
+    def __contains__(self, transactionHash: object) -> bool:
+        return transactionHash in self.transactions
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+    def close(self) -> None:
+        """
+        Stops listening to the chain.
+        """
+        self.chain.removeListener(self)
+
+    def addListener(self, listener: MempoolListener) -> None:
+        self.listeners.append(listener)
+
+    def removeListener(self, listener: MempoolListener) -> None:
+        self.listeners.remove(listener)
+
+    def addTransaction(self, newTransaction: transaction.Transaction) -> None:
+        """
+        Adds a transaction to the pool after verifying it against the
+        chain's UTXO and the other pending transactions, whose outputs it
+        can spend. A MempoolException is raised if it can not be added.
+        """
+        if newTransaction.hash in self.transactions:
+            raise MempoolException(
+                "Transaction is already in the mempool: {}".format(
+                    newTransaction.hash))
+
+        if self.chain.utxo.hasUnspentOutputs(newTransaction):
+            raise MempoolException(
+                "Transaction is already in the chain: {}".format(
+                    newTransaction.hash))
+
+        if len(self.transactions) >= self.maxSize:
+            raise MempoolException("Mempool is full.")
+
+        isValid, msg = verifyTransactionSyntax(newTransaction)
+        if not isValid:
+            raise MempoolException(msg)
+
+        for tInput in newTransaction.inputs:
+            outpoint = (tInput.referencedHash, tInput.referencedOutputIndex)
+            spender = self.spenders.get(outpoint, None)
+            if spender is not None:
+                raise MempoolException(
+                    "Output {} {} is already spent by pending transaction {}"
+                    .format(outpoint[0], outpoint[1], spender))
+
+        canSpend, msg = self.view.canSpend(newTransaction)
+        if not canSpend:
+            raise MempoolException(msg)
+
+        txHash = newTransaction.hash
+        self.transactions[txHash] = newTransaction
+        self.arrivals[txHash] = self._nextArrival
+        self._nextArrival += 1
+
+        self.parents[txHash] = set()
+        self.children[txHash] = set()
+        for tInput in newTransaction.inputs:
+            outpoint = (tInput.referencedHash, tInput.referencedOutputIndex)
+            self.spenders[outpoint] = txHash
+
+            if tInput.referencedHash in self.transactions:
+                self.parents[txHash].add(tInput.referencedHash)
+                self.children[tInput.referencedHash].add(txHash)
+
+        for listener in self.listeners:
+            listener.transactionAdded(newTransaction)
+
+    def removeTransaction(
+            self,
+            transactionHash: str) -> List[transaction.Transaction]:
+        """
+        Removes a transaction and all of its descendants from the pool,
+        returning the removed transactions in the order they were added.
+        """
+        if transactionHash not in self.transactions:
+            return []
+
+        descendants = self.getDescendants(transactionHash)
+        descendants.add(transactionHash)
+
+        # Children are always newer than their parents, so removing the
+        # newest first never leaves a child without its parent.
+        removed = [
+            self._removeEntry(txHash) for txHash in
+            sorted(descendants, key=self.arrivals.__getitem__, reverse=True)]
+        removed.reverse()
+        return removed
+
+    def getAncestors(self, transactionHash: str) -> Set[str]:
+        """
+        Returns the hashes of the pending transactions that a pending
+        transaction depends on, directly or through other ones.
+        """
+        return self._walk(transactionHash, self.parents)
+
+    def getDescendants(self, transactionHash: str) -> Set[str]:
+        """
+        Returns the hashes of the pending transactions that depend on a
+        pending transaction, directly or through other ones.
+        """
+        return self._walk(transactionHash, self.children)
+
+    def getTransactions(
+            self,
+            n: int = MAX_TRANSACTIONS_PER_BLOCK - 1) \
+            -> List[transaction.Transaction]:
+        """
+        Returns the n oldest pending transactions. Only those n entries of
+        the pool are visited, so this does not depend on the pool's size.
+        """
+        return list(islice(self.transactions.values(), n))
+
+    def createBlockTemplate(
+            self,
+            coinbaseAddress: str,
+            timestamp: float = None) -> List[transaction.Transaction]:
+        """
+        Returns the transactions for the next block: a coinbase paying
+        the reward to the given address followed by the oldest pending
+        transactions, up to MAX_TRANSACTIONS_PER_BLOCK in total.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        coinbase = transaction.createTransaction(
+            [coinbaseAddress], [COINBASE_REWARD], timestamp)
+        return [coinbase] + self.getTransactions()
+
+    def blockConnected(self, connectedBlock: block.Block) -> None:
+        for tx in connectedBlock.transactions:
+            # A confirmed transaction's children now spend confirmed
+            # outputs, so they stay in the pool.
+            if tx.hash in self.transactions:
+                for child in self.children[tx.hash]:
+                    self.parents[child].discard(tx.hash)
+                self.children[tx.hash] = set()
+                self._removeEntry(tx.hash)
+
+            # Pending transactions spending the same outputs can no
+            # longer be included, and neither can their descendants.
+            for tInput in tx.inputs:
+                spender = self.spenders.get(
+                    (tInput.referencedHash, tInput.referencedOutputIndex),
+                    None)
+                if spender is not None:
+                    self.removeTransaction(spender)
+
+    def blockDisconnected(self, disconnectedBlock: block.Block) -> None:
+        # Pending transactions spending outputs created by the block are
+        # taken out, unless the new main chain has the same output, so
+        # that they can be added back after the block's transactions.
+        removed: List[transaction.Transaction] = []
+        for tx in disconnectedBlock.transactions:
+            for i in range(len(tx.outputs)):
+                if (tx.hash, i) in self.chain.utxo.utxo:
+                    continue
+
+                spender = self.spenders.get((tx.hash, i), None)
+                if spender is not None:
+                    removed.extend(self.removeTransaction(spender))
+
+        for tx in disconnectedBlock.transactions:
+            if len(tx.inputs) > 0:
+                self._tryAddTransaction(tx)
+
+        for tx in removed:
+            self._tryAddTransaction(tx)
+
+    def _tryAddTransaction(self, tx: transaction.Transaction) -> None:
+        try:
+            self.addTransaction(tx)
+        except MempoolException:
+            pass
+
+    def _removeEntry(self, transactionHash: str) -> transaction.Transaction:
+        """
+        Removes a single transaction, which must not have any children.
+        """
+        tx = self.transactions.pop(transactionHash)
+        del self.arrivals[transactionHash]
+        del self.children[transactionHash]
+
+        for parent in self.parents.pop(transactionHash):
+            self.children[parent].discard(transactionHash)
+
+        for tInput in tx.inputs:
+            outpoint = (tInput.referencedHash, tInput.referencedOutputIndex)
+            if self.spenders.get(outpoint, None) == transactionHash:
+                del self.spenders[outpoint]
+
+        for listener in self.listeners:
+            listener.transactionRemoved(tx)
+
+        return tx
+
+    def _walk(
+            self,
+            transactionHash: str,
+            edges: Dict[str, Set[str]]) -> Set[str]:
+        """
+        Returns the transactions reachable from a transaction by following
+        the edges, without the transaction itself.
+        """
+        reached: Set[str] = set()
+        stack = list(edges.get(transactionHash, ()))
+        while len(stack) > 0:
+            txHash = stack.pop()
+            if txHash in reached:
+                continue
+            reached.add(txHash)
+            stack.extend(edges[txHash])
+
+        return reached
+
+
+def verifyTransactionSyntax(
+        tx: transaction.Transaction) -> Tuple[bool, str]:
+    """
+    Verifies that a pending transaction is syntactically correct. Unlike
+    the transactions of a block, pending transactions can not be coinbase
+    transactions.
+    """
+    expectedHash = transaction.Transaction.createHash(
+        inputs=tx.inputs,
+        outputs=tx.outputs,
+        timestamp=tx.timestamp)
+    if tx.hash != expectedHash:
+        return False, "Transaction hash {} does not match expected {}".format(
+            tx.hash, expectedHash)
+
+    if len(tx.inputs) == 0:
+        return False, "Coinbase transactions can not be pending."
+
+    if len(tx.outputs) == 0:
+        return False, "Transaction has no outputs."
+
+    outpoints: Set[Tuple[str, int]] = set()
+    for tInput in tx.inputs:
+        outpoint = (tInput.referencedHash, tInput.referencedOutputIndex)
+        if outpoint in outpoints:
+            return False, "Multiple inputs for utxo {} with index {}".format(
+                outpoint[0], outpoint[1])
+        outpoints.add(outpoint)
+
+    for tOutput in tx.outputs:
+        if tOutput.amount < MIN_TRANSACTION_AMOUNT:
+            return False, \
+                "Output amount '{}' is less than the minimum reward." \
+                .format(tOutput.amount)
+
+    return True, ""
@@ -0,0 +1,88 @@
+import hashlib
+from typing import List, Tuple
+
+# A proof is the list of sibling hashes from a leaf up to the root, each
+# with whether the sibling is on the left.
+MerkleProof = List[Tuple[str, bool]]
+
+# Prefixes of the hashed bytes of leaves and inner nodes, so the hash of
+# an inner node can not also be the hash of a leaf.
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def computeMerkleRoot(hashes: List[str]) -> str:
+    """
+    Returns the root of the Merkle tree over the given hashes.
+
+    The given hashes are hashed with a leaf prefix, and each level pairs
+    up adjacent hashes and hashes their concatenated bytes with a node
+    prefix. A hash left without a pair is moved up to the next level
+    unchanged, instead of being paired with itself, so repeating the last
+    hash changes the root. The prefixes keep an inner node from being
+    passed off as a leaf, so a list of hashes can not share its root with
+    the shorter list of the inner nodes of its tree.
+    """
+    if len(hashes) == 0:
+        return hashlib.sha256(b"").hexdigest()
+
+    level = [_hashLeaf(h) for h in hashes]
+    while len(level) > 1:
+        level = _nextLevel(level)
+
+    return level[0]
+
+
+def getMerkleProof(hashes: List[str], index: int) -> MerkleProof:
+    """
+    Returns the proof that the hash at the given index is part of the
+    Merkle tree over the hashes.
+    """
+    if index < 0 or index >= len(hashes):
+        raise IndexError("Merkle leaf index out of range.")
+
+    proof: MerkleProof = []
+    level = [_hashLeaf(h) for h in hashes]
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < index))
+        level = _nextLevel(level)
+        index //= 2
+
+    return proof
+
+
+def verifyMerkleProof(leaf: str, proof: MerkleProof, root: str) -> bool:
+    """
+    Verifies that a proof leads from the leaf hash to the given root.
+    """
+    try:
+        current = _hashLeaf(leaf)
+        for sibling, isLeft in proof:
+            if isLeft:
+                current = _hashPair(sibling, current)
+            else:
+                current = _hashPair(current, sibling)
+    except ValueError:
+        return False
+
+    return current == root
+
+
+def _nextLevel(level: List[str]) -> List[str]:
+    nextLevel = [
+        _hashPair(level[i], level[i + 1])
+        for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2 == 1:
+        nextLevel.append(level[-1])
+    return nextLevel
+
+
+def _hashLeaf(leaf: str) -> str:
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(leaf)).hexdigest()
+
+
+def _hashPair(left: str, right: str) -> str:
+    return hashlib.sha256(
+        NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
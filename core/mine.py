@@ -1,43 +1,299 @@
+import multiprocessing
+import queue
+import threading
 import time
-from typing import List
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Tuple, Type
 
-from core.block import Block, hashBlock
+from core.block import Block, MiningHeader
+from core.settings import INITIAL_DIFFICULTY
+from core.settings import MINING_BATCH_SIZE, MINING_CHUNK_SIZE
 from core.transaction import Transaction
 
 
-def hasProofOfWork(hash: str) -> bool:
+def hasProofOfWork(hash: str, difficulty: int = INITIAL_DIFFICULTY) -> bool:
     """
-    Checks if the first n half-bytes in the hash are zero, where n
+    Checks if the first n bits in the hash are zero, where n
     is the difficulty.
     """
-    difficulty = 1  # Number of most significant bytes that are zero.
-    return int(hash[:difficulty], 16) == 0
+    return hasProofOfWorkDigest(bytes.fromhex(hash), difficulty)
+
+
+def hasProofOfWorkDigest(
+        digest: bytes,
+        difficulty: int = INITIAL_DIFFICULTY) -> bool:
+    """
+    Checks if the first n bits of a raw hash digest are zero, where
+    n is the difficulty. Compares whole bytes instead of parsing hex.
+    """
+    zeroBytes, zeroBits = divmod(difficulty, 8)
+    if digest[:zeroBytes] != bytes(zeroBytes):
+        return False
+
+    return zeroBits == 0 or digest[zeroBytes] >> (8 - zeroBits) == 0
 
 
 def generateNextBlock(
         previousBlock: Block,
-        transactions: List[Transaction]) -> Block:
+        transactions: List[Transaction],
+        difficulty: int = None) -> Block:
     """
-    Attempts to generate the next block in given new data
+    Attempts to generate the next block in given new data. If the
+    difficulty is not given, the previous block's difficulty is used.
     """
-    nextIndex = previousBlock.index + 1
-    nextTimestamp = time.time()
+    header = _createHeader(previousBlock, transactions, difficulty)
     noonce = 0
 
     while True:
-        hash = hashBlock(
-            nextIndex,
-            nextTimestamp,
-            transactions,
-            noonce,
-            previousBlock.hash)
-        if hasProofOfWork(hash):
-            return Block(
-                index=nextIndex,
-                timestamp=nextTimestamp,
-                transactions=transactions,
-                noonce=noonce,
-                previousHash=previousBlock.hash)
+        if hasProofOfWorkDigest(header.digest(noonce), header.difficulty):
+            return header.createBlock(noonce)
         noonce += 1
 
     return None
+
+
+def _createHeader(
+        previousBlock: Block,
+        transactions: List[Transaction],
+        difficulty: int = None) -> MiningHeader:
+    if difficulty is None:
+        difficulty = previousBlock.difficulty
+
+    return MiningHeader(
+        index=previousBlock.index + 1,
+        timestamp=time.time(),
+        transactions=transactions,
+        previousHash=previousBlock.hash,
+        difficulty=difficulty)
+
+
+class Miner(ABC):
+    """
+    Base class for the mining engines. Subclasses implement _search, and
+    the hash count and hash rate of the last generated block are recorded
+    so that the engines can be compared on the same machine.
+    """
+    def __init__(self) -> None:
+        # Statistics for the last call to generateNextBlock
+        self.hashCount = 0
+        self.elapsed = 0.0
+
+    @property
+    def hashesPerSecond(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.hashCount / self.elapsed
+
+    def generateNextBlock(
+            self,
+            previousBlock: Block,
+            transactions: List[Transaction],
+            difficulty: int = None) -> Block:
+        """
+        Attempts to generate the next block in given new data. If the
+        difficulty is not given, the previous block's difficulty is used.
+        """
+        header = _createHeader(previousBlock, transactions, difficulty)
+
+        startTime = time.time()
+        noonce, self.hashCount = self._search(header)
+        self.elapsed = time.time() - startTime
+
+        return header.createBlock(noonce)
+
+    @abstractmethod
+    def _search(self, header: MiningHeader) -> Tuple[int, int]:
+        """
+        Returns a valid noonce for the header along with the number of
+        hashes that were computed to find it.
+        """
+
+
+class SerialMiner(Miner):
+    """
+    Searches noonces one at a time on the calling thread.
+    """
+    def _search(self, header: MiningHeader) -> Tuple[int, int]:
+        noonce = 0
+        difficulty = header.difficulty
+        while not hasProofOfWorkDigest(header.digest(noonce), difficulty):
+            noonce += 1
+        return noonce, noonce + 1
+
+
+class ParallelMiner(Miner):
+    """
+    Searches for the next block's noonce on a pool of worker processes.
+
+    The noonce space is split into chunks of chunkSize noonces, and worker
+    i searches chunks i, i + n, i + 2n, ... where n is the number of
+    processes. Workers check a shared stop event between chunks, so all of
+    them stop shortly after the first valid noonce is found.
+    """
+    def __init__(
+            self,
+            processes: int = None,
+            chunkSize: int = MINING_CHUNK_SIZE) -> None:
+        super().__init__()
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+
+    def _search(self, header: MiningHeader) -> Tuple[int, int]:
+        stopEvent = multiprocessing.Event()
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        hashCounter = multiprocessing.Value('Q', 0)
+
+        workers = []
+        for i in range(self.processes):
+            worker = multiprocessing.Process(
+                target=_searchNoonces,
+                args=(
+                    header,
+                    i,
+                    self.processes,
+                    self.chunkSize,
+                    stopEvent,
+                    results,
+                    hashCounter))
+            worker.daemon = True
+            workers.append(worker)
+
+        for worker in workers:
+            worker.start()
+
+        try:
+            noonce = None
+            while noonce is None:
+                try:
+                    noonce = results.get(timeout=0.1)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError(
+                            "All mining workers exited without a result.")
+        finally:
+            stopEvent.set()
+            for worker in workers:
+                worker.join()
+
+        return noonce, hashCounter.value
+
+
+def _searchNoonces(
+        header: MiningHeader,
+        workerIndex: int,
+        workerCount: int,
+        chunkSize: int,
+        stopEvent,
+        results,
+        hashCounter) -> None:
+    """
+    Worker process body for the ParallelMiner. Puts the first valid noonce
+    found on the results queue and then signals the other workers to stop.
+    """
+    difficulty = header.difficulty
+    chunk = workerIndex
+    while not stopEvent.is_set():
+        start = chunk * chunkSize
+        for noonce in range(start, start + chunkSize):
+            if hasProofOfWorkDigest(header.digest(noonce), difficulty):
+                with hashCounter.get_lock():
+                    hashCounter.value += noonce - start + 1
+                results.put(noonce)
+                stopEvent.set()
+                return
+
+        with hashCounter.get_lock():
+            hashCounter.value += chunkSize
+        chunk += workerCount
+
+
+class BatchedMiner(Miner):
+    """
+    Evaluates noonces in batches of batchSize on a pool of threads.
+
+    Each batch copies the header midstate from MiningHeader and checks the
+    raw digests with hasProofOfWorkDigest. Note that hashlib only releases
+    the GIL for updates larger than roughly 2KB, so with short noonce
+    updates the threads mostly interleave rather than run in parallel;
+    the ParallelMiner is the engine to use for multiple cores.
+    """
+    def __init__(
+            self,
+            threads: int = None,
+            batchSize: int = MINING_BATCH_SIZE) -> None:
+        super().__init__()
+        self.threads = threads or multiprocessing.cpu_count()
+        self.batchSize = batchSize
+
+    def _search(self, header: MiningHeader) -> Tuple[int, int]:
+        stopEvent = threading.Event()
+        hashCount = 0
+        found: Optional[int] = None
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            nextStart = 0
+            pending = set()
+            while found is None:
+                # Keep every thread busy with a queued batch behind it.
+                while len(pending) < self.threads * 2:
+                    pending.add(executor.submit(
+                        _searchBatch,
+                        header,
+                        nextStart,
+                        self.batchSize,
+                        stopEvent))
+                    nextStart += self.batchSize
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    noonce, count = future.result()
+                    hashCount += count
+                    if noonce is not None and found is None:
+                        found = noonce
+
+            stopEvent.set()
+            for future in pending:
+                hashCount += future.result()[1]
+
+        return found, hashCount
+
+
+def _searchBatch(
+        header: MiningHeader,
+        start: int,
+        batchSize: int,
+        stopEvent: threading.Event) -> Tuple[Optional[int], int]:
+    """
+    Searches a single batch of noonces for the BatchedMiner. Returns the
+    first valid noonce (or None) and the number of hashes computed.
+    """
+    if stopEvent.is_set():
+        return None, 0
+
+    difficulty = header.difficulty
+    midstate = header.midstate
+    for noonce in range(start, start + batchSize):
+        state = midstate.copy()
+        state.update(str(noonce).encode('utf-8'))
+        if hasProofOfWorkDigest(state.digest(), difficulty):
+            return noonce, noonce - start + 1
+
+    return None, batchSize
+
+
+MINERS: Dict[str, Type[Miner]] = {
+    "serial": SerialMiner,
+    "parallel": ParallelMiner,
+    "batched": BatchedMiner,
+}
+
+
+def createMiner(mode: str, **kwargs) -> Miner:
+    """
+    Creates one of the mining engines by name. See MINERS for the
+    available modes.
+    """
+    if mode not in MINERS:
+        raise ValueError("Unknown mining mode: {}".format(mode))
+    return MINERS[mode](**kwargs)
@@ -0,0 +1,597 @@
+import asyncio
+import logging
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from typing import cast
+
+import core.block as block
+from core.chain import Chain, ChainException, DuplicateBlockException
+from core.chain import OrphanBlockException
+from core.encoding import DecodeException, readBytes, readHex, readVarint
+from core.encoding import writeBytes, writeHex, writeVarint
+from core.mempool import Mempool, MempoolException
+from core.settings import BLOCK_REQUEST_TIMEOUT
+from core.settings import MAX_BLOCKS_IN_FLIGHT, MAX_HEADERS_PER_MESSAGE
+from core.settings import MAX_MESSAGE_SIZE, PEER_SEND_QUEUE_SIZE
+import core.transaction as transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class NetworkException(Exception):
+    pass
+
+
+# Messages are a 4 byte length followed by a message type and its payload.
+MESSAGE_LENGTH = struct.Struct("<I")
+
+MSG_VERSION = 0  # The port the sending node listens on
+MSG_INV = 1  # Hashes of blocks and transactions the sender has
+MSG_GETDATA = 2  # Hashes of blocks and transactions the sender wants
+MSG_BLOCK = 3  # A block in the binary format
+MSG_TX = 4  # A transaction in the binary format
+MSG_GETHEADERS = 5  # A locator of the sender's main chain
+MSG_HEADERS = 6  # Headers following the locator of a getheaders message
+
+INV_BLOCK = 0
+INV_TX = 1
+
+Address = Tuple[str, int]
+InventoryItem = Tuple[int, str]
+Handler = Callable[["Peer", bytes], Awaitable[None]]
+
+
+def encodeMessage(messageType: int, payload: bytes) -> bytes:
+    return MESSAGE_LENGTH.pack(len(payload) + 1) + \
+        bytes([messageType]) + payload
+
+
+def encodeInventory(items: List[InventoryItem]) -> bytes:
+    buffer = bytearray()
+    writeVarint(buffer, len(items))
+    for itemType, itemHash in items:
+        buffer.append(itemType)
+        writeHex(buffer, itemHash)
+    return bytes(buffer)
+
+
+def decodeInventory(payload: bytes) -> List[InventoryItem]:
+    items: List[InventoryItem] = []
+    count, offset = readVarint(payload, 0)
+    for i in range(count):
+        if offset >= len(payload):
+            raise DecodeException("Inventory is truncated.")
+        itemType = payload[offset]
+        itemHash, offset = readHex(payload, offset + 1)
+        items.append((itemType, itemHash))
+    _checkEnd(payload, offset)
+    return items
+
+
+def encodeHeaders(headers: List[block.BlockHeader]) -> bytes:
+    buffer = bytearray()
+    writeVarint(buffer, len(headers))
+    for header in headers:
+        writeBytes(buffer, header.asBytes())
+    return bytes(buffer)
+
+
+def decodeHeaders(payload: bytes) -> List[block.BlockHeader]:
+    headers: List[block.BlockHeader] = []
+    count, offset = readVarint(payload, 0)
+    for i in range(count):
+        data, offset = readBytes(payload, offset)
+        headers.append(block.createHeaderFromBytes(data))
+    _checkEnd(payload, offset)
+    return headers
+
+
+def encodeLocator(locator: List[str]) -> bytes:
+    buffer = bytearray()
+    writeVarint(buffer, len(locator))
+    for blockHash in locator:
+        writeHex(buffer, blockHash)
+    return bytes(buffer)
+
+
+def decodeLocator(payload: bytes) -> List[str]:
+    locator: List[str] = []
+    count, offset = readVarint(payload, 0)
+    for i in range(count):
+        blockHash, offset = readHex(payload, offset)
+        locator.append(blockHash)
+    _checkEnd(payload, offset)
+    return locator
+
+
+def _checkEnd(payload: bytes, offset: int) -> None:
+    if offset != len(payload):
+        raise DecodeException("Unexpected data after the message.")
+
+
+class Peer:
+    """
+    A connection to another node.
+
+    Outgoing messages wait in a bounded queue that a writer task drains
+    into the socket, waiting for the socket to drain in turn. Sending
+    never waits for the queue, since a reader task handling a message
+    waiting on a peer whose reader waits in turn could deadlock both.
+    Instead a peer that lets its queue fill up is too slow and is
+    disconnected. Incoming messages are handled one at a time by the
+    reader task, and a message that can not be handled, for any reason,
+    closes the connection.
+    """
+    def __init__(
+            self,
+            node: "Node",
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            address: Optional[Address] = None) -> None:
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.address = address
+        self.sendQueue: "asyncio.Queue[bytes]" = \
+            asyncio.Queue(maxsize=PEER_SEND_QUEUE_SIZE)
+        self.closed = False
+        self._tasks = [
+            asyncio.ensure_future(self._writeLoop()),
+            asyncio.ensure_future(self._readLoop()),
+        ]
+
+    def send(self, messageType: int, payload: bytes) -> None:
+        """
+        Queues a message without waiting. If the send queue is full the
+        connection is closed instead.
+        """
+        if self.closed:
+            raise NetworkException("Peer connection is closed.")
+        try:
+            self.sendQueue.put_nowait(encodeMessage(messageType, payload))
+        except asyncio.QueueFull:
+            self.abort()
+            raise NetworkException("Peer send queue is full.")
+
+    def abort(self) -> None:
+        """
+        Closes the connection without waiting for the socket to close.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.node._removePeer(self)
+
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self.writer.close()
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.abort()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _writeLoop(self) -> None:
+        try:
+            while True:
+                message = await self.sendQueue.get()
+                self.writer.write(message)
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            await self.close()
+        except Exception:
+            logger.exception("Error writing to peer %s.", self.address)
+            await self.close()
+
+    async def _readLoop(self) -> None:
+        try:
+            while True:
+                prefix = await self.reader.readexactly(MESSAGE_LENGTH.size)
+                length = MESSAGE_LENGTH.unpack(prefix)[0]
+                if length == 0 or length > MAX_MESSAGE_SIZE:
+                    raise NetworkException("Invalid message length.")
+
+                message = await self.reader.readexactly(length)
+                await self.node._dispatch(self, message[0], message[1:])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            await self.close()
+        except (NetworkException, ValueError, block.BlockException):
+            # Malformed messages end the connection.
+            await self.close()
+        except Exception:
+            logger.exception("Error handling a message from peer %s.",
+                             self.address)
+            await self.close()
+
+
+class Node:
+    """
+    A node of the peer to peer network, relaying the blocks of a chain and
+    the transactions of an optional mempool.
+
+    A node keeps a single connection per peer address, whether it opened
+    the connection or accepted it, and every message to that peer goes
+    through it. Messages are dispatched to a handler by type. The default
+    handlers announce new blocks and transactions with inv messages, fetch
+    unknown ones with getdata, add them to the chain and mempool and relay
+    them. A block whose previous block is missing triggers a getheaders
+    request, and the blocks of the received headers are fetched a few at
+    a time, so a node catches up headers first. A block that does not
+    arrive within BLOCK_REQUEST_TIMEOUT seconds is requested from another
+    peer. setHandler replaces the handler of a message type.
+
+    Chain and mempool updates run on a single worker thread, so connecting
+    a block does not stall the other connections, and updates never run at
+    once.
+    """
+    def __init__(
+            self,
+            chain: Chain,
+            mempool: Mempool = None,
+            host: str = "127.0.0.1",
+            port: int = 0) -> None:
+        self.chain = chain
+        self.mempool = mempool
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+        # Peers maps the listening address of each peer to its connection.
+        self.peers: Dict[Address, Peer] = {}
+        self._pending: Set[Peer] = set()
+        self._connecting: Dict[Address, "asyncio.Future[Peer]"] = {}
+
+        # Requested maps the hashes of blocks asked for but not received
+        # to the peer they were asked from and the time to ask another.
+        self.requested: Dict[str, Tuple[Peer, float]] = {}
+        self._requestTimer: Optional["asyncio.Task[None]"] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.handlers: Dict[int, Handler] = {
+            MSG_VERSION: self._handleVersion,
+            MSG_INV: self._handleInventory,
+            MSG_GETDATA: self._handleGetData,
+            MSG_BLOCK: self._handleBlock,
+            MSG_TX: self._handleTransaction,
+            MSG_GETHEADERS: self._handleGetHeaders,
+            MSG_HEADERS: self._handleHeaders,
+        }
+
+    def setHandler(self, messageType: int, handler: Handler) -> None:
+        self.handlers[messageType] = handler
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(
+            self._acceptPeer, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._requestTimer = asyncio.ensure_future(self._retryRequestsLoop())
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        if self._requestTimer is not None:
+            self._requestTimer.cancel()
+            self._requestTimer = None
+
+        for peer in list(self.peers.values()) + list(self._pending):
+            await peer.close()
+
+        self._executor.shutdown(wait=True)
+
+    async def connect(self, host: str, port: int) -> Peer:
+        """
+        Returns the connection to the node listening at an address,
+        opening it if there is none. A new connection asks the peer for
+        the headers after this node's main chain.
+        """
+        address = (host, port)
+        peer = self.peers.get(address, None)
+        if peer is not None:
+            return peer
+
+        connecting = self._connecting.get(address, None)
+        if connecting is not None:
+            return await connecting
+
+        future = asyncio.get_running_loop().create_future()
+        self._connecting[address] = future
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            peer = Peer(self, reader, writer, address)
+            self.peers[address] = peer
+            self._sendVersion(peer)
+            await self.requestHeaders(peer)
+            future.set_result(peer)
+        except Exception as e:
+            future.set_exception(e)
+            # The exception is raised here, so the future's copy of it is
+            # marked as retrieved.
+            future.exception()
+            raise
+        finally:
+            del self._connecting[address]
+
+        return peer
+
+    def broadcast(
+            self,
+            messageType: int,
+            payload: bytes,
+            exclude: Peer = None) -> None:
+        for peer in list(self.peers.values()):
+            if peer is not exclude and not peer.closed:
+                try:
+                    peer.send(messageType, payload)
+                except NetworkException:
+                    # The peer was too slow and is disconnected.
+                    pass
+
+    async def announceBlock(self, newBlock: block.Block) -> None:
+        """
+        Adds a block, such as a newly mined one, to the chain and announces
+        it to every peer.
+        """
+        await self._runChain(self.chain.addBlock, newBlock)
+        self.broadcast(
+            MSG_INV, encodeInventory([(INV_BLOCK, newBlock.hash)]))
+
+    async def announceTransaction(
+            self,
+            newTransaction: transaction.Transaction) -> None:
+        """
+        Adds a transaction to the mempool and announces it to every peer.
+        """
+        if self.mempool is None:
+            raise NetworkException("Node has no mempool.")
+
+        await self._runChain(self.mempool.addTransaction, newTransaction)
+        self.broadcast(
+            MSG_INV, encodeInventory([(INV_TX, newTransaction.hash)]))
+
+    async def requestHeaders(self, peer: Peer) -> None:
+        locator = await self._runChain(self.chain.getLocator)
+        peer.send(MSG_GETHEADERS, encodeLocator(locator))
+
+    async def _acceptPeer(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        # The peer is registered under its address once its version
+        # message says which port it listens on.
+        peer = Peer(self, reader, writer)
+        self._pending.add(peer)
+        self._sendVersion(peer)
+
+    def _sendVersion(self, peer: Peer) -> None:
+        payload = bytearray()
+        writeVarint(payload, self.port)
+        peer.send(MSG_VERSION, bytes(payload))
+
+    def _removePeer(self, peer: Peer) -> None:
+        # Blocks requested from the peer can be requested from others.
+        for blockHash in [
+                h for h, (p, _) in self.requested.items() if p is peer]:
+            del self.requested[blockHash]
+
+        self._pending.discard(peer)
+        if peer.address is not None and \
+                self.peers.get(peer.address, None) is peer:
+            del self.peers[peer.address]
+
+    async def _runChain(self, function: Callable[..., Any], *args: Any) -> Any:
+        """
+        Runs a chain or mempool call on the worker thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args)
+
+    def _requestBlocks(self, peer: Peer, items: List[InventoryItem]) -> None:
+        """
+        Sends a getdata message, recording when to ask another peer for
+        the blocks in it.
+        """
+        deadline = time.time() + BLOCK_REQUEST_TIMEOUT
+        for itemType, itemHash in items:
+            if itemType == INV_BLOCK:
+                self.requested[itemHash] = (peer, deadline)
+        peer.send(MSG_GETDATA, encodeInventory(items))
+
+    async def _retryRequestsLoop(self) -> None:
+        while True:
+            await asyncio.sleep(BLOCK_REQUEST_TIMEOUT / 4)
+            self._retryRequests(time.time())
+
+    def _retryRequests(self, now: float) -> None:
+        """
+        Requests the blocks whose deadline has passed from the peer with
+        the fewest requests, other than the one that did not send them.
+        """
+        load: Dict[Peer, int] = {}
+        for peer, deadline in self.requested.values():
+            if deadline > now:
+                load[peer] = load.get(peer, 0) + 1
+
+        expired: Dict[Peer, List[str]] = {}
+        for blockHash, (peer, deadline) in list(self.requested.items()):
+            if deadline > now:
+                continue
+            del self.requested[blockHash]
+            if blockHash in self.chain.blocks:
+                continue
+
+            candidates = [
+                p for p in self.peers.values()
+                if p is not peer and not p.closed]
+            if len(candidates) == 0 and not peer.closed:
+                candidates = [peer]
+            if len(candidates) == 0:
+                continue
+
+            nextPeer = min(candidates, key=lambda p: load.get(p, 0))
+            load[nextPeer] = load.get(nextPeer, 0) + 1
+            expired.setdefault(nextPeer, []).append(blockHash)
+
+        for peer, hashes in expired.items():
+            try:
+                self._requestBlocks(
+                    peer, [(INV_BLOCK, blockHash) for blockHash in hashes])
+            except NetworkException:
+                # The peer is disconnected, so its requests are dropped.
+                pass
+
+    async def _dispatch(
+            self,
+            peer: Peer,
+            messageType: int,
+            payload: bytes) -> None:
+        handler = self.handlers.get(messageType, None)
+        if handler is None:
+            raise NetworkException(
+                "Unknown message type: {}".format(messageType))
+        await handler(peer, payload)
+
+    async def _handleVersion(self, peer: Peer, payload: bytes) -> None:
+        port, offset = readVarint(payload, 0)
+        _checkEnd(payload, offset)
+        if peer.address is not None:
+            return
+
+        # Both nodes may have connected to each other at once, in which
+        # case the existing connection is kept.
+        host = peer.writer.get_extra_info("peername")[0]
+        self._pending.discard(peer)
+        peer.address = (host, port)
+        if peer.address in self.peers or peer.address in self._connecting:
+            peer.address = None
+            await peer.close()
+            return
+        self.peers[peer.address] = peer
+
+    async def _handleInventory(self, peer: Peer, payload: bytes) -> None:
+        wanted: List[InventoryItem] = []
+        for itemType, itemHash in decodeInventory(payload):
+            if itemType == INV_BLOCK:
+                if itemHash in self.chain.blocks or \
+                        itemHash in self.chain.orphans or \
+                        itemHash in self.requested:
+                    continue
+                wanted.append((itemType, itemHash))
+            elif itemType == INV_TX and self.mempool is not None:
+                if itemHash not in self.mempool:
+                    wanted.append((itemType, itemHash))
+
+        if len(wanted) > 0:
+            self._requestBlocks(peer, wanted)
+
+    async def _handleGetData(self, peer: Peer, payload: bytes) -> None:
+        for itemType, itemHash in decodeInventory(payload):
+            if itemType == INV_BLOCK:
+                data = await self._runChain(self._getBlockBytes, itemHash)
+                if data is not None:
+                    peer.send(MSG_BLOCK, data)
+            elif itemType == INV_TX and self.mempool is not None:
+                data = await self._runChain(
+                    self._getTransactionBytes, itemHash)
+                if data is not None:
+                    peer.send(MSG_TX, data)
+
+    async def _handleBlock(self, peer: Peer, payload: bytes) -> None:
+        newBlock = block.createFromBytes(payload)
+        self.requested.pop(newBlock.hash, None)
+        try:
+            await self._runChain(self.chain.addBlock, newBlock)
+        except DuplicateBlockException:
+            return
+        except OrphanBlockException:
+            await self.requestHeaders(peer)
+            return
+        except ChainException:
+            return
+
+        self.broadcast(
+            MSG_INV,
+            encodeInventory([(INV_BLOCK, newBlock.hash)]),
+            exclude=peer)
+        await self._requestMissingBlocks(peer)
+
+    async def _handleTransaction(self, peer: Peer, payload: bytes) -> None:
+        if self.mempool is None:
+            return
+
+        newTransaction = transaction.createFromBytes(payload)
+        try:
+            await self._runChain(self.mempool.addTransaction, newTransaction)
+        except MempoolException:
+            return
+
+        self.broadcast(
+            MSG_INV,
+            encodeInventory([(INV_TX, newTransaction.hash)]),
+            exclude=peer)
+
+    async def _handleGetHeaders(self, peer: Peer, payload: bytes) -> None:
+        headers = await self._runChain(
+            self.chain.getHeadersAfter,
+            decodeLocator(payload),
+            MAX_HEADERS_PER_MESSAGE)
+        peer.send(MSG_HEADERS, encodeHeaders(headers))
+
+    async def _handleHeaders(self, peer: Peer, payload: bytes) -> None:
+        headers = decodeHeaders(payload)
+        try:
+            await self._runChain(self.chain.addHeaders, headers)
+        except ChainException:
+            return
+
+        if len(headers) == MAX_HEADERS_PER_MESSAGE:
+            locator = await self._runChain(self.chain.getLocator)
+            peer.send(
+                MSG_GETHEADERS,
+                encodeLocator([headers[-1].hash] + locator))
+        await self._requestMissingBlocks(peer)
+
+    async def _requestMissingBlocks(self, peer: Peer) -> None:
+        """
+        Requests the blocks of the best header chain that are missing, so
+        that at most MAX_BLOCKS_IN_FLIGHT requests are outstanding.
+        """
+        room = MAX_BLOCKS_IN_FLIGHT - len(self.requested)
+        if room <= 0:
+            return
+
+        wanted: List[InventoryItem] = []
+        # The first missing blocks may already be requested, so the limit
+        # leaves room to skip them.
+        missing = await self._runChain(
+            self.chain.getMissingBlocks, room + len(self.requested))
+        for blockHash in missing:
+            if len(wanted) >= room:
+                break
+            if blockHash not in self.requested:
+                wanted.append((INV_BLOCK, blockHash))
+
+        if len(wanted) > 0:
+            self._requestBlocks(peer, wanted)
+
+    def _getBlockBytes(self, blockHash: str) -> Optional[bytes]:
+        if blockHash not in self.chain.blocks:
+            return None
+        return self.chain.blocks[blockHash].asBytes()
+
+    def _getTransactionBytes(self, transactionHash: str) -> Optional[bytes]:
+        newTransaction = cast(Mempool, self.mempool).transactions.get(
+            transactionHash, None)
+        if newTransaction is None:
+            return None
+        return newTransaction.asBytes()
@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+from core.block import Block, hashHeader
+from core.mine import hasProofOfWorkDigest
+from core.settings import MIN_DIFFICULTY, ORPHAN_MAX_AGE, ORPHAN_POOL_SIZE
+
+
+class OrphanPool:
+    """
+    Holds blocks whose previous block is not known yet, until it arrives.
+
+    Orphans are kept in the order they arrived, along with their arrival
+    time, and indexed by the hash of their previous block. At most maxSize
+    orphans are kept, evicting the oldest first, and orphans older than
+    maxAge seconds are dropped. Since an orphan's expected difficulty is
+    not known without its previous block, an orphan is only kept if its
+    hash matches its header and has a proof of work for at least a given
+    minimum difficulty, so the pool can not be filled for free.
+    """
+    def __init__(
+            self,
+            maxSize: int = ORPHAN_POOL_SIZE,
+            maxAge: float = ORPHAN_MAX_AGE) -> None:
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        self.orphans: "OrderedDict[str, Tuple[Block, float]]" = OrderedDict()
+        self.byParent: Dict[str, Set[str]] = {}
+
+    def __contains__(self, blockHash: object) -> bool:
+        return blockHash in self.orphans
+
+    def __len__(self) -> int:
+        return len(self.orphans)
+
+    def add(
+            self,
+            orphan: Block,
+            now: float = None,
+            minDifficulty: int = MIN_DIFFICULTY) -> bool:
+        """
+        Adds an orphan block, evicting expired and then the oldest orphans
+        to make room for it. Returns false, without adding it, if the
+        orphan does not have a valid proof of work of at least
+        minDifficulty.
+        """
+        if now is None:
+            now = time.time()
+
+        if orphan.hash in self.orphans:
+            return True
+
+        if not hasValidProofOfWork(orphan, minDifficulty):
+            return False
+
+        self.expire(now)
+        while len(self.orphans) >= self.maxSize:
+            self._remove(next(iter(self.orphans)))
+
+        self.orphans[orphan.hash] = (orphan, now)
+        self.byParent.setdefault(orphan.previousHash, set()).add(orphan.hash)
+        return True
+
+    def popChildren(self, parentHash: str) -> List[Block]:
+        """
+        Removes and returns the orphans whose previous block is the given
+        block, in the order they arrived.
+        """
+        childHashes = self.byParent.get(parentHash, None)
+        if childHashes is None:
+            return []
+
+        children = [self.orphans[childHash] for childHash in childHashes]
+        children.sort(key=lambda entry: entry[1])
+        for child, _ in children:
+            self._remove(child.hash)
+
+        return [child for child, _ in children]
+
+    def expire(self, now: float = None) -> None:
+        """
+        Drops the orphans that arrived more than maxAge seconds ago.
+        """
+        if now is None:
+            now = time.time()
+
+        while len(self.orphans) > 0:
+            oldestHash, (_, arrival) = next(iter(self.orphans.items()))
+            if now - arrival <= self.maxAge:
+                return
+            self._remove(oldestHash)
+
+    def _remove(self, blockHash: str) -> None:
+        orphan, _ = self.orphans.pop(blockHash)
+        siblings = self.byParent[orphan.previousHash]
+        siblings.discard(blockHash)
+        if len(siblings) == 0:
+            del self.byParent[orphan.previousHash]
+
+
+def hasValidProofOfWork(orphan: Block, minDifficulty: int) -> bool:
+    """
+    Returns true if a block's hash matches its header and has a proof of
+    work for its difficulty, which is at least minDifficulty.
+    """
+    if orphan.difficulty < minDifficulty:
+        return False
+
+    expectedHash = hashHeader(
+        orphan.index,
+        orphan.timestamp,
+        orphan.transactionsRoot,
+        orphan.noonce,
+        orphan.previousHash)
+    if expectedHash != orphan.hash:
+        return False
+
+    return hasProofOfWorkDigest(bytes.fromhex(orphan.hash), orphan.difficulty)
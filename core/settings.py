@@ -1,3 +1,36 @@
 MAX_TRANSACTIONS_PER_BLOCK = 5
 MIN_TRANSACTION_AMOUNT = 1  # SPC
 COINBASE_REWARD = 1000  # SPC
+
+MINING_CHUNK_SIZE = 2000  # Noonces searched by a worker between stop checks
+MINING_BATCH_SIZE = 5000  # Noonces hashed per batch by the batched miner
+
+# Difficulty is the number of leading zero bits required in a block hash.
+INITIAL_DIFFICULTY = 4
+MIN_DIFFICULTY = 1
+TARGET_BLOCK_INTERVAL = 30  # Seconds
+RETARGET_WINDOW = 10  # Number of blocks used to retarget the difficulty
+MAX_RETARGET_BITS = 2  # Bits the difficulty can change by at a retarget
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60  # Seconds a block can be ahead of now
+
+BLOCK_STORE_SEGMENT_SIZE = 16 * 1024 * 1024  # Bytes per block segment file
+BLOCK_CACHE_SIZE = 256  # Full blocks kept in memory by a block store
+SYNC_QUEUE_SIZE = 64  # Decoded blocks buffered while importing a chain
+MAX_BLOCK_SIZE = 4 * 1024 * 1024  # Bytes of a block record read from a stream
+SIGNATURE_BATCH_SIZE = 16  # Signatures verified per worker task
+KEY_CACHE_SIZE = 1024  # Parsed public keys kept for signature verification
+SIGNATURE_CACHE_SIZE = 100000  # Verified transaction inputs remembered
+MEMPOOL_MAX_SIZE = 10000  # Pending transactions held by a mempool
+MINING_WORK_SIZE = 100000  # Noonces handed out per mining work unit
+UTXO_CACHE_SIZE = 100000  # Outputs read from a UTXO database kept in memory
+UTXO_FLUSH_SIZE = 10000  # Changed outputs written to a UTXO database at once
+ORPHAN_POOL_SIZE = 100  # Blocks with an unknown previous block kept
+ORPHAN_MAX_AGE = 600  # Seconds an orphan block is kept
+ORPHAN_DIFFICULTY_MARGIN = 2  # Orphan difficulty bits allowed below the head's
+SPV_CONFIRMATIONS = 6  # Blocks from a payment's block to the head to accept it
+MAX_LOCATOR_HASHES = 32  # Block hashes sent to find the last common block
+PEER_SEND_QUEUE_SIZE = 64  # Messages queued for a peer before it is closed
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024  # Bytes in a network message
+MAX_HEADERS_PER_MESSAGE = 500  # Headers sent in reply to a getheaders message
+MAX_BLOCKS_IN_FLIGHT = 16  # Blocks requested from peers at once while syncing
+BLOCK_REQUEST_TIMEOUT = 30  # Seconds before a block is asked from another peer
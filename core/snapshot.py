@@ -0,0 +1,220 @@
+import hashlib
+import os
+from typing import BinaryIO, Dict, Iterator, List, Mapping, Tuple
+
+from core.encoding import DecodeException, readVarint
+from core.encoding import writeHex, writeVarint
+from core.transaction import Outpoint, TransactionOutput
+
+
+class SnapshotException(Exception):
+    pass
+
+
+# Snapshots start with a magic string and a version, followed by the hash
+# and index of the block the UTXO is for, the addresses that are paid to,
+# and one entry per unspent output with the index of its address. The
+# SHA256 of all of this comes last.
+SNAPSHOT_MAGIC = b"SPCS"
+SNAPSHOT_VERSION = 1
+CHECKSUM_SIZE = 32
+
+# Bytes read from a snapshot file at once, and the most bytes in a varint.
+READ_SIZE = 64 * 1024
+MAX_VARINT_SIZE = 10
+
+
+def writeSnapshot(
+        utxo: Mapping[Outpoint, TransactionOutput],
+        blockHash: str,
+        blockIndex: int,
+        filename: str) -> None:
+    """
+    Writes the UTXO as of the given block to a snapshot file. The file is
+    written next to its final name and then renamed, so an existing
+    snapshot is only replaced by a complete one.
+
+    The UTXO is iterated twice, first to find the addresses and the number
+    of outputs that come before the entries, and then to write the entries
+    a chunk at a time, so only the addresses are held in memory.
+    """
+    addressIds: Dict[str, int] = {}
+    count = 0
+    for outpoint, output in utxo.items():
+        addressIds.setdefault(output.address, len(addressIds))
+        count += 1
+
+    buffer = bytearray(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]))
+    writeHex(buffer, blockHash)
+    writeVarint(buffer, blockIndex)
+    writeVarint(buffer, len(addressIds))
+    for address in addressIds:
+        writeHex(buffer, address)
+    writeVarint(buffer, count)
+
+    temporary = filename + ".tmp"
+    checksum = hashlib.sha256()
+    try:
+        with open(temporary, "wb") as f:
+            written = 0
+            for outpoint, output in utxo.items():
+                addressId = addressIds.get(output.address, None)
+                if addressId is None or written == count:
+                    raise SnapshotException("UTXO changed while writing.")
+                writeHex(buffer, outpoint[0])
+                writeVarint(buffer, outpoint[1])
+                writeVarint(buffer, output.amount)
+                writeVarint(buffer, addressId)
+                written += 1
+                if len(buffer) >= READ_SIZE:
+                    _writeChunk(f, checksum, buffer)
+
+            if written != count:
+                raise SnapshotException("UTXO changed while writing.")
+            _writeChunk(f, checksum, buffer)
+            f.write(checksum.digest())
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, filename)
+
+
+def _writeChunk(f: BinaryIO, checksum: "hashlib._Hash", buffer: bytearray) \
+        -> None:
+    checksum.update(buffer)
+    f.write(buffer)
+    buffer.clear()
+
+
+def readSnapshot(filename: str) \
+        -> Tuple[str, int, Iterator[Tuple[Outpoint, TransactionOutput]]]:
+    """
+    Reads a snapshot file, returning the hash and index of its block and
+    an iterator over its unspent outputs, which are read from the file a
+    chunk at a time as they are iterated. The checksum is verified before
+    anything is returned. A SnapshotException is raised if the checksum
+    does not match or the data is malformed, which for the outputs is
+    only found while iterating over them.
+    """
+    size = os.path.getsize(filename)
+    header = len(SNAPSHOT_MAGIC) + 1
+    end = size - CHECKSUM_SIZE
+
+    with open(filename, "rb") as f:
+        prefix = f.read(header)
+        if size < header + CHECKSUM_SIZE or \
+                prefix[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise SnapshotException("File is not a UTXO snapshot.")
+
+        if prefix[len(SNAPSHOT_MAGIC)] != SNAPSHOT_VERSION:
+            raise SnapshotException("Unsupported snapshot version.")
+
+        f.seek(0)
+        checksum = hashlib.sha256()
+        remaining = end
+        while remaining > 0:
+            chunk = f.read(min(READ_SIZE, remaining))
+            checksum.update(chunk)
+            remaining -= len(chunk)
+        if checksum.digest() != f.read(CHECKSUM_SIZE):
+            raise SnapshotException("Snapshot checksum does not match.")
+
+        f.seek(header)
+        reader = _SnapshotReader(f, end - header)
+        try:
+            blockHash = reader.readHex()
+            blockIndex = reader.readVarint()
+
+            addressCount = reader.readVarint()
+            addresses: List[str] = []
+            for i in range(addressCount):
+                addresses.append(reader.readHex())
+
+            count = reader.readVarint()
+        except DecodeException as e:
+            raise SnapshotException("Snapshot is malformed: {}".format(e))
+        offset = reader.tell()
+
+    return blockHash, blockIndex, _readOutputs(
+        filename, offset, end, addresses, count)
+
+
+def _readOutputs(
+        filename: str,
+        offset: int,
+        end: int,
+        addresses: List[str],
+        count: int) -> Iterator[Tuple[Outpoint, TransactionOutput]]:
+    """
+    Reads the entries of a snapshot, which start at offset and end at end.
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        reader = _SnapshotReader(f, end - offset)
+        for i in range(count):
+            try:
+                txHash = reader.readHex()
+                index = reader.readVarint()
+                amount = reader.readVarint()
+                address = addresses[reader.readVarint()]
+            except (DecodeException, IndexError) as e:
+                raise SnapshotException(
+                    "Snapshot is malformed: {}".format(e))
+            yield (txHash, index), TransactionOutput(amount, address)
+
+        if not reader.atEnd():
+            raise SnapshotException("Snapshot has trailing data.")
+
+
+class _SnapshotReader:
+    """
+    Reads varints and hex strings from part of a snapshot file, keeping
+    only a chunk of it in memory at a time.
+    """
+    def __init__(self, f: BinaryIO, length: int) -> None:
+        self.f = f
+        self.remaining = length
+        self.buffer = b""
+        self.offset = 0
+
+    def readVarint(self) -> int:
+        self._fill(MAX_VARINT_SIZE)
+        value, self.offset = readVarint(self.buffer, self.offset)
+        return value
+
+    def readHex(self) -> str:
+        length = self.readVarint()
+        self._fill(length)
+        end = self.offset + length
+        if end > len(self.buffer):
+            raise DecodeException("Byte string is truncated.")
+
+        value = self.buffer[self.offset:end].hex()
+        self.offset = end
+        return value
+
+    def tell(self) -> int:
+        """
+        Returns the file position of the next byte to read.
+        """
+        return self.f.tell() - (len(self.buffer) - self.offset)
+
+    def atEnd(self) -> bool:
+        return self.remaining == 0 and self.offset == len(self.buffer)
+
+    def _fill(self, size: int) -> None:
+        """
+        Reads another chunk if fewer than size bytes are buffered.
+        """
+        if len(self.buffer) - self.offset >= size or self.remaining == 0:
+            return
+
+        chunk = self.f.read(min(max(size, READ_SIZE), self.remaining))
+        self.remaining -= len(chunk)
+        if len(chunk) == 0:
+            self.remaining = 0
+        self.buffer = self.buffer[self.offset:] + chunk
+        self.offset = 0
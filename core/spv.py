@@ -0,0 +1,217 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import core.block as block
+from core.chain import Chain, ChainListener, Header, extendHeaderChain
+from core.chain import getLocator
+from core.difficulty import DifficultyWindow, getWork
+from core.merkle import MerkleProof
+from core.settings import SPV_CONFIRMATIONS
+
+
+class SPVException(Exception):
+    """
+    Exception class for headers and proofs rejected by an SPV client.
+    """
+
+
+class ProofSource(ABC):
+    """
+    Answers the requests of an SPV client, which is usually done by a full
+    node.
+    """
+    @abstractmethod
+    def getHeaders(self, locator: List[str]) -> List[block.BlockHeader]:
+        """
+        Returns the main chain's headers after the first block of the
+        locator that is in the main chain, oldest first.
+        """
+
+    @abstractmethod
+    def getTransactionProof(
+            self,
+            transactionHash: str) -> Optional[Tuple[str, MerkleProof]]:
+        """
+        Returns the hash of the main chain's block holding a transaction
+        along with the Merkle proof of it, or None if no block holds it.
+        """
+
+
+class ChainProofSource(ProofSource, ChainListener):
+    """
+    Serves headers and proofs from a full chain. It listens to the chain
+    to keep an index from each transaction of the main chain to its block.
+    """
+    def __init__(self, chain: Chain) -> None:
+        self.chain = chain
+        self.transactionBlocks: Dict[str, str] = {}
+        for blockHash in chain.mainChain:
+            self.blockConnected(chain.blocks[blockHash])
+        chain.addListener(self)
+
+    def close(self) -> None:
+        self.chain.removeListener(self)
+
+    def getHeaders(self, locator: List[str]) -> List[block.BlockHeader]:
+        return self.chain.getHeadersAfter(locator)
+
+    def getTransactionProof(
+            self,
+            transactionHash: str) -> Optional[Tuple[str, MerkleProof]]:
+        blockHash = self.transactionBlocks.get(transactionHash, None)
+        if blockHash is None:
+            return None
+
+        containingBlock = self.chain.blocks[blockHash]
+        return blockHash, containingBlock.getTransactionProof(transactionHash)
+
+    def blockConnected(self, connectedBlock: block.Block) -> None:
+        for tx in connectedBlock.transactions:
+            self.transactionBlocks[tx.hash] = connectedBlock.hash
+
+    def blockDisconnected(self, disconnectedBlock: block.Block) -> None:
+        for tx in disconnectedBlock.transactions:
+            if self.transactionBlocks.get(tx.hash, None) == \
+                    disconnectedBlock.hash:
+                del self.transactionBlocks[tx.hash]
+
+
+class SPVClient:
+    """
+    A light client that follows the chain with headers only.
+
+    Headers are verified for their linkage, difficulty and proof of work,
+    and the main chain is the header chain with the most work. Payments
+    are verified with the Merkle proofs of the watched transactions, so
+    the memory used grows with the number of headers and not with the
+    transactions of the chain.
+    """
+    def __init__(self, confirmations: int = SPV_CONFIRMATIONS) -> None:
+        self.confirmations = confirmations
+
+        genesis = block.genesisBlock().getHeader()
+        self.headers: Dict[str, block.BlockHeader] = {genesis.hash: genesis}
+        self.chainWork: Dict[str, int] = {
+            genesis.hash: getWork(genesis.difficulty)}
+        self.windows: Dict[str, DifficultyWindow] = {
+            genesis.hash: DifficultyWindow([genesis.timestamp])}
+        self.head = genesis
+
+        # Main chain holds the hash of the main chain's header at each
+        # height, from the genesis block to the head.
+        self.mainChain: List[str] = [genesis.hash]
+
+        # Watched maps the transactions of interest to the block holding
+        # them, or None until a valid proof is received.
+        self.watched: Dict[str, Optional[str]] = {}
+
+    def addHeader(self, nextHeader: block.BlockHeader) -> None:
+        """
+        Adds a header, moving the head if it has the most work.
+        """
+        if nextHeader.hash in self.headers:
+            return
+
+        previousHeader = self.headers.get(nextHeader.previousHash, None)
+        if previousHeader is None:
+            raise SPVException(
+                "New header's previous header is not in the chain.")
+
+        isVerified, msg = extendHeaderChain(
+            previousHeader,
+            nextHeader,
+            self.windows,
+            self.chainWork,
+            self._getPreviousHeader)
+        if not isVerified:
+            raise SPVException(
+                "New header could not be verified." +
+                "\n" + "Message: " + msg)
+
+        self.headers[nextHeader.hash] = nextHeader
+        if self.chainWork[nextHeader.hash] > self.chainWork[self.head.hash]:
+            self._updateHead(nextHeader)
+
+    def addHeaders(self, newHeaders: List[block.BlockHeader]) -> None:
+        for newHeader in newHeaders:
+            self.addHeader(newHeader)
+
+    def getLocator(self) -> List[str]:
+        return getLocator(self.mainChain)
+
+    def sync(self, source: ProofSource) -> None:
+        """
+        Downloads and adds the headers a source has after the head, and
+        then requests proofs for the watched transactions that have none.
+        """
+        self.addHeaders(source.getHeaders(self.getLocator()))
+
+        for transactionHash, blockHash in list(self.watched.items()):
+            if blockHash is not None and self._isInMainChain(blockHash):
+                continue
+
+            self.watched[transactionHash] = None
+            answer = source.getTransactionProof(transactionHash)
+            if answer is not None:
+                self.addTransactionProof(transactionHash, *answer)
+
+    def watchTransaction(self, transactionHash: str) -> None:
+        self.watched.setdefault(transactionHash, None)
+
+    def addTransactionProof(
+            self,
+            transactionHash: str,
+            blockHash: str,
+            proof: MerkleProof) -> None:
+        """
+        Records the block holding a watched transaction, once the proof is
+        verified against the header of that block.
+        """
+        header = self.headers.get(blockHash, None)
+        if header is None:
+            raise SPVException("Proof is for an unknown block.")
+
+        if not header.verifyTransactionProof(transactionHash, proof):
+            raise SPVException("Transaction proof is invalid.")
+
+        self.watched[transactionHash] = blockHash
+
+    def getConfirmations(self, transactionHash: str) -> int:
+        """
+        Returns the number of main chain blocks from the block holding the
+        transaction to the head, or 0 if it is not in the main chain.
+        """
+        blockHash = self.watched.get(transactionHash, None)
+        if blockHash is None or not self._isInMainChain(blockHash):
+            return 0
+
+        return self.head.index - self.headers[blockHash].index + 1
+
+    def isConfirmed(self, transactionHash: str) -> bool:
+        return self.getConfirmations(transactionHash) >= self.confirmations
+
+    def _updateHead(self, newHead: block.BlockHeader) -> None:
+        """
+        Moves the head to a header with more work, replacing the main
+        chain's headers from the common ancestor.
+        """
+        newChain: List[str] = []
+        current = newHead
+        while not self._isInMainChain(current.hash):
+            newChain.append(current.hash)
+            current = self.headers[current.previousHash]
+
+        del self.mainChain[current.index + 1:]
+        self.mainChain.extend(reversed(newChain))
+        self.head = newHead
+
+    def _isInMainChain(self, blockHash: str) -> bool:
+        header = self.headers.get(blockHash, None)
+        return header is not None and \
+            header.index < len(self.mainChain) and \
+            self.mainChain[header.index] == blockHash
+
+    def _getPreviousHeader(
+            self,
+            header: Header) -> Optional[block.BlockHeader]:
+        return self.headers.get(header.previousHash, None)
@@ -0,0 +1,383 @@
+import os
+import struct
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import core.block as block
+from core.settings import BLOCK_CACHE_SIZE, BLOCK_STORE_SEGMENT_SIZE
+
+
+class BlockStoreException(Exception):
+    pass
+
+
+INDEX_FILENAME = "index.dat"
+SEGMENT_FILENAME = "blk{:05d}.dat"
+
+# Index records are fixed size: flags, hash, previous hash, index,
+# timestamp, noonce, difficulty, segment number, payload offset and
+# payload length. Undo records point to the block's undo payload instead
+# of the block itself.
+INDEX_RECORD = struct.Struct("<B32s32sQdQBIQI")
+FLAG_STORED = 0
+FLAG_REMOVED = 1
+FLAG_UNDO = 2
+
+RECORD_LENGTH = struct.Struct("<I")
+
+
+class StoredHeader:
+    """
+    The header fields of a stored block, along with where its full data
+    and its undo record, if it has one, are kept. These are all that is
+    loaded when a store is opened.
+    """
+    __slots__ = (
+        "hash", "previousHash", "index", "timestamp", "noonce", "difficulty",
+        "segment", "offset", "length",
+        "undoSegment", "undoOffset", "undoLength")
+
+    def __init__(
+            self,
+            hash: str,
+            previousHash: str,
+            index: int,
+            timestamp: float,
+            noonce: int,
+            difficulty: int,
+            segment: int,
+            offset: int,
+            length: int) -> None:
+        self.hash = hash
+        self.previousHash = previousHash
+        self.index = index
+        self.timestamp = timestamp
+        self.noonce = noonce
+        self.difficulty = difficulty
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.undoSegment = -1
+        self.undoOffset = 0
+        self.undoLength = 0
+
+    @property
+    def hasUndo(self) -> bool:
+        return self.undoSegment >= 0
+
+
+class BlockStore:
+    """
+    An append-only store of blocks in a directory.
+
+    Blocks are appended to segment files (blk00000.dat, blk00001.dat, ...)
+    as a 4 byte length followed by the encoded block. A new segment is
+    started once the current one reaches segmentSize bytes. The index file
+    has one fixed size record per block with its header fields and its
+    location, and removing a block appends a record marking it as removed.
+    A block's undo record is appended to the segments in the same way,
+    with an index record pointing to it. A partial index record left by a
+    crash is truncated when the store is opened, so that the records
+    appended after it stay aligned.
+    """
+    def __init__(
+            self,
+            directory: str,
+            segmentSize: int = BLOCK_STORE_SEGMENT_SIZE) -> None:
+        self.directory = directory
+        self.segmentSize = segmentSize
+        os.makedirs(directory, exist_ok=True)
+
+        self._readers: Dict[int, BinaryIO] = {}
+
+        self.segment = 0
+        while os.path.exists(self._segmentPath(self.segment + 1)):
+            self.segment += 1
+
+        self._writer = open(self._segmentPath(self.segment), "ab")
+
+        indexPath = os.path.join(directory, INDEX_FILENAME)
+        if os.path.exists(indexPath):
+            size = os.path.getsize(indexPath)
+            if size % INDEX_RECORD.size != 0:
+                with open(indexPath, "r+b") as f:
+                    f.truncate(size - size % INDEX_RECORD.size)
+        self._index = open(indexPath, "ab")
+
+    def append(self, newBlock: block.Block) -> StoredHeader:
+        """
+        Writes a block to the end of the current segment and indexes it.
+        """
+        payload = encodeBlock(newBlock)
+        segment, offset = self._appendPayload(payload)
+
+        header = StoredHeader(
+            hash=newBlock.hash,
+            previousHash=newBlock.previousHash,
+            index=newBlock.index,
+            timestamp=newBlock.timestamp,
+            noonce=newBlock.noonce,
+            difficulty=newBlock.difficulty,
+            segment=segment,
+            offset=offset,
+            length=len(payload))
+        self._writeIndex(FLAG_STORED, header)
+        return header
+
+    def appendUndo(self, header: StoredHeader, payload: bytes) -> None:
+        """
+        Writes the undo record of a stored block and indexes it, updating
+        the header with its location.
+        """
+        segment, offset = self._appendPayload(payload)
+        header.undoSegment = segment
+        header.undoOffset = offset
+        header.undoLength = len(payload)
+        self._writeIndex(FLAG_UNDO, header)
+
+    def remove(self, header: StoredHeader) -> None:
+        """
+        Marks a block as removed. Its data stays in the segment file.
+        """
+        self._writeIndex(FLAG_REMOVED, header)
+
+    def read(self, header: StoredHeader) -> block.Block:
+        """
+        Reads the full block for a header.
+        """
+        return decodeBlock(self._readPayload(
+            header.hash, header.segment, header.offset, header.length))
+
+    def readUndo(self, header: StoredHeader) -> bytes:
+        """
+        Reads the undo record for a header that has one.
+        """
+        if not header.hasUndo:
+            raise BlockStoreException(
+                "Block {} has no undo record.".format(header.hash))
+
+        return self._readPayload(
+            header.hash,
+            header.undoSegment,
+            header.undoOffset,
+            header.undoLength)
+
+    def loadHeaders(self) -> "OrderedDict[str, StoredHeader]":
+        """
+        Reads the index and returns the headers of all blocks that have
+        not been removed, in the order they were stored.
+        """
+        headers: "OrderedDict[str, StoredHeader]" = OrderedDict()
+        path = os.path.join(self.directory, INDEX_FILENAME)
+        with open(path, "rb") as f:
+            while True:
+                record = f.read(INDEX_RECORD.size)
+                if len(record) < INDEX_RECORD.size:
+                    break
+
+                flags, header = _unpackIndexRecord(record)
+                if flags == FLAG_REMOVED:
+                    headers.pop(header.hash, None)
+                elif flags == FLAG_UNDO:
+                    stored = headers.get(header.hash, None)
+                    if stored is not None:
+                        stored.undoSegment = header.segment
+                        stored.undoOffset = header.offset
+                        stored.undoLength = header.length
+                else:
+                    headers[header.hash] = header
+
+        return headers
+
+    def close(self) -> None:
+        self._writer.close()
+        self._index.close()
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+    def _appendPayload(self, payload: bytes) -> Tuple[int, int]:
+        """
+        Writes a length prefixed payload to the current segment, starting
+        a new one if it is full. Returns the segment and the offset of the
+        payload.
+        """
+        offset = self._writer.tell()
+        if offset > 0 and \
+                offset + RECORD_LENGTH.size + len(payload) > self.segmentSize:
+            self._writer.close()
+            self.segment += 1
+            self._writer = open(self._segmentPath(self.segment), "ab")
+            offset = 0
+
+        self._writer.write(RECORD_LENGTH.pack(len(payload)))
+        self._writer.write(payload)
+        self._writer.flush()
+        return self.segment, offset + RECORD_LENGTH.size
+
+    def _readPayload(
+            self,
+            blockHash: str,
+            segment: int,
+            offset: int,
+            length: int) -> bytes:
+        reader = self._readers.get(segment, None)
+        if reader is None:
+            reader = open(self._segmentPath(segment), "rb")
+            self._readers[segment] = reader
+
+        reader.seek(offset)
+        payload = reader.read(length)
+        if len(payload) != length:
+            raise BlockStoreException(
+                "Block {} is truncated in segment {}.".format(
+                    blockHash, segment))
+
+        return payload
+
+    def _writeIndex(self, flags: int, header: StoredHeader) -> None:
+        segment, offset, length = header.segment, header.offset, header.length
+        if flags == FLAG_UNDO:
+            segment = header.undoSegment
+            offset = header.undoOffset
+            length = header.undoLength
+
+        self._index.write(INDEX_RECORD.pack(
+            flags,
+            bytes.fromhex(header.hash),
+            bytes.fromhex(header.previousHash),
+            header.index,
+            header.timestamp,
+            header.noonce,
+            header.difficulty,
+            segment,
+            offset,
+            length))
+        self._index.flush()
+
+    def _segmentPath(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT_FILENAME.format(segment))
+
+
+def _unpackIndexRecord(record: bytes) -> Tuple[int, StoredHeader]:
+    (flags, hash, previousHash, index, timestamp, noonce, difficulty,
+        segment, offset, length) = INDEX_RECORD.unpack(record)
+
+    # The genesis block has no previous hash, which is stored as zeros.
+    return flags, StoredHeader(
+        hash=hash.hex(),
+        previousHash=previousHash.hex() if any(previousHash) else "",
+        index=index,
+        timestamp=timestamp,
+        noonce=noonce,
+        difficulty=difficulty,
+        segment=segment,
+        offset=offset,
+        length=length)
+
+
+def encodeBlock(newBlock: block.Block) -> bytes:
+    return newBlock.asBytes()
+
+
+def decodeBlock(payload: bytes) -> block.Block:
+    return block.createFromBytes(payload)
+
+
+class BlockMap:
+    """
+    A mapping from block hash to block that is backed by a BlockStore.
+
+    Only the stored headers are kept in memory. Full blocks are read from
+    disk when they are looked up, and the last cacheSize of them are kept
+    in a least recently used cache.
+    """
+    def __init__(
+            self,
+            store: BlockStore,
+            cacheSize: int = BLOCK_CACHE_SIZE) -> None:
+        self.store = store
+        self.cacheSize = cacheSize
+        self.headers = store.loadHeaders()
+        self._cache: "OrderedDict[str, block.Block]" = OrderedDict()
+
+    def __contains__(self, blockHash: object) -> bool:
+        return blockHash in self.headers
+
+    def __getitem__(self, blockHash: str) -> block.Block:
+        cached = self._cache.get(blockHash, None)
+        if cached is not None:
+            self._cache.move_to_end(blockHash)
+            return cached
+
+        stored = self.store.read(self.headers[blockHash])
+        self._addToCache(stored)
+        return stored
+
+    def __setitem__(self, blockHash: str, newBlock: block.Block) -> None:
+        if blockHash != newBlock.hash:
+            raise BlockStoreException("Block stored under the wrong hash.")
+
+        if blockHash in self.headers:
+            return
+
+        self.headers[blockHash] = self.store.append(newBlock)
+        self._addToCache(newBlock)
+
+    def __delitem__(self, blockHash: str) -> None:
+        header = self.headers.pop(blockHash)
+        self._cache.pop(blockHash, None)
+        self.store.remove(header)
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.headers)
+
+    def get(self, blockHash: str, default: block.Block = None) -> block.Block:
+        if blockHash not in self.headers:
+            return default
+        return self[blockHash]
+
+    def hasUndo(self, blockHash: str) -> bool:
+        header = self.headers.get(blockHash, None)
+        return header is not None and header.hasUndo
+
+    def getUndo(self, blockHash: str) -> bytes:
+        """
+        Reads the encoded undo record of a stored block.
+        """
+        return self.store.readUndo(self.headers[blockHash])
+
+    def setUndo(self, blockHash: str, payload: bytes) -> None:
+        """
+        Stores the encoded undo record of a stored block. A block's undo
+        record does not change, so it is only written once.
+        """
+        header = self.headers[blockHash]
+        if not header.hasUndo:
+            self.store.appendUndo(header, payload)
+
+    def getHeaderChain(self, blockHash: str) -> List[StoredHeader]:
+        """
+        Returns the stored headers from the genesis block up to and
+        including the given block, without reading any block data.
+        """
+        headers: List[StoredHeader] = []
+        header = self.headers.get(blockHash, None)
+        while header is not None:
+            headers.append(header)
+            header = self.headers.get(header.previousHash, None)
+
+        headers.reverse()
+        return headers
+
+    def close(self) -> None:
+        self.store.close()
+
+    def _addToCache(self, newBlock: block.Block) -> None:
+        self._cache[newBlock.hash] = newBlock
+        self._cache.move_to_end(newBlock.hash)
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
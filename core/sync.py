@@ -0,0 +1,131 @@
+import queue
+import struct
+import threading
+from typing import BinaryIO, Iterator
+
+import core.block as block
+from core.chain import Chain, DuplicateBlockException
+from core.settings import MAX_BLOCK_SIZE, SYNC_QUEUE_SIZE
+
+
+class SyncException(Exception):
+    pass
+
+
+# Chain streams start with a magic string and a version, followed by one
+# length prefixed binary block per record from the genesis block to the head.
+STREAM_MAGIC = b"SPCC"
+STREAM_VERSION = 1
+RECORD_LENGTH = struct.Struct("<I")
+
+# Marks the end of the stream on the import queue.
+_END_OF_STREAM = object()
+
+
+def exportChain(chain: Chain, stream: BinaryIO) -> int:
+    """
+    Writes the main chain from the genesis block to the head to a stream.
+    Blocks are encoded one at a time. Returns the number of blocks written.
+    """
+    hashes = list(chain.mainChain)
+
+    stream.write(STREAM_MAGIC + bytes([STREAM_VERSION]))
+    for blockHash in hashes:
+        payload = chain.blocks[blockHash].asBytes()
+        stream.write(RECORD_LENGTH.pack(len(payload)))
+        stream.write(payload)
+
+    return len(hashes)
+
+
+def readChain(
+        stream: BinaryIO,
+        maxBlockSize: int = MAX_BLOCK_SIZE) -> Iterator[block.Block]:
+    """
+    Reads the blocks of a chain stream one at a time. A record longer than
+    maxBlockSize is rejected before it is read, so a corrupt length can
+    not make the reader allocate more than that.
+    """
+    header = stream.read(len(STREAM_MAGIC) + 1)
+    if header[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+        raise SyncException("Stream is not a chain stream.")
+
+    if header[len(STREAM_MAGIC):] != bytes([STREAM_VERSION]):
+        raise SyncException("Unsupported chain stream version.")
+
+    while True:
+        prefix = stream.read(RECORD_LENGTH.size)
+        if len(prefix) == 0:
+            return
+        if len(prefix) < RECORD_LENGTH.size:
+            raise SyncException("Chain stream is truncated.")
+
+        length = RECORD_LENGTH.unpack(prefix)[0]
+        if length > maxBlockSize:
+            raise SyncException(
+                "Chain stream record of {} bytes is too large.".format(length))
+
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise SyncException("Chain stream is truncated.")
+
+        yield block.createFromBytes(payload)
+
+
+def importChain(
+        chain: Chain,
+        stream: BinaryIO,
+        queueSize: int = SYNC_QUEUE_SIZE) -> int:
+    """
+    Adds the blocks of a chain stream to a chain, returning the number of
+    new blocks added. Blocks that are already in the chain are skipped.
+
+    Reading and decoding (which hashes every transaction) happen on a
+    separate thread from validating and connecting the blocks. At most
+    queueSize decoded blocks are held between the two, so memory does not
+    grow with the size of the stream.
+    """
+    blocks: queue.Queue = queue.Queue(maxsize=queueSize)
+    stopEvent = threading.Event()
+
+    def put(item: object) -> bool:
+        while not stopEvent.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read() -> None:
+        try:
+            for nextBlock in readChain(stream):
+                if not put(nextBlock):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(_END_OF_STREAM)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    added = 0
+    try:
+        while True:
+            item = blocks.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            try:
+                chain.addBlock(item)
+            except DuplicateBlockException:
+                continue
+            added += 1
+    finally:
+        stopEvent.set()
+        reader.join()
+
+    return added
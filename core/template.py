@@ -0,0 +1,177 @@
+import threading
+import time
+from typing import Optional
+
+from core.block import Block, MiningHeader
+from core.chain import Chain, ChainListener
+from core.mempool import Mempool, MempoolListener
+from core.mine import hasProofOfWorkDigest
+from core.settings import MAX_TRANSACTIONS_PER_BLOCK, MINING_WORK_SIZE
+import core.transaction as transaction
+
+
+class WorkUnit:
+    """
+    A range of noonces, from start up to but not including end, to search
+    for a block header. Template id identifies the template the header
+    was taken from.
+    """
+    __slots__ = ("header", "start", "end", "templateId")
+
+    def __init__(
+            self,
+            header: MiningHeader,
+            start: int,
+            end: int,
+            templateId: int) -> None:
+        self.header = header
+        self.start = start
+        self.end = end
+        self.templateId = templateId
+
+
+class TemplateBuilder(ChainListener, MempoolListener):
+    """
+    Maintains the next block to mine on top of a chain's head and hands
+    out work units for it.
+
+    The template is a mining header for a coinbase paying the given
+    address followed by the oldest transactions of the mempool. New
+    pending transactions are appended while the block has room by
+    extending the header's transaction root. The template is only rebuilt
+    when the head changes or one of its transactions leaves the mempool,
+    and the rebuild is done when work is next requested, so a
+    reorganization rebuilds it once. Each work unit is a new range of
+    noonces, so workers never search the same noonces for a template.
+    """
+    def __init__(
+            self,
+            chain: Chain,
+            mempool: Mempool,
+            coinbaseAddress: str,
+            workSize: int = MINING_WORK_SIZE) -> None:
+        self.chain = chain
+        self.mempool = mempool
+        self.coinbaseAddress = coinbaseAddress
+        self.workSize = workSize
+
+        self.header: MiningHeader = None
+        self.templateId = 0
+        self.rebuilds = 0
+        self.extensions = 0
+        self._nextNoonce = 0
+        self._outdated = True
+        self._lock = threading.Lock()
+
+        chain.addListener(self)
+        mempool.addListener(self)
+
+    def close(self) -> None:
+        """
+        Stops listening to the chain and the mempool.
+        """
+        self.chain.removeListener(self)
+        self.mempool.removeListener(self)
+
+    def getWork(self) -> Optional[WorkUnit]:
+        """
+        Returns the next range of noonces to search for the current
+        template, or None if the template only holds its coinbase. A block
+        needs a transaction besides the coinbase to be valid, so there is
+        no work until the mempool has one.
+        """
+        with self._lock:
+            if self._outdated:
+                self._rebuild()
+
+            if len(self.header.transactions) < 2:
+                return None
+
+            start = self._nextNoonce
+            self._nextNoonce += self.workSize
+            return WorkUnit(
+                self.header, start, self._nextNoonce, self.templateId)
+
+    def isStale(self, unit: WorkUnit) -> bool:
+        """
+        Returns true if a block found for the work unit would no longer
+        extend the head. Work from older templates on the same head is
+        still valid, but has fewer transactions.
+        """
+        return unit.header.previousHash != self.chain.head.hash
+
+    def submit(self, unit: WorkUnit, noonce: int) -> Block:
+        """
+        Creates the block found for a work unit and adds it to the chain.
+        """
+        newBlock = unit.header.createBlock(noonce)
+        self.chain.addBlock(newBlock)
+        return newBlock
+
+    def blockConnected(self, connectedBlock: Block) -> None:
+        with self._lock:
+            self._outdated = True
+
+    def blockDisconnected(self, disconnectedBlock: Block) -> None:
+        with self._lock:
+            self._outdated = True
+
+    def transactionAdded(
+            self,
+            addedTransaction: transaction.Transaction) -> None:
+        with self._lock:
+            if self._outdated:
+                return
+            if len(self.header.transactions) >= MAX_TRANSACTIONS_PER_BLOCK:
+                return
+
+            # The mempool is ordered by arrival, so when the template has
+            # room it holds the whole pool, including the new transaction's
+            # pending parents.
+            self._setHeader(self.header.extend(addedTransaction))
+            self.extensions += 1
+
+    def transactionRemoved(
+            self,
+            removedTransaction: transaction.Transaction) -> None:
+        with self._lock:
+            if self._outdated:
+                return
+
+            for tx in self.header.transactions:
+                if tx.hash == removedTransaction.hash:
+                    self._outdated = True
+                    return
+
+    def _rebuild(self) -> None:
+        head = self.chain.head
+        timestamp = time.time()
+        transactions = self.mempool.createBlockTemplate(
+            self.coinbaseAddress, timestamp)
+
+        self._setHeader(MiningHeader(
+            head.index + 1,
+            timestamp,
+            transactions,
+            head.hash,
+            self.chain.getNextDifficulty(head)))
+        self._outdated = False
+        self.rebuilds += 1
+
+    def _setHeader(self, header: MiningHeader) -> None:
+        self.header = header
+        self.templateId += 1
+        self._nextNoonce = 0
+
+
+def searchWorkUnit(unit: WorkUnit) -> Optional[int]:
+    """
+    Searches the noonces of a work unit, returning the first one that
+    gives a proof of work, or None if there is none in the range.
+    """
+    header = unit.header
+    for noonce in range(unit.start, unit.end):
+        if hasProofOfWorkDigest(header.digest(noonce), header.difficulty):
+            return noonce
+
+    return None
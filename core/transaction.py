@@ -1,5 +1,14 @@
+from collections import OrderedDict
 from typing import List, Tuple
 import json
+import sys
+import threading
+import time
+
+from core.encoding import SERIALIZATION_VERSION, readVersion, DecodeException
+from core.encoding import writeVarint, readVarint, writeHex, readHex
+from core.encoding import writeNumber, readNumber
+from core.settings import KEY_CACHE_SIZE, SIGNATURE_CACHE_SIZE
 
 from Crypto.Signature import PKCS1_PSS
 from Crypto.PublicKey import RSA
@@ -7,6 +16,8 @@ from Crypto.Hash import SHA256
 
 
 class TransactionInput:
+    __slots__ = ("referencedHash", "referencedOutputIndex", "signature")
+
     def __init__(
             self,
             referencedHash: str,
@@ -16,6 +27,13 @@ class TransactionInput:
         self.referencedOutputIndex = referencedOutputIndex
         self.signature = signature
 
+    def asDict(self) -> dict:
+        return {
+            "referencedHash": self.referencedHash,
+            "referencedOutputIndex": self.referencedOutputIndex,
+            "signature": self.signature,
+        }
+
     def serialize(self) -> str:
         return "{}{}{}".format(
             self.referencedHash,
@@ -36,10 +54,21 @@ class TransactionInput:
         Create a transaction signature hash for the signature
         """
         hash = SHA256.new()
-        hash.update(
-            (previousTransactionHash + str(outputIndex) + outputData).encode('utf-8'))
+        hash.update(TransactionInput.createSignatureMessage(
+            previousTransactionHash, outputIndex, outputData))
         return hash
 
+    @staticmethod
+    def createSignatureMessage(
+            previousTransactionHash: str,
+            outputIndex: int,
+            outputData: str) -> bytes:
+        """
+        Create the message that is hashed and signed for the signature
+        """
+        return (previousTransactionHash + str(outputIndex) + outputData) \
+            .encode('utf-8')
+
     @staticmethod
     def createSignature(
             previousTransactionHash: str,
@@ -60,12 +89,19 @@ class TransactionInput:
 
 
 class TransactionOutput:
+    __slots__ = ("amount", "address")
+
     def __init__(
             self,
             amount: int,
             address: str) -> None:
+        # Addresses are interned since many outputs, and the UTXO entries
+        # that share them, pay to the same few addresses.
         self.amount = amount
-        self.address = address
+        self.address = sys.intern(address)
+
+    def asDict(self) -> dict:
+        return {"amount": self.amount, "address": self.address}
 
     @staticmethod
     def serializeMultiple(outputs: List["TransactionOutput"]):
@@ -79,6 +115,8 @@ class TransactionOutput:
 
 
 class Transaction(object):
+    __slots__ = ("inputs", "outputs", "timestamp", "hash")
+
     def __init__(
             self,
             inputs: List[TransactionInput],
@@ -108,31 +146,68 @@ class Transaction(object):
         s = {"inputs": [], "outputs": [], "timestamp": self.timestamp, "hash": self.hash}
 
         for input in self.inputs:
-            s["inputs"].append(input.__dict__.copy())  # type: ignore
+            s["inputs"].append(input.asDict())
 
         for outputs in self.outputs:
-            s["outputs"].append(outputs.__dict__.copy())  # type: ignore
+            s["outputs"].append(outputs.asDict())
         return s
 
     def __repr__(self) -> str:
         return json.dumps(self.asDict(), indent=2)
 
+    def asBytes(self) -> bytes:
+        """
+        Encodes the transaction in the versioned binary format.
+        """
+        buffer = bytearray([SERIALIZATION_VERSION])
+        self.encodeInto(buffer)
+        return bytes(buffer)
+
+    def encodeInto(self, buffer: bytearray) -> None:
+        """
+        Appends the binary encoding of the transaction, without a version.
+        Hashes, signatures and addresses are written as raw bytes, and the
+        transaction hash is not written since it is derived from the data.
+        """
+        writeVarint(buffer, len(self.inputs))
+        for tInput in self.inputs:
+            writeHex(buffer, tInput.referencedHash)
+            writeVarint(buffer, tInput.referencedOutputIndex)
+            writeHex(buffer, tInput.signature)
+
+        writeVarint(buffer, len(self.outputs))
+        for tOutput in self.outputs:
+            writeVarint(buffer, tOutput.amount)
+            writeHex(buffer, tOutput.address)
+
+        writeNumber(buffer, self.timestamp)
+
+
+# A signature check is the address (public key) of the referenced output,
+# the signed message and the signature, all of which can be sent to
+# another process.
+SignatureCheck = Tuple[str, bytes, str]
+
+# An outpoint is the hash of a transaction and the index of one of its
+# outputs.
+Outpoint = Tuple[str, int]
+
 
 def verifyTransactionInput(
         referencedTransaction: Transaction,
         transaction: Transaction,
-        inputIndex: int) -> Tuple[bool, str]:
+        inputIndex: int,
+        checkSignature: bool = True) -> Tuple[bool, str]:
     """
     Verifies that a transaction input referencs a valid transaction output
     with corresponding index. Also checks if the transaction input is properly
-    signed.
+    signed, unless checkSignature is false because the signature was
+    already verified elsewhere.
 
     This method is to verify that a person using a transaction input
     is the same person who recieved it as an output.
     """
     newInput = transaction.inputs[inputIndex]
-    serializedOutputs = \
-        TransactionOutput.serializeMultiple(transaction.outputs)
 
     # Check if referenced index is out of bounds
     index = newInput.referencedOutputIndex
@@ -142,20 +217,187 @@ def verifyTransactionInput(
     if referencedTransaction.hash != newInput.referencedHash:
         return False, "Referenced transaction hash does not match."
 
-    referencedOutput = referencedTransaction.outputs[index]
-    publicKey = RSA.importKey(bytes.fromhex(referencedOutput.address))
-    verifier = PKCS1_PSS.new(publicKey)
-    hash = TransactionInput.createSignatureHash(
+    if checkSignature:
+        return verifyInputSignature(
+            referencedTransaction.outputs[index], transaction, inputIndex)
+
+    return True, ""
+
+
+def verifyInputSignature(
+        referencedOutput: TransactionOutput,
+        transaction: Transaction,
+        inputIndex: int) -> Tuple[bool, str]:
+    """
+    Verifies that a transaction input is signed by the address of the
+    output it references. Inputs in the signature cache are not verified
+    again.
+    """
+    if signatureCache.contains(transaction.hash, inputIndex):
+        return True, ""
+
+    start = time.perf_counter()
+    isValid = verifySignature(*createSignatureCheck(
+        referencedOutput, transaction, inputIndex))
+    signatureCache.recordVerification(time.perf_counter() - start)
+
+    if not isValid:
+        return False, "Signature not valid"
+    signatureCache.add(transaction.hash, inputIndex)
+
+    return True, ""
+
+
+def createSignatureCheck(
+        referencedOutput: TransactionOutput,
+        transaction: Transaction,
+        inputIndex: int) -> SignatureCheck:
+    """
+    Returns the signature check for a transaction input, given the output
+    it references.
+    """
+    newInput = transaction.inputs[inputIndex]
+    message = TransactionInput.createSignatureMessage(
         newInput.referencedHash,
         newInput.referencedOutputIndex,
-        serializedOutputs
+        TransactionOutput.serializeMultiple(transaction.outputs)
     )
-    signature = bytes.fromhex(newInput.signature)
+    return referencedOutput.address, message, newInput.signature
 
-    if not verifier.verify(hash, signature):
-        return False, "Signature not valid"
 
-    return True, ""
+class KeyCache:
+    """
+    A bounded least recently used cache of signature verifiers, keyed by
+    address. Parsing the DER public key in an address is much slower than
+    looking it up, and busy addresses are referenced by many inputs.
+    """
+    def __init__(self, maxSize: int = KEY_CACHE_SIZE) -> None:
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._verifiers: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def getVerifier(self, address: str):
+        """
+        Returns the PKCS1 PSS verifier for the public key in an address.
+        """
+        with self._lock:
+            verifier = self._verifiers.get(address, None)
+            if verifier is not None:
+                self._verifiers.move_to_end(address)
+                self.hits += 1
+                return verifier
+
+        verifier = PKCS1_PSS.new(RSA.importKey(bytes.fromhex(address)))
+
+        with self._lock:
+            self.misses += 1
+            self._verifiers[address] = verifier
+            while len(self._verifiers) > self.maxSize:
+                self._verifiers.popitem(last=False)
+
+        return verifier
+
+    def clear(self) -> None:
+        with self._lock:
+            self._verifiers.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The key cache shared by all signature verification in this process.
+keyCache = KeyCache()
+
+
+class SignatureCache:
+    """
+    A bounded least recently used set of transaction inputs whose
+    signatures have been verified, keyed by transaction hash and input
+    index. A transaction's hash covers the input's reference and signature
+    as well as the signed outputs, so an input that verified once does not
+    need its RSA signature checked again when the same transaction arrives
+    in a block or is reconnected. This relies on transaction hashes
+    matching their data, which is checked before inputs are verified.
+
+    The cache also keeps the time spent verifying signatures, which gives
+    an estimate of the time saved by its hits.
+    """
+    def __init__(self, maxSize: int = SIGNATURE_CACHE_SIZE) -> None:
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verificationTime = 0.0
+        self._verified: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, transactionHash: str, inputIndex: int) -> bool:
+        """
+        Returns true if the input was verified before, counting a hit or
+        a miss.
+        """
+        key = (transactionHash, inputIndex)
+        with self._lock:
+            if key in self._verified:
+                self._verified.move_to_end(key)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def add(self, transactionHash: str, inputIndex: int) -> None:
+        with self._lock:
+            self._verified[(transactionHash, inputIndex)] = True
+            self._verified.move_to_end((transactionHash, inputIndex))
+            while len(self._verified) > self.maxSize:
+                self._verified.popitem(last=False)
+
+    def recordVerification(self, seconds: float, count: int = 1) -> None:
+        """
+        Records the time taken to verify a number of signatures.
+        """
+        with self._lock:
+            self.verifications += count
+            self.verificationTime += seconds
+
+    @property
+    def timeSaved(self) -> float:
+        """
+        Estimates the seconds saved by cache hits, using the average time
+        of the verifications that were done.
+        """
+        if self.verifications == 0:
+            return 0.0
+        return self.hits * self.verificationTime / self.verifications
+
+    def clear(self) -> None:
+        with self._lock:
+            self._verified.clear()
+            self.hits = 0
+            self.misses = 0
+            self.verifications = 0
+            self.verificationTime = 0.0
+
+
+# The signature cache shared by all input verification in this process.
+signatureCache = SignatureCache()
+
+
+def verifySignature(address: str, message: bytes, signature: str) -> bool:
+    """
+    Verifies a signature of a message with the public key in the address.
+    Addresses that are not valid public keys fail the check.
+    """
+    try:
+        verifier = keyCache.getVerifier(address)
+        return bool(verifier.verify(
+            SHA256.new(message), bytes.fromhex(signature)))
+    except Exception:
+        # Malformed keys and signatures raise a variety of exceptions
+        # depending on where the parser gives up.
+        return False
 
 
 def createTransaction(
@@ -226,3 +468,43 @@ def createFromDictionary(transactionDict: dict) -> Transaction:
         ))
 
     return Transaction(inputs, outputs, timestamp)
+
+
+def createFromBytes(data: bytes) -> Transaction:
+    """
+    Creates a transaction from the binary format written by asBytes.
+    """
+    offset = readVersion(data)
+    tx, offset = readTransaction(data, offset)
+    if offset != len(data):
+        raise DecodeException("Unexpected data after the transaction.")
+    return tx
+
+
+def readTransaction(data: bytes, offset: int) -> Tuple[Transaction, int]:
+    """
+    Reads a transaction written by encodeInto. Returns the transaction and
+    the offset after it.
+    """
+    inputs: List[TransactionInput] = []
+    outputs: List[TransactionOutput] = []
+
+    inputCount, offset = readVarint(data, offset)
+    for i in range(inputCount):
+        referencedHash, offset = readHex(data, offset)
+        referencedOutputIndex, offset = readVarint(data, offset)
+        signature, offset = readHex(data, offset)
+        inputs.append(TransactionInput(
+            referencedHash,
+            referencedOutputIndex,
+            signature
+        ))
+
+    outputCount, offset = readVarint(data, offset)
+    for i in range(outputCount):
+        amount, offset = readVarint(data, offset)
+        address, offset = readHex(data, offset)
+        outputs.append(TransactionOutput(amount, address))
+
+    timestamp, offset = readNumber(data, offset)
+    return Transaction(inputs, outputs, timestamp), offset
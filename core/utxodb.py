@@ -0,0 +1,241 @@
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, ItemsView, Iterator, MutableMapping, Optional
+from typing import Tuple
+
+from core.settings import UTXO_CACHE_SIZE, UTXO_FLUSH_SIZE
+from core.transaction import Outpoint, TransactionOutput
+
+
+class MemoryBackend(dict):
+    """
+    Keeps the whole UTXO in a dictionary from outpoint to output.
+    """
+    bestBlock: Optional[str] = None
+
+    def clear(self) -> None:
+        super().clear()
+        self.bestBlock = None
+
+    def blockBoundary(self, blockHash: str) -> None:
+        self.bestBlock = blockHash
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend(MutableMapping):
+    """
+    Keeps the UTXO in a SQLite database, behaving like a dictionary from
+    outpoint to output.
+
+    Changes are kept in a dirty cache in memory and only written to the
+    database at block boundaries, once at least flushSize of them have
+    accumulated, so the database always holds the UTXO as of some block.
+    Outputs read from the database are kept in a least recently used cache
+    of cacheSize entries. Addresses are stored once in their own table.
+
+    The hash of the block the UTXO is for is written along with the
+    changes, so a chain can tell which block the stored UTXO is at and
+    only connect the blocks after it when it is opened again.
+    """
+    def __init__(
+            self,
+            path: str,
+            cacheSize: int = UTXO_CACHE_SIZE,
+            flushSize: int = UTXO_FLUSH_SIZE) -> None:
+        self.path = path
+        self.cacheSize = cacheSize
+        self.flushSize = flushSize
+
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS addresses (
+                id INTEGER PRIMARY KEY,
+                address BLOB NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS utxo (
+                hash BLOB NOT NULL,
+                outputIndex INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                addressId INTEGER NOT NULL,
+                PRIMARY KEY (hash, outputIndex)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL);
+        """)
+
+        # Best block is the hash of the block the UTXO is consistent with
+        # as of the last block boundary, and stored best block is the one
+        # written to the database.
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'bestBlock'").fetchone()
+        self._storedBestBlock: Optional[str] = \
+            None if row is None else row[0].hex()
+        self.bestBlock = self._storedBestBlock
+
+        # Dirty maps changed outpoints to their output, or to None if the
+        # output was removed.
+        self._dirty: Dict[Outpoint, Optional[TransactionOutput]] = {}
+        self._cache: "OrderedDict[Outpoint, TransactionOutput]" = \
+            OrderedDict()
+
+    def __getitem__(self, outpoint: Outpoint) -> TransactionOutput:
+        if outpoint in self._dirty:
+            output = self._dirty[outpoint]
+            if output is None:
+                raise KeyError(outpoint)
+            return output
+
+        output = self._cache.get(outpoint, None)
+        if output is not None:
+            self._cache.move_to_end(outpoint)
+            return output
+
+        row = self._connection.execute(
+            "SELECT utxo.amount, addresses.address FROM utxo "
+            "JOIN addresses ON addresses.id = utxo.addressId "
+            "WHERE utxo.hash = ? AND utxo.outputIndex = ?",
+            (bytes.fromhex(outpoint[0]), outpoint[1])).fetchone()
+        if row is None:
+            raise KeyError(outpoint)
+
+        output = TransactionOutput(row[0], row[1].hex())
+        self._cache[outpoint] = output
+        if len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+        return output
+
+    def __setitem__(
+            self,
+            outpoint: Outpoint,
+            output: TransactionOutput) -> None:
+        self._cache.pop(outpoint, None)
+        self._dirty[outpoint] = output
+
+    def __delitem__(self, outpoint: Outpoint) -> None:
+        # Raises a KeyError if the output does not exist.
+        self[outpoint]
+        self._cache.pop(outpoint, None)
+        self._dirty[outpoint] = None
+
+    def __iter__(self) -> Iterator[Outpoint]:
+        # The rows are read from the cursor as they are iterated, so the
+        # whole UTXO is never held in memory.
+        rows = self._connection.execute("SELECT hash, outputIndex FROM utxo")
+        for txHash, index in rows:
+            outpoint = (txHash.hex(), index)
+            if outpoint not in self._dirty:
+                yield outpoint
+
+        for outpoint, output in list(self._dirty.items()):
+            if output is not None:
+                yield outpoint
+
+    def items(self) -> ItemsView[Outpoint, TransactionOutput]:
+        return _SQLiteItemsView(self)
+
+    def iterItems(self) -> Iterator[Tuple[Outpoint, TransactionOutput]]:
+        """
+        Iterates over the outputs with a single query, instead of looking
+        up each outpoint on its own.
+        """
+        rows = self._connection.execute(
+            "SELECT utxo.hash, utxo.outputIndex, utxo.amount, "
+            "addresses.address FROM utxo "
+            "JOIN addresses ON addresses.id = utxo.addressId")
+        for txHash, index, amount, address in rows:
+            outpoint = (txHash.hex(), index)
+            if outpoint not in self._dirty:
+                yield outpoint, TransactionOutput(amount, address.hex())
+
+        for outpoint, output in list(self._dirty.items()):
+            if output is not None:
+                yield outpoint, output
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self) -> None:
+        self._dirty = {}
+        self._cache = OrderedDict()
+        self.bestBlock = None
+        self._storedBestBlock = None
+        with self._connection:
+            self._connection.execute("DELETE FROM utxo")
+            self._connection.execute(
+                "DELETE FROM meta WHERE key = 'bestBlock'")
+
+    def blockBoundary(self, blockHash: str) -> None:
+        """
+        Called once the UTXO is consistent with a block. Writes the dirty
+        cache if it has grown past the flush size.
+        """
+        self.bestBlock = blockHash
+        if len(self._dirty) >= self.flushSize:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all the changes in the dirty cache, along with the best
+        block, in one transaction.
+        """
+        if len(self._dirty) == 0 and \
+                self.bestBlock == self._storedBestBlock:
+            return
+
+        removed = []
+        added = []
+        addressIds: Dict[str, int] = {}
+        with self._connection:
+            for outpoint, output in self._dirty.items():
+                key = (bytes.fromhex(outpoint[0]), outpoint[1])
+                if output is None:
+                    removed.append(key)
+                    continue
+
+                addressId = addressIds.get(output.address, None)
+                if addressId is None:
+                    addressId = self._getAddressId(output.address)
+                    addressIds[output.address] = addressId
+                added.append(key + (output.amount, addressId))
+
+            self._connection.executemany(
+                "DELETE FROM utxo WHERE hash = ? AND outputIndex = ?",
+                removed)
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO utxo VALUES (?, ?, ?, ?)", added)
+
+            if self.bestBlock is None:
+                self._connection.execute(
+                    "DELETE FROM meta WHERE key = 'bestBlock'")
+            else:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('bestBlock', ?)",
+                    (bytes.fromhex(self.bestBlock),))
+
+        self._dirty = {}
+        self._storedBestBlock = self.bestBlock
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+    def _getAddressId(self, address: str) -> int:
+        raw = bytes.fromhex(address)
+        self._connection.execute(
+            "INSERT OR IGNORE INTO addresses (address) VALUES (?)", (raw,))
+        return self._connection.execute(
+            "SELECT id FROM addresses WHERE address = ?", (raw,)).fetchone()[0]
+
+
+class _SQLiteItemsView(ItemsView):
+    """
+    The items of a SQLiteBackend, iterated with a single query.
+    """
+    _mapping: SQLiteBackend
+
+    def __iter__(self) -> Iterator[Tuple[Outpoint, TransactionOutput]]:
+        return self._mapping.iterItems()
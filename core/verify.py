@@ -0,0 +1,70 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+from core.settings import SIGNATURE_BATCH_SIZE
+from core.transaction import SignatureCheck, verifySignature
+
+
+class SignatureVerifier:
+    """
+    Verifies the signature checks of a block (or several blocks) on a pool
+    of worker processes.
+
+    Checks are split into batches of batchSize, and the result is returned
+    as soon as any batch has an invalid signature, cancelling the batches
+    that have not started. Lists of at most batchSize checks are verified
+    on the calling process, since sending them to a worker costs more than
+    verifying them.
+    """
+    def __init__(
+            self,
+            processes: int = None,
+            batchSize: int = SIGNATURE_BATCH_SIZE) -> None:
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batchSize = batchSize
+        self._executor: ProcessPoolExecutor = None
+
+    def verifyAll(self, checks: List[SignatureCheck]) -> bool:
+        """
+        Returns true if every signature check is valid.
+        """
+        if len(checks) <= self.batchSize:
+            return _verifyBatch(checks)
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes)
+
+        futures = [
+            self._executor.submit(
+                _verifyBatch, checks[i:i + self.batchSize])
+            for i in range(0, len(checks), self.batchSize)
+        ]
+
+        try:
+            for future in as_completed(futures):
+                if not future.result():
+                    return False
+            return True
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def _verifyBatch(checks: List[SignatureCheck]) -> bool:
+    """
+    Verifies a batch of signature checks, stopping at the first invalid one.
+    A check that raises an exception fails.
+    """
+    try:
+        for address, message, signature in checks:
+            if not verifySignature(address, message, signature):
+                return False
+    except Exception:
+        return False
+    return True
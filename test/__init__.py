@@ -1,3 +1,4 @@
+from core import block, mine, transaction
 from Crypto.PublicKey import RSA
 
 private1 = RSA.generate(2048)
@@ -5,4 +6,45 @@ public1 = private1.publickey().exportKey('DER').hex()
 private2 = RSA.generate(2048)
 public2 = private2.publickey().exportKey('DER').hex()
 private3 = RSA.generate(2048)
-public3 = private3.publickey().exportKey('DER').hex()
\ No newline at end of file
+public3 = private3.publickey().exportKey('DER').hex()
+
+
+def mineBlockAt(previousBlock, timestamp, blockDifficulty):
+    """
+    Mines a block with a coinbase and a transaction spending it, at the
+    given timestamp and difficulty.
+    """
+    coinbase = transaction.createTransaction([public1], [1000], timestamp)
+    tx = transaction.createTransaction(
+        outputAddresses=[public2],
+        outputAmounts=[1000],
+        timestamp=timestamp,
+        previousTransactionHashes=[coinbase.hash],
+        previousOutputIndices=[0],
+        privateKeys=[private1]
+    )
+    header = block.MiningHeader(
+        previousBlock.index + 1,
+        timestamp,
+        [coinbase, tx],
+        previousBlock.hash,
+        blockDifficulty)
+    noonce = 0
+    while not mine.hasProofOfWorkDigest(
+            header.digest(noonce), blockDifficulty):
+        noonce += 1
+    return header.createBlock(noonce)
+
+
+def mineBlocks(parent, count, clock, blockDifficulty, addTo=None):
+    """
+    Mines count blocks on top of a parent, taking each timestamp from the
+    clock iterator, and adds them to a chain if one is given.
+    """
+    blocks = []
+    for i in range(count):
+        parent = mineBlockAt(parent, next(clock), blockDifficulty)
+        if addTo is not None:
+            addTo.addBlock(parent)
+        blocks.append(parent)
+    return blocks
@@ -41,6 +41,111 @@ class TestBlock(unittest.TestCase):
         with self.assertRaises(block.BlockException):
             block.createFromJSON(serialized)
 
+    def test_binarySerialization(self):
+        genesis = block.genesisBlock()
+        self.assertEqual(block.createFromBytes(genesis.asBytes()), genesis)
+
+        t1 = transaction.createTransaction(
+            [TestBlock.public1], [1000], time.time())
+        t2 = transaction.createTransaction(
+            outputAddresses=[TestBlock.public2, TestBlock.public3],
+            outputAmounts=[300, 700],
+            timestamp=time.time(),
+            previousTransactionHashes=[t1.hash],
+            previousOutputIndices=[0],
+            privateKeys=[TestBlock.private1]
+        )
+
+        # Integer timestamps must stay integers, since they are hashed
+        # as strings.
+        b = block.Block(32, 32, [t1, t2], 300, genesis.hash, difficulty=7)
+        encoded = b.asBytes()
+        decoded = block.createFromBytes(encoded)
+        self.assertEqual(decoded, b)
+        self.assertEqual(decoded.hash, b.hash)
+        self.assertEqual(decoded.timestamp, 32)
+        self.assertIsInstance(decoded.timestamp, int)
+        self.assertEqual(decoded.difficulty, 7)
+        self.assertEqual(decoded.transactions[1].asDict(), t2.asDict())
+        self.assertLess(len(encoded), len(b.asJSON()) / 2)
+
+        # Corrupt an output amount, which is the last varint before the
+        # final address of the coinbase transaction.
+        corrupted = bytearray(encoded)
+        amountOffset = encoded.index(bytes.fromhex(TestBlock.public1)) - 4
+        corrupted[amountOffset] ^= 0x01
+        with self.assertRaises(block.BlockException):
+            block.createFromBytes(bytes(corrupted))
+
+        with self.assertRaises(ValueError):
+            block.createFromBytes(encoded[:-1])
+
+        with self.assertRaises(ValueError):
+            block.createFromBytes(bytes([99]) + encoded[1:])
+
+    def test_header(self):
+        genesis = block.genesisBlock()
+        tx = transaction.createTransaction(
+            [TestBlock.public1], [1000], time.time())
+        b = block.Block(1, 32, [tx], 300, genesis.hash, difficulty=7)
+
+        header = b.getHeader()
+        self.assertEqual(header.hash, b.hash)
+        self.assertEqual(header.transactionsRoot, block.hashTransactions([tx]))
+
+        encoded = header.asBytes()
+        decoded = block.createHeaderFromBytes(encoded)
+        self.assertEqual(decoded, header)
+        self.assertEqual(decoded.difficulty, 7)
+        self.assertEqual(decoded.transactionsRoot, header.transactionsRoot)
+
+        corrupted = bytearray(encoded)
+        corrupted[-1] ^= 0x01
+        with self.assertRaises(block.BlockException):
+            block.createHeaderFromBytes(bytes(corrupted))
+
+        # The previous hash is committed to by the block hash.
+        moved = block.Block(1, 32, [tx], 300, "00" * 32, difficulty=7)
+        self.assertNotEqual(moved.hash, b.hash)
+
+    def test_transactionProof(self):
+        transactions = [
+            transaction.createTransaction(
+                [TestBlock.public1], [1000], time.time() + i)
+            for i in range(5)
+        ]
+        b = block.Block(1, 32, transactions, 0, "")
+        header = b.getHeader()
+
+        for tx in transactions:
+            proof = b.getTransactionProof(tx.hash)
+            self.assertTrue(b.verifyTransactionProof(tx.hash, proof))
+            self.assertTrue(header.verifyTransactionProof(tx.hash, proof))
+
+        proof = b.getTransactionProof(transactions[0].hash)
+        self.assertFalse(
+            header.verifyTransactionProof(transactions[1].hash, proof))
+        with self.assertRaises(block.BlockException):
+            b.getTransactionProof("ab" * 32)
+
     def test_genesis(self):
         genesis = block.genesisBlock()
-        self.assertTrue(genesis is not None)
\ No newline at end of file
+        self.assertTrue(genesis is not None)
+
+    def test_miningHeader(self):
+        genesis = block.genesisBlock()
+        tx = transaction.createTransaction(
+            [TestBlock.public1], [1000], time.time())
+
+        header = block.MiningHeader(1, time.time(), [tx], genesis.hash)
+        for noonce in [0, 1, 9, 10, 12345]:
+            expected = block.hashBlock(
+                header.index,
+                header.timestamp,
+                header.transactions,
+                noonce,
+                header.previousHash)
+            self.assertEqual(header.hash(noonce), expected)
+
+        b = header.createBlock(10)
+        self.assertEqual(b.hash, header.hash(10))
@@ -1,7 +1,14 @@
+import itertools
+import random
 import unittest
 import time
-from core import chain, transaction, mine
+from unittest import mock
+from core import block, chain, difficulty, transaction, mine, verify
+from core.settings import MAX_FUTURE_BLOCK_TIME, MAX_RETARGET_BITS
+from core.settings import RETARGET_WINDOW
+from core.settings import TARGET_BLOCK_INTERVAL
 from test import private1, private2, private3, public1, public2, public3
+from test import mineBlockAt, mineBlocks
 
 
 class TestUTXOManager(unittest.TestCase):
@@ -120,11 +127,11 @@ class TestUTXOManager(unittest.TestCase):
         self.assertTrue(manager.canSpend(tx6)[0])
         self.assertTrue(chain.verifyTransactionsSyntax([tx5, tx6]))
         manager.spend(tx5)
-        manager.spend(tx6)
+        spent = manager.spend(tx6)
 
         # Revert the 500 transaction to 3. 3 should now have 2500,
         # 1 should now have 500.
-        manager.revert(tx6)
+        manager.revert(tx6, spent)
 
         # Should not be able to spend 3000
         tx7 = transaction.createTransaction(
@@ -172,6 +179,35 @@ class TestUTXOManager(unittest.TestCase):
         )
         self.assertFalse(manager.canSpend(tx7)[0])
 
+    def test_addressIndex(self):
+        timestamp = time.time()
+        manager = chain.UTXOManager(indexAddresses=True)
+        tx1 = transaction.createTransaction([public1], [1000], timestamp)
+        tx2 = transaction.createTransaction(
+            [public2, public1],
+            [600, 400],
+            timestamp,
+            [tx1.hash],
+            [0],
+            [private1])
+
+        manager.spend(tx1)
+        spent = manager.spend(tx2)
+        self.assertEqual(manager.getBalance(public1), 400)
+        self.assertEqual(manager.getBalance(public2), 600)
+        self.assertEqual(manager.getUnspentOutputs(public2), [(tx2.hash, 0)])
+        self.assertEqual(manager.getHistory(public1), [tx1.hash, tx2.hash])
+        self.assertEqual(manager.getHistory(public2), [tx2.hash])
+
+        manager.revert(tx2, spent)
+        self.assertEqual(manager.getBalance(public1), 1000)
+        self.assertEqual(manager.getBalance(public2), 0)
+        self.assertEqual(manager.getHistory(public1), [tx1.hash])
+        self.assertEqual(manager.getHistory(public2), [])
+
+        with self.assertRaises(chain.UTXOException):
+            chain.UTXOManager().getBalance(public1)
+
 
 class TestChain(unittest.TestCase):
     def test_createLongChainValid(self):
@@ -295,3 +331,522 @@ class TestChain(unittest.TestCase):
         b4alt = mine.generateNextBlock(b3alt, [tx5alt])
         testChain.addBlock(b4alt)
         assert testChain.head == b4alt
+
+    def test_difficultyRetarget(self):
+        testChain = chain.Chain()
+        initial = testChain.head.difficulty
+        timestamp = time.time()
+
+        # The window starts at the genesis block, so the first retarget
+        # looks slow and the difficulty drops by the most it can.
+        for i in range(RETARGET_WINDOW - 1):
+            self.assertEqual(
+                testChain.getNextDifficulty(testChain.head), initial)
+            timestamp += 1
+            testChain.addBlock(mineBlockAt(testChain.head, timestamp, initial))
+        lowered = initial - MAX_RETARGET_BITS
+        self.assertEqual(testChain.getNextDifficulty(testChain.head), lowered)
+
+        # A block that ignores the retarget is rejected.
+        timestamp += 1
+        with self.assertRaises(chain.ChainException):
+            testChain.addBlock(mineBlockAt(testChain.head, timestamp, initial))
+
+        b = mineBlockAt(testChain.head, timestamp, lowered)
+        testChain.addBlock(b)
+        self.assertEqual(testChain.head, b)
+
+        # Blocks one second apart are much faster than the target, but the
+        # difficulty only changes at the next retarget.
+        self.assertEqual(testChain.getNextDifficulty(b), lowered)
+        for i in range(RETARGET_WINDOW - 1):
+            timestamp += 1
+            testChain.addBlock(mineBlockAt(testChain.head, timestamp, lowered))
+        self.assertEqual(
+            testChain.getNextDifficulty(testChain.head), initial)
+
+        # Forks off older blocks rebuild their window from the ancestors.
+        parent = testChain.getPreviousBlock(b)
+        self.assertEqual(testChain.getNextDifficulty(parent), lowered)
+
+    def test_retarget(self):
+        intervals = RETARGET_WINDOW - 1
+        expected = TARGET_BLOCK_INTERVAL * intervals
+        self.assertEqual(difficulty.retarget(10, 0, expected, intervals), 10)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected / 1.9, intervals), 10)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected * 1.9, intervals), 10)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected / 3, intervals), 11)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected * 3, intervals), 9)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected / 4, intervals), 12)
+
+        # The change is limited, however far off the intervals were.
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected / 1000, intervals),
+            10 + MAX_RETARGET_BITS)
+        self.assertEqual(
+            difficulty.retarget(10, 0, 0, intervals), 10 + MAX_RETARGET_BITS)
+        self.assertEqual(
+            difficulty.retarget(10, 0, expected * 1000, intervals),
+            10 - MAX_RETARGET_BITS)
+        self.assertEqual(
+            difficulty.retarget(1, 0, expected * 3, intervals), 1)
+
+        window = difficulty.DifficultyWindow()
+        for i in range(RETARGET_WINDOW + 5):
+            window.push(i)
+        self.assertEqual(len(window.timestamps), RETARGET_WINDOW)
+        self.assertEqual(
+            window.nextDifficulty(10, RETARGET_WINDOW * 2),
+            10 + MAX_RETARGET_BITS)
+        self.assertEqual(
+            window.nextDifficulty(10, RETARGET_WINDOW * 2 + 1), 10)
+
+    def test_stableDifficulty(self):
+        # Blocks mined at a constant hash rate, with the exponential
+        # intervals of proof of work, keep the difficulty within a bit of
+        # the ideal one instead of swinging around it.
+        rng = random.Random(1)
+        ideal = 20
+        hashRate = (1 << ideal) / TARGET_BLOCK_INTERVAL
+        current = ideal
+        window = difficulty.DifficultyWindow([0])
+        timestamp = 0.0
+        difficulties = []
+        for index in range(1, 5000):
+            current = window.nextDifficulty(current, index)
+            timestamp += rng.expovariate(hashRate / (1 << current))
+            window.push(timestamp)
+            difficulties.append(current)
+
+        self.assertGreaterEqual(min(difficulties[100:]), ideal - 1)
+        self.assertLessEqual(max(difficulties[100:]), ideal + 1)
+
+    def test_timestampRules(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        timestamp = time.time()
+        for i in range(5):
+            timestamp += 1
+            testChain.addBlock(
+                mineBlockAt(testChain.head, timestamp, genesis.difficulty))
+
+        # The window holds the genesis block and the five blocks, so its
+        # median is the third block's timestamp.
+        median = timestamp - 2
+        self.assertEqual(
+            testChain._getWindow(testChain.head).medianTime(), median)
+
+        for backdated in [median - 1, median]:
+            b = mineBlockAt(testChain.head, backdated, genesis.difficulty)
+            with self.assertRaises(chain.ChainException):
+                testChain.addBlock(b)
+            with self.assertRaises(chain.ChainException):
+                testChain.addHeader(b.getHeader())
+
+        future = time.time() + MAX_FUTURE_BLOCK_TIME + 60
+        with self.assertRaises(chain.ChainException):
+            testChain.addBlock(
+                mineBlockAt(testChain.head, future, genesis.difficulty))
+
+        # A timestamp before the head's is allowed if it is after the
+        # median.
+        b = mineBlockAt(testChain.head, median + 1, genesis.difficulty)
+        testChain.addBlock(b)
+        self.assertEqual(testChain.head, b)
+
+    def test_mostWorkForkChoice(self):
+        testChain = chain.Chain()
+        timestamp = time.time()
+        for i in range(RETARGET_WINDOW + 4):
+            timestamp += 1
+            testChain.addBlock(mineBlockAt(
+                testChain.head,
+                timestamp,
+                testChain.getNextDifficulty(testChain.head)))
+        forkPoint = testChain.head
+
+        # Fork A is mined slowly, so its difficulty drops at the retarget.
+        slowChain = []
+        parent = forkPoint
+        slowTimestamp = timestamp
+        for i in range(RETARGET_WINDOW - 2):
+            slowTimestamp += TARGET_BLOCK_INTERVAL * RETARGET_WINDOW
+            b = mineBlockAt(
+                parent, slowTimestamp, testChain.getNextDifficulty(parent))
+            testChain.addBlock(b)
+            slowChain.append(b)
+            parent = b
+        self.assertEqual(testChain.head, slowChain[-1])
+        self.assertLess(slowChain[-1].difficulty, forkPoint.difficulty)
+
+        # Fork B is mined quickly, so its difficulty goes up at the
+        # retarget. It is shorter than fork A but has more work once its
+        # first block after the retarget is added.
+        fastChain = []
+        parent = forkPoint
+        for i in range(RETARGET_WINDOW - 4):
+            timestamp += 1
+            b = mineBlockAt(
+                parent, timestamp, testChain.getNextDifficulty(parent))
+            testChain.addBlock(b)
+            fastChain.append(b)
+            parent = b
+        self.assertGreater(fastChain[-1].difficulty, forkPoint.difficulty)
+
+        self.assertLess(fastChain[-1].index, slowChain[-1].index)
+        self.assertGreater(
+            testChain.chainWork[fastChain[-1].hash],
+            testChain.chainWork[slowChain[-1].hash])
+        self.assertEqual(testChain.head, fastChain[-1])
+
+    def test_undoReorg(self):
+        def utxoState(testChain):
+            return {
+                outpoint: (output.amount, output.address)
+                for outpoint, output in testChain.utxo.utxo.items()
+            }
+
+        testChain = chain.Chain()
+        genesis = testChain.head
+        difficulty = genesis.difficulty
+        timestamp = time.time()
+
+        mainBlocks = []
+        parent = genesis
+        for i in range(2):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, difficulty)
+            testChain.addBlock(parent)
+            mainBlocks.append(parent)
+
+        # A longer fork off the genesis block becomes the main chain.
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, difficulty)
+            testChain.addBlock(parent)
+        self.assertEqual(testChain.head, parent)
+
+        # Extending the original chain switches back to it. The blocks that
+        # were connected before are not verified again.
+        for i in range(2):
+            timestamp += 1
+            mainBlocks.append(
+                mineBlockAt(mainBlocks[-1], timestamp, difficulty))
+
+        testChain.addBlock(mainBlocks[2])
+        with mock.patch.object(
+                chain.UTXOManager,
+                "canSpend",
+                autospec=True,
+                side_effect=chain.UTXOManager.canSpend) as canSpend:
+            testChain.addBlock(mainBlocks[3])
+            verified = [call[0][1] for call in canSpend.call_args_list]
+
+        self.assertEqual(testChain.head, mainBlocks[3])
+        self.assertEqual(
+            verified, mainBlocks[2].transactions + mainBlocks[3].transactions)
+
+        expectedChain = chain.Chain()
+        expectedChain.addBlocks(mainBlocks)
+        self.assertEqual(utxoState(testChain), utxoState(expectedChain))
+
+    def test_unexpectedConnectError(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        utxoBefore = dict(testChain.utxo.utxo)
+        b1 = mineBlockAt(genesis, time.time(), genesis.difficulty)
+
+        # Errors other than UTXOExceptions also undo the block's changes.
+        with mock.patch.object(
+                transaction,
+                "verifyInputSignature",
+                side_effect=RuntimeError("Unexpected")):
+            with self.assertRaises(chain.ChainException):
+                testChain.addBlock(b1)
+
+        self.assertEqual(testChain.head, genesis)
+        self.assertNotIn(b1.hash, testChain.blocks)
+        self.assertEqual(testChain.utxo.utxo, utxoBefore)
+
+        testChain.addBlock(b1)
+        self.assertEqual(testChain.head, b1)
+
+    def test_malformedAddress(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        utxoBefore = dict(testChain.utxo.utxo)
+
+        # The coinbase pays to an address that is not a public key, and the
+        # second transaction tries to spend it.
+        coinbase = transaction.createTransaction(["00"], [1000], time.time())
+        tx = transaction.createTransaction(
+            outputAddresses=[public2],
+            outputAmounts=[1000],
+            timestamp=time.time(),
+            previousTransactionHashes=[coinbase.hash],
+            previousOutputIndices=[0],
+            privateKeys=[private1]
+        )
+        badBlock = mine.generateNextBlock(genesis, [coinbase, tx])
+        with self.assertRaises(chain.UTXOException):
+            testChain.addBlock(badBlock)
+
+        self.assertEqual(testChain.head, genesis)
+        self.assertNotIn(badBlock.hash, testChain.blocks)
+        self.assertEqual(testChain.utxo.utxo, utxoBefore)
+
+        # Workers of the signature verifier fail the check the same way.
+        checks = list(testChain.utxo.getSignatureChecks(
+            badBlock.transactions).values())
+        self.assertFalse(verify._verifyBatch(checks))
+        with mock.patch.object(
+                verify, "verifySignature", side_effect=RuntimeError):
+            self.assertFalse(verify._verifyBatch(checks))
+
+    def test_parallelSignatureVerification(self):
+        verifier = verify.SignatureVerifier(processes=2, batchSize=1)
+        self.addCleanup(verifier.close)
+        testChain = chain.Chain(verifier=verifier)
+
+        def createTransactions(lastSigner):
+            coinbase = transaction.createTransaction(
+                [public1], [1000], time.time())
+            split = transaction.createTransaction(
+                outputAddresses=[public2, public2],
+                outputAmounts=[400, 600],
+                timestamp=time.time(),
+                previousTransactionHashes=[coinbase.hash],
+                previousOutputIndices=[0],
+                privateKeys=[private1]
+            )
+            merge = transaction.createTransaction(
+                outputAddresses=[public3],
+                outputAmounts=[1000],
+                timestamp=time.time(),
+                previousTransactionHashes=[split.hash, split.hash],
+                previousOutputIndices=[0, 1],
+                privateKeys=[private2, lastSigner]
+            )
+            return [coinbase, split, merge]
+
+        badTransactions = createTransactions(private3)
+        manager = chain.UTXOManager()
+        checks = list(manager.getSignatureChecks(badTransactions).values())
+        self.assertEqual(len(checks), 3)
+        self.assertTrue(verifier.verifyAll(checks[:2]))
+        self.assertFalse(verifier.verifyAll(checks))
+
+        badBlock = mine.generateNextBlock(testChain.head, badTransactions)
+        with self.assertRaises(chain.UTXOException):
+            testChain.addBlock(badBlock)
+        self.assertEqual(testChain.head.index, 0)
+
+        goodBlock = mine.generateNextBlock(
+            testChain.head, createTransactions(private2))
+        testChain.addBlock(goodBlock)
+        self.assertEqual(testChain.head, goodBlock)
+
+    def test_addressIndexReorg(self):
+        def addressState(testChain):
+            addresses = testChain.utxo.addresses
+            return (
+                {a: sorted(o) for a, o in addresses.unspent.items()},
+                addresses.history)
+
+        testChain = chain.Chain(indexAddresses=True)
+        genesis = testChain.head
+        timestamp = time.time()
+
+        mainBlocks = []
+        parent = genesis
+        for i in range(2):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            testChain.addBlock(parent)
+            mainBlocks.append(parent)
+        self.assertEqual(testChain.utxo.getBalance(public2), 2000)
+        self.assertEqual(len(testChain.utxo.getHistory(public1)), 4)
+
+        # A longer fork replaces the main chain, and the index follows it.
+        forkBlocks = []
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            testChain.addBlock(parent)
+            forkBlocks.append(parent)
+        self.assertEqual(testChain.head, parent)
+        self.assertEqual(testChain.utxo.getBalance(public2), 3000)
+
+        expectedChain = chain.Chain(indexAddresses=True)
+        expectedChain.addBlocks(forkBlocks)
+        self.assertEqual(addressState(testChain), addressState(expectedChain))
+
+    def test_heightIndex(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        timestamp = time.time()
+
+        mainBlocks = []
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            testChain.addBlock(parent)
+            mainBlocks.append(parent)
+
+        forkBlocks = []
+        parent = mainBlocks[0]
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            testChain.addBlock(parent)
+            forkBlocks.append(parent)
+
+        # The fork replaces the last two blocks of the main chain.
+        newChain = [mainBlocks[0]] + forkBlocks
+        self.assertEqual(
+            testChain.mainChain, [genesis.hash] + [b.hash for b in newChain])
+        self.assertEqual(testChain.getBlockAtHeight(2), forkBlocks[0])
+        self.assertIsNone(testChain.getBlockAtHeight(5))
+        self.assertTrue(testChain.isInMainChain(forkBlocks[1]))
+        self.assertFalse(testChain.isInMainChain(mainBlocks[1]))
+
+        self.assertEqual(testChain.getChildren(mainBlocks[0]), forkBlocks)
+        self.assertEqual(testChain.getChildren(genesis), newChain)
+        self.assertEqual(testChain.getChildren(mainBlocks[2]), newChain)
+
+        self.assertEqual(
+            testChain.getAncestors(testChain.head), list(reversed(newChain)))
+        self.assertEqual(
+            testChain.getAncestors(forkBlocks[1], 2),
+            [forkBlocks[1], forkBlocks[0]])
+        self.assertEqual(
+            testChain.getAncestors(mainBlocks[2], 3),
+            [mainBlocks[2], mainBlocks[1], mainBlocks[0]])
+        self.assertEqual(
+            testChain.getAncestors(mainBlocks[2]),
+            [mainBlocks[2], mainBlocks[1], mainBlocks[0]])
+
+    def test_headersFirst(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        timestamp = time.time()
+
+        blocks = []
+        parent = genesis
+        for i in range(5):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            blocks.append(parent)
+
+        # Headers are verified like blocks, without their transactions.
+        header = blocks[0].getHeader()
+        badHeader = block.BlockHeader(
+            header.index,
+            header.timestamp,
+            header.noonce,
+            header.previousHash,
+            header.transactionsRoot,
+            header.difficulty + 1)
+        with self.assertRaises(chain.ChainException):
+            testChain.addHeader(badHeader)
+
+        with self.assertRaises(chain.NoParentException):
+            testChain.addHeader(blocks[1].getHeader())
+
+        testChain.addHeaders([b.getHeader() for b in blocks])
+        self.assertEqual(testChain.bestHeader, blocks[-1].getHeader())
+        self.assertEqual(testChain.head, genesis)
+        self.assertEqual(
+            testChain.getMissingBlocks(), [b.hash for b in blocks])
+        self.assertEqual(
+            testChain.getMissingBlocks(2), [b.hash for b in blocks[:2]])
+
+        # Blocks can arrive in any order once their headers are known.
+        testChain.addBlock(blocks[0])
+        for newBlock in [blocks[4], blocks[2], blocks[3]]:
+            with self.assertRaises(chain.OrphanBlockException):
+                testChain.addBlock(newBlock)
+        self.assertEqual(testChain.getMissingBlocks(), [blocks[1].hash])
+
+        testChain.addBlock(blocks[1])
+        self.assertEqual(testChain.head, blocks[-1])
+        self.assertEqual(testChain.getMissingBlocks(), [])
+        self.assertEqual(testChain.headers, {})
+
+    def test_missingBlocksFork(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        clock = itertools.count(time.time())
+
+        def mineHeaders(parent, count):
+            return mineBlocks(parent, count, clock, genesis.difficulty)
+
+        first = mineHeaders(genesis, 3)
+        testChain.addHeaders([b.getHeader() for b in first])
+        testChain.addBlock(first[0])
+        self.assertEqual(
+            testChain.getMissingBlocks(), [b.hash for b in first[1:]])
+
+        # A longer header fork replaces the missing blocks, and a block
+        # added on the fork is dropped from the front.
+        fork = mineHeaders(first[0], 3)
+        testChain.addHeaders([b.getHeader() for b in fork])
+        self.assertEqual(testChain.bestHeader, fork[-1].getHeader())
+        self.assertEqual(
+            testChain.getMissingBlocks(), [b.hash for b in fork])
+        testChain.addBlock(fork[0])
+        self.assertEqual(
+            testChain.getMissingBlocks(1), [fork[1].hash])
+        self.assertEqual(list(testChain.missingBlocks), [
+            b.hash for b in fork[1:]])
+
+        # Each new best header extends the missing blocks by itself.
+        more = mineHeaders(fork[-1], 2)
+        testChain.addHeaders([b.getHeader() for b in more])
+        self.assertEqual(
+            testChain.getMissingBlocks(),
+            [b.hash for b in fork[1:] + more])
+
+    def test_addBlocksRollback(self):
+        testChain = chain.Chain()
+        genesis = testChain.head
+        timestamp = time.time() - 10
+        b1 = mineBlockAt(genesis, timestamp, genesis.difficulty)
+        utxoBefore = dict(testChain.utxo.utxo)
+
+        # The second block spends an output that does not exist.
+        coinbase = transaction.createTransaction([public1], [1000], timestamp)
+        badTx = transaction.createTransaction(
+            outputAddresses=[public2],
+            outputAmounts=[1000],
+            timestamp=timestamp,
+            previousTransactionHashes=[coinbase.hash],
+            previousOutputIndices=[1],
+            privateKeys=[private1]
+        )
+        badBlock = mine.generateNextBlock(b1, [coinbase, badTx])
+
+        with self.assertRaises(chain.UTXOException):
+            testChain.addBlocks([b1, badBlock])
+
+        # The connected block is disconnected again and removed.
+        self.assertEqual(testChain.head, genesis)
+        self.assertEqual(testChain.mainChain, [genesis.hash])
+        self.assertNotIn(b1.hash, testChain.blocks)
+        self.assertNotIn(badBlock.hash, testChain.blocks)
+        self.assertEqual(testChain.utxo.utxo, utxoBefore)
+        self.assertIsNone(testChain.getBlockAtHeight(1))
+
+        # The valid blocks can still be added afterwards.
+        b2 = mineBlockAt(b1, timestamp + 1, genesis.difficulty)
+        testChain.addBlocks([b1, b2])
+        self.assertEqual(testChain.head, b2)
+        self.assertEqual(testChain.getBlockAtHeight(1), b1)
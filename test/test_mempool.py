@@ -0,0 +1,207 @@
+import unittest
+import time
+from core import chain, mempool, mine, transaction
+from core.settings import MAX_TRANSACTIONS_PER_BLOCK
+from test import private1, private2, private3, public1, public2, public3
+from test import mineBlockAt
+
+
+class TestMempool(unittest.TestCase):
+    def setUp(self):
+        self.chain = chain.Chain()
+        self.timestamp = time.time()
+        self.funding = mineBlockAt(
+            self.chain.head,
+            self.timestamp,
+            self.chain.getNextDifficulty(self.chain.head))
+        self.chain.addBlock(self.funding)
+        self.mempool = mempool.Mempool(self.chain)
+
+        # The second transaction of the block pays 1000 to public2.
+        self.fundingHash = self.funding.transactions[1].hash
+
+    def tearDown(self):
+        self.mempool.close()
+
+    def spend(self, address, timestamp, privateKey=private2):
+        return transaction.createTransaction(
+            [address], [1000], timestamp, [self.fundingHash], [0],
+            [privateKey])
+
+    def test_addTransaction(self):
+        tx = self.spend(public3, self.timestamp)
+        self.mempool.addTransaction(tx)
+        self.assertIn(tx.hash, self.mempool)
+        self.assertEqual(self.mempool.spenders[(self.fundingHash, 0)], tx.hash)
+
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(tx)
+
+        # Double spend of a pending transaction's input
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(
+                self.spend(public1, self.timestamp + 1))
+
+        # Coinbase transactions can not be pending
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(transaction.createTransaction(
+                [public1], [1000], self.timestamp))
+
+        self.mempool.removeTransaction(tx.hash)
+        self.assertEqual(len(self.mempool), 0)
+        self.assertEqual(len(self.mempool.spenders), 0)
+
+        # Signed with the wrong key
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(
+                self.spend(public3, self.timestamp, private1))
+
+    def test_blockTemplate(self):
+        tx = self.spend(public3, self.timestamp)
+        self.mempool.addTransaction(tx)
+
+        template = self.mempool.createBlockTemplate(
+            public1, self.timestamp + 5)
+        self.assertEqual(len(template), 2)
+        self.assertEqual(template[1], tx)
+        self.assertLessEqual(len(template), MAX_TRANSACTIONS_PER_BLOCK)
+
+        self.chain.addBlock(mine.generateNextBlock(self.chain.head, template))
+        self.assertEqual(len(self.mempool), 0)
+
+    def test_conflictingBlock(self):
+        self.mempool.addTransaction(self.spend(public3, self.timestamp))
+
+        coinbase = transaction.createTransaction(
+            [public1], [1000], self.timestamp + 5)
+        conflict = self.spend(public1, self.timestamp + 1)
+        self.chain.addBlock(mine.generateNextBlock(
+            self.chain.head, [coinbase, conflict]))
+
+        self.assertEqual(len(self.mempool), 0)
+        self.assertEqual(len(self.mempool.spenders), 0)
+
+    def test_reorg(self):
+        tx = self.spend(public3, self.timestamp)
+        self.mempool.addTransaction(tx)
+
+        template = self.mempool.createBlockTemplate(
+            public1, self.timestamp + 5)
+        self.chain.addBlock(mine.generateNextBlock(self.chain.head, template))
+        self.assertNotIn(tx.hash, self.mempool)
+
+        # A fork with more work that does not have the transaction returns
+        # it to the mempool.
+        parent = self.funding
+        for i in range(2):
+            forkBlock = mineBlockAt(
+                parent,
+                self.timestamp + i + 1,
+                self.chain.getNextDifficulty(parent))
+            self.chain.addBlock(forkBlock)
+            parent = forkBlock
+
+        self.assertEqual(self.chain.head, parent)
+        self.assertIn(tx.hash, self.mempool)
+
+    def createChain(self):
+        """
+        Creates three pending transactions that each spend the output of
+        the one before it.
+        """
+        first = self.spend(public3, self.timestamp)
+        second = transaction.createTransaction(
+            [public1], [1000], self.timestamp, [first.hash], [0], [private3])
+        third = transaction.createTransaction(
+            [public2], [1000], self.timestamp, [second.hash], [0], [private1])
+        return [first, second, third]
+
+    def test_chainedTransactions(self):
+        first, second, third = self.createChain()
+
+        # A child can not be added before its parent.
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(second)
+
+        for tx in [first, second, third]:
+            self.mempool.addTransaction(tx)
+
+        self.assertEqual(self.mempool.parents[second.hash], {first.hash})
+        self.assertEqual(
+            self.mempool.getAncestors(third.hash), {first.hash, second.hash})
+        self.assertEqual(
+            self.mempool.getDescendants(first.hash),
+            {second.hash, third.hash})
+
+        # Double spend of a pending transaction's output
+        with self.assertRaises(mempool.MempoolException):
+            self.mempool.addTransaction(transaction.createTransaction(
+                [public2], [1000], self.timestamp + 1,
+                [first.hash], [0], [private3]))
+
+        # Removing a transaction removes its descendants.
+        removed = self.mempool.removeTransaction(first.hash)
+        self.assertEqual(removed, [first, second, third])
+        self.assertEqual(len(self.mempool), 0)
+        self.assertEqual(len(self.mempool.spenders), 0)
+        self.assertEqual(len(self.mempool.children), 0)
+
+    def test_chainedBlocks(self):
+        first, second, third = self.createChain()
+        for tx in [first, second, third]:
+            self.mempool.addTransaction(tx)
+
+        # Confirming a parent keeps its children.
+        coinbase = transaction.createTransaction(
+            [public1], [1000], self.timestamp + 5)
+        self.chain.addBlock(mine.generateNextBlock(
+            self.chain.head, [coinbase, first]))
+        self.assertEqual(self.mempool.getTransactions(), [second, third])
+        self.assertEqual(self.mempool.parents[second.hash], set())
+
+        template = self.mempool.createBlockTemplate(
+            public1, self.timestamp + 6)
+        self.chain.addBlock(mine.generateNextBlock(self.chain.head, template))
+        self.assertEqual(len(self.mempool), 0)
+
+    def test_chainedConflict(self):
+        for tx in self.createChain():
+            self.mempool.addTransaction(tx)
+
+        coinbase = transaction.createTransaction(
+            [public1], [1000], self.timestamp + 5)
+        conflict = self.spend(public1, self.timestamp + 1)
+        self.chain.addBlock(mine.generateNextBlock(
+            self.chain.head, [coinbase, conflict]))
+
+        self.assertEqual(len(self.mempool), 0)
+        self.assertEqual(len(self.mempool.spenders), 0)
+
+    def test_chainedReorg(self):
+        first, second, third = self.createChain()
+        for tx in [first, second, third]:
+            self.mempool.addTransaction(tx)
+
+        coinbase = transaction.createTransaction(
+            [public1], [1000], self.timestamp + 5)
+        self.chain.addBlock(mine.generateNextBlock(
+            self.chain.head, [coinbase, first, second]))
+        self.assertEqual(self.mempool.getTransactions(), [third])
+
+        parent = self.funding
+        for i in range(2):
+            forkBlock = mineBlockAt(
+                parent,
+                self.timestamp + i + 1,
+                self.chain.getNextDifficulty(parent))
+            self.chain.addBlock(forkBlock)
+            parent = forkBlock
+
+        # The block's transactions come back before their child.
+        self.assertEqual(
+            self.mempool.getTransactions(), [first, second, third])
+        self.assertEqual(self.mempool.parents[third.hash], {second.hash})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import hashlib
+import unittest
+from core import merkle
+
+
+def leaf(i):
+    return hashlib.sha256(str(i).encode('utf-8')).hexdigest()
+
+
+class TestMerkle(unittest.TestCase):
+    def test_root(self):
+        a, b, c = leaf(0), leaf(1), leaf(2)
+        hashA, hashB, hashC = [
+            hashlib.sha256(b"\x00" + bytes.fromhex(h)).hexdigest()
+            for h in [a, b, c]]
+        ab = hashlib.sha256(
+            b"\x01" + bytes.fromhex(hashA + hashB)).hexdigest()
+        abc = hashlib.sha256(
+            b"\x01" + bytes.fromhex(ab + hashC)).hexdigest()
+
+        self.assertEqual(merkle.computeMerkleRoot([a]), hashA)
+        self.assertEqual(merkle.computeMerkleRoot([a, b]), ab)
+        self.assertEqual(merkle.computeMerkleRoot([a, b, c]), abc)
+
+        # An unpaired hash is not paired with itself, so repeating it
+        # gives a different root.
+        self.assertNotEqual(
+            merkle.computeMerkleRoot([a, b, c, c]),
+            merkle.computeMerkleRoot([a, b, c]))
+
+    def test_innerNodeAsLeaf(self):
+        hashes = [leaf(i) for i in range(4)]
+        root = merkle.computeMerkleRoot(hashes)
+        proof = merkle.getMerkleProof(hashes, 0)
+
+        # The inner nodes of a tree, given as leaves, do not have the same
+        # root, and an inner node does not verify as a leaf.
+        innerLeft = merkle._hashPair(
+            merkle._hashLeaf(hashes[0]), merkle._hashLeaf(hashes[1]))
+        innerRight = proof[1][0]
+        self.assertNotEqual(
+            merkle.computeMerkleRoot([innerLeft, innerRight]), root)
+        self.assertFalse(
+            merkle.verifyMerkleProof(innerLeft, proof[1:], root))
+        self.assertTrue(
+            merkle.verifyMerkleProof(hashes[0], proof, root))
+
+    def test_proofs(self):
+        for count in range(1, 10):
+            hashes = [leaf(i) for i in range(count)]
+            root = merkle.computeMerkleRoot(hashes)
+            for index in range(count):
+                proof = merkle.getMerkleProof(hashes, index)
+                self.assertTrue(
+                    merkle.verifyMerkleProof(hashes[index], proof, root))
+                self.assertFalse(
+                    merkle.verifyMerkleProof(leaf(count), proof, root))
+
+        hashes = [leaf(i) for i in range(5)]
+        root = merkle.computeMerkleRoot(hashes)
+        proof = merkle.getMerkleProof(hashes, 2)
+        flipped = [(sibling, not isLeft) for sibling, isLeft in proof]
+        self.assertFalse(merkle.verifyMerkleProof(hashes[2], flipped, root))
+        self.assertFalse(
+            merkle.verifyMerkleProof(hashes[2], [("zz", True)], root))
+
+        with self.assertRaises(IndexError):
+            merkle.getMerkleProof(hashes, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
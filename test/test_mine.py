@@ -0,0 +1,64 @@
+import time
+import unittest
+from core import chain, mine, transaction
+from test import public1, private1
+
+
+class TestMine(unittest.TestCase):
+    def test_parallelMiner(self):
+        testChain = chain.Chain()
+        tx1 = transaction.createTransaction([public1], [1000], time.time())
+        tx2 = transaction.createTransaction(
+            outputAddresses=[public1],
+            outputAmounts=[1000],
+            timestamp=time.time(),
+            previousTransactionHashes=[tx1.hash],
+            previousOutputIndices=[0],
+            privateKeys=[private1]
+        )
+
+        miner = mine.ParallelMiner(processes=2, chunkSize=4)
+        b1 = miner.generateNextBlock(testChain.head, [tx1, tx2])
+        self.assertTrue(mine.hasProofOfWork(b1.hash))
+        self.assertGreater(miner.hashCount, 0)
+        self.assertGreater(miner.hashesPerSecond, 0)
+
+        testChain.addBlock(b1)
+        self.assertEqual(testChain.head, b1)
+
+    def test_hasProofOfWorkDigest(self):
+        self.assertTrue(mine.hasProofOfWorkDigest(bytes([0x0f, 0xff]), 4))
+        self.assertFalse(mine.hasProofOfWorkDigest(bytes([0x10, 0x00]), 4))
+        self.assertTrue(mine.hasProofOfWorkDigest(bytes([0x1f, 0xff]), 3))
+        self.assertFalse(mine.hasProofOfWorkDigest(bytes([0x20, 0x00]), 3))
+        self.assertTrue(mine.hasProofOfWorkDigest(bytes([0x00, 0x7f]), 9))
+        self.assertFalse(mine.hasProofOfWorkDigest(bytes([0x00, 0x80]), 9))
+        self.assertTrue(mine.hasProofOfWorkDigest(bytes([0x00, 0xff]), 8))
+        self.assertTrue(mine.hasProofOfWork("0" + "f" * 63))
+        self.assertFalse(mine.hasProofOfWork("1" + "0" * 63))
+
+    def test_miningModes(self):
+        tx = transaction.createTransaction([public1], [1000], time.time())
+        genesis = chain.Chain().head
+
+        for mode in mine.MINERS:
+            kwargs = {}
+            if mode == "parallel":
+                kwargs["processes"] = 2
+            elif mode == "batched":
+                kwargs["threads"] = 2
+                kwargs["batchSize"] = 50
+            miner = mine.createMiner(mode, **kwargs)
+            b = miner.generateNextBlock(genesis, [tx], difficulty=8)
+            self.assertTrue(b.hash.startswith("00"), mode)
+            self.assertEqual(b.difficulty, 8, mode)
+            self.assertGreater(miner.hashCount, 0, mode)
+
+        with self.assertRaises(ValueError):
+            mine.createMiner("unknown")
+
+        # An engine that does not implement the search can not be created.
+        class IncompleteMiner(mine.Miner):
+            pass
+        with self.assertRaises(TypeError):
+            IncompleteMiner()
@@ -0,0 +1,183 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+from core import chain, mempool, network, transaction
+from test import private2, public3
+from test import mineBlockAt
+
+
+async def waitFor(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting for the network.")
+        await asyncio.sleep(0.01)
+
+
+class TestNetwork(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.nodes = []
+        for i in range(3):
+            testChain = chain.Chain()
+            node = network.Node(testChain, mempool.Mempool(testChain))
+            await node.start()
+            self.nodes.append(node)
+
+    async def asyncTearDown(self):
+        for node in self.nodes:
+            await node.stop()
+
+    async def test_relay(self):
+        first, second, third = self.nodes
+        genesis = first.chain.head
+        timestamp = time.time()
+
+        blocks = []
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            first.chain.addBlock(parent)
+            blocks.append(parent)
+
+        # Connecting asks for headers, so the chain is synced headers first.
+        peer = await second.connect(first.host, first.port)
+        self.assertIs(await second.connect(first.host, first.port), peer)
+        await third.connect(second.host, second.port)
+        await waitFor(lambda: third.chain.head == blocks[-1])
+        self.assertEqual(len(second.peers), 2)
+        self.assertIn((second.host, second.port), first.peers)
+
+        # New blocks and transactions are relayed across the network.
+        timestamp += 1
+        newBlock = mineBlockAt(blocks[-1], timestamp, genesis.difficulty)
+        await first.announceBlock(newBlock)
+        await waitFor(lambda: third.chain.head == newBlock)
+
+        tx = transaction.createTransaction(
+            [public3],
+            [1000],
+            timestamp,
+            [blocks[0].transactions[1].hash],
+            [0],
+            [private2])
+        await third.announceTransaction(tx)
+        await waitFor(lambda: tx.hash in first.mempool)
+        self.assertIn(tx.hash, second.mempool)
+
+    async def test_requestTimeout(self):
+        first, second, third = self.nodes
+        genesis = first.chain.head
+        timestamp = time.time()
+
+        blocks = []
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            first.chain.addBlock(parent)
+            third.chain.addBlock(parent)
+            blocks.append(parent)
+
+        # The first node sends headers but never the blocks, so the blocks
+        # are requested from the third node once their deadline passes.
+        async def ignoreGetData(peer, payload):
+            pass
+        first.setHandler(network.MSG_GETDATA, ignoreGetData)
+
+        firstPeer = await second.connect(first.host, first.port)
+        await waitFor(lambda: len(second.requested) == len(blocks))
+        self.assertTrue(all(
+            peer is firstPeer for peer, _ in second.requested.values()))
+
+        thirdPeer = await second.connect(third.host, third.port)
+        second._retryRequests(time.time())
+        self.assertIs(second.requested[blocks[0].hash][0], firstPeer)
+
+        second._retryRequests(time.time() + network.BLOCK_REQUEST_TIMEOUT)
+        self.assertTrue(all(
+            peer is thirdPeer for peer, _ in second.requested.values()))
+        await waitFor(lambda: second.chain.head == blocks[-1])
+        self.assertEqual(second.requested, {})
+
+    async def test_getDataMissingItems(self):
+        first, second, _ = self.nodes
+        genesis = first.chain.head
+        newBlock = mineBlockAt(genesis, time.time(), genesis.difficulty)
+        first.chain.addBlock(newBlock)
+        peer = await second.connect(first.host, first.port)
+        await waitFor(lambda: second.chain.head == newBlock)
+
+        # A transaction that leaves the mempool, or a block that is not
+        # there, is skipped without closing the connection.
+        with mock.patch.object(
+                mempool.Mempool, "__contains__", return_value=True):
+            peer.send(network.MSG_GETDATA, network.encodeInventory([
+                (network.INV_TX, "ab" * 32),
+                (network.INV_BLOCK, "cd" * 32)]))
+
+            timestamp = newBlock.timestamp + 1
+            nextBlock = mineBlockAt(newBlock, timestamp, genesis.difficulty)
+            first.chain.addBlock(nextBlock)
+            peer.send(network.MSG_GETDATA, network.encodeInventory([
+                (network.INV_BLOCK, nextBlock.hash)]))
+            await waitFor(lambda: second.chain.head == nextBlock)
+        self.assertEqual(len(first.peers), 1)
+
+    async def test_malformedMessage(self):
+        first, second, _ = self.nodes
+        peer = await second.connect(first.host, first.port)
+        await waitFor(lambda: len(first.peers) == 1)
+
+        peer.send(network.MSG_BLOCK, b"\x01\x02")
+        await waitFor(lambda: len(first.peers) == 0)
+        await waitFor(lambda: len(second.peers) == 0)
+
+    async def test_slowPeer(self):
+        first, second, _ = self.nodes
+        with mock.patch.object(network, "PEER_SEND_QUEUE_SIZE", 4):
+            peer = await second.connect(first.host, first.port)
+        await waitFor(lambda: len(first.peers) == 1)
+
+        # Sending never waits for a full queue, the peer is closed instead.
+        with self.assertRaises(network.NetworkException):
+            for i in range(5):
+                peer.send(network.MSG_INV, network.encodeInventory([]))
+        self.assertTrue(peer.closed)
+        self.assertEqual(len(second.peers), 0)
+        await waitFor(lambda: len(first.peers) == 0)
+
+    async def test_handlerError(self):
+        first, second, _ = self.nodes
+
+        async def failingHandler(peer, payload):
+            raise RuntimeError("Handler failed.")
+        first.setHandler(network.MSG_TX, failingHandler)
+
+        peer = await second.connect(first.host, first.port)
+        await waitFor(lambda: len(first.peers) == 1)
+
+        # An unexpected error is logged and closes the connection.
+        with self.assertLogs("core.network") as logs:
+            peer.send(network.MSG_TX, b"")
+            await waitFor(lambda: len(first.peers) == 0)
+        self.assertIn("Handler failed.", logs.output[0])
+        await waitFor(lambda: len(second.peers) == 0)
+
+    def test_messages(self):
+        items = [(network.INV_BLOCK, "ab" * 32), (network.INV_TX, "cd" * 32)]
+        self.assertEqual(
+            network.decodeInventory(network.encodeInventory(items)), items)
+
+        headers = [mineBlockAt(
+            chain.Chain().head, time.time(), 4).getHeader()]
+        self.assertEqual(
+            network.decodeHeaders(network.encodeHeaders(headers)), headers)
+
+        with self.assertRaises(ValueError):
+            network.decodeLocator(network.encodeLocator(["ab" * 32]) + b"\0")
+
+
+if __name__ == '__main__':
+    unittest.main()
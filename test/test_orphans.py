@@ -0,0 +1,90 @@
+import itertools
+import time
+import unittest
+from core import chain, orphans
+from test import mineBlockAt, mineBlocks
+
+
+class TestOrphanPool(unittest.TestCase):
+    def setUp(self):
+        self.chain = chain.Chain()
+        self.genesis = self.chain.head
+        self.clock = itertools.count(time.time())
+
+    def mineBlocks(self, parent, count):
+        return mineBlocks(
+            parent, count, self.clock, self.genesis.difficulty)
+
+    def test_reconnect(self):
+        blocks = self.mineBlocks(self.genesis, 4)
+        fork = self.mineBlocks(blocks[0], 1)
+
+        # Blocks arriving before their parent are kept as orphans.
+        for orphan in reversed(blocks[1:] + fork):
+            with self.assertRaises(chain.OrphanBlockException):
+                self.chain.addBlock(orphan)
+            self.assertIn(orphan.hash, self.chain.orphans)
+        self.assertEqual(self.chain.head, self.genesis)
+
+        # The orphan exception is still a missing parent exception.
+        tip = self.mineBlocks(blocks[-1], 1)[0]
+        with self.assertRaises(chain.NoParentException):
+            self.chain.addBlock(tip)
+
+        # Adding the missing block connects every block waiting for it.
+        self.chain.addBlock(blocks[0])
+        self.assertEqual(self.chain.head, tip)
+        self.assertIn(fork[0].hash, self.chain.blocks)
+        self.assertEqual(len(self.chain.orphans), 0)
+
+    def test_proofOfWork(self):
+        blocks = self.mineBlocks(self.genesis, 2)
+
+        # An orphan whose hash does not meet its claimed difficulty, whose
+        # hash does not match its header, or whose difficulty is far below
+        # the head's is rejected and not kept.
+        claimed = self.mineBlocks(blocks[0], 1)[0]
+        claimed.difficulty = 32
+        forged = self.mineBlocks(blocks[0], 1)[0]
+        forged.hash = "00" * 32
+        easy = mineBlockAt(blocks[0], next(self.clock), 1)
+        for orphan in [claimed, forged, easy]:
+            with self.assertRaises(chain.ChainException) as context:
+                self.chain.addBlock(orphan)
+            self.assertNotIsInstance(
+                context.exception, chain.OrphanBlockException)
+            self.assertNotIn(orphan.hash, self.chain.orphans)
+
+        with self.assertRaises(chain.OrphanBlockException):
+            self.chain.addBlock(blocks[1])
+        self.assertIn(blocks[1].hash, self.chain.orphans)
+
+        pool = orphans.OrphanPool()
+        self.assertTrue(pool.add(easy))
+        self.assertFalse(pool.add(forged))
+        self.assertFalse(pool.add(blocks[1], minDifficulty=5))
+
+    def test_limits(self):
+        pool = orphans.OrphanPool(maxSize=2, maxAge=10)
+        blocks = self.mineBlocks(self.genesis, 4)
+
+        pool.add(blocks[1], now=0)
+        pool.add(blocks[2], now=1)
+        pool.add(blocks[3], now=2)
+        self.assertEqual(len(pool), 2)
+        self.assertNotIn(blocks[1].hash, pool)
+        self.assertEqual(pool.popChildren(blocks[0].hash), [])
+
+        pool.add(blocks[1], now=12)
+        self.assertNotIn(blocks[2].hash, pool)
+        self.assertIn(blocks[3].hash, pool)
+        self.assertEqual(pool.popChildren(blocks[0].hash), [blocks[1]])
+        self.assertEqual(len(pool), 1)
+
+        pool.expire(now=20)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.byParent, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from core import chain, snapshot, transaction, utxodb
+from test import public1, public2
+from test import mineBlockAt
+
+
+def utxoState(testChain):
+    return {
+        outpoint: (output.amount, output.address)
+        for outpoint, output in testChain.utxo.utxo.items()
+    }
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_writeAndRead(self):
+        utxo = {
+            ("ab" * 32, 0): transaction.TransactionOutput(1000, public1),
+            ("ab" * 32, 1): transaction.TransactionOutput(400, public2),
+            ("cd" * 32, 0): transaction.TransactionOutput(600, public1),
+        }
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "utxo.snapshot")
+            snapshot.writeSnapshot(utxo, "ef" * 32, 7, path)
+
+            blockHash, blockIndex, outputs = snapshot.readSnapshot(path)
+            self.assertEqual(blockHash, "ef" * 32)
+            self.assertEqual(blockIndex, 7)
+            self.assertEqual(
+                {o: (out.amount, out.address) for o, out in outputs},
+                {o: (out.amount, out.address) for o, out in utxo.items()})
+
+            with open(path, "r+b") as f:
+                f.seek(-40, os.SEEK_END)
+                f.write(b"\x00")
+
+            with self.assertRaises(snapshot.SnapshotException):
+                snapshot.readSnapshot(path)
+
+    def test_boundedLoad(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = utxodb.SQLiteBackend(
+                os.path.join(directory, "utxo.sqlite"))
+            manager = chain.UTXOManager(backend=backend)
+            utxo = {
+                ("{:064x}".format(i), 0):
+                    transaction.TransactionOutput(1000, public1)
+                for i in range(25)
+            }
+            path = os.path.join(directory, "utxo.snapshot")
+            snapshot.writeSnapshot(utxo, "ef" * 32, 7, path)
+
+            # The outputs are read while they are loaded, and written to the
+            # database in batches instead of being held until a flush.
+            dirtySizes = []
+            blockHash, blockIndex, outputs = snapshot.readSnapshot(path)
+            with mock.patch.object(snapshot, "READ_SIZE", 16), \
+                    mock.patch.object(chain, "UTXO_FLUSH_SIZE", 10):
+                def loadedOutputs():
+                    for entry in outputs:
+                        dirtySizes.append(len(backend._dirty))
+                        yield entry
+                manager.loadOutputs(loadedOutputs())
+
+            self.assertLessEqual(max(dirtySizes), 10)
+            self.assertEqual(set(backend), set(utxo))
+            self.assertIsNone(backend.bestBlock)
+            backend.close()
+
+    def test_streamedWrite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = utxodb.SQLiteBackend(
+                os.path.join(directory, "utxo.sqlite"))
+            utxo = {
+                ("{:064x}".format(i), i % 3):
+                    transaction.TransactionOutput(1000 + i, public1)
+                for i in range(25)
+            }
+            for outpoint, output in utxo.items():
+                backend[outpoint] = output
+            backend.flush()
+
+            # Outputs still in the dirty cache are written as well, and
+            # removed ones are left out.
+            removed = ("{:064x}".format(0), 0)
+            del backend[removed]
+            del utxo[removed]
+            added = ("ab" * 32, 0)
+            backend[added] = transaction.TransactionOutput(5, public2)
+            utxo[added] = backend[added]
+
+            # The entries are read with one query and written a chunk at a
+            # time, instead of looking up each outpoint.
+            path = os.path.join(directory, "utxo.snapshot")
+            with mock.patch.object(snapshot, "READ_SIZE", 64), \
+                    mock.patch.object(
+                        utxodb.SQLiteBackend,
+                        "__getitem__",
+                        side_effect=AssertionError):
+                snapshot.writeSnapshot(backend, "ef" * 32, 7, path)
+
+            blockHash, blockIndex, outputs = snapshot.readSnapshot(path)
+            self.assertEqual(
+                {o: (out.amount, out.address) for o, out in outputs},
+                {o: (out.amount, out.address) for o, out in utxo.items()})
+            self.assertFalse(os.path.exists(path + ".tmp"))
+            backend.close()
+
+    def test_chainStartup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain")
+            snapshotPath = os.path.join(directory, "utxo.snapshot")
+            testChain = chain.Chain(path)
+            genesis = testChain.head
+            timestamp = time.time()
+
+            blocks = []
+            for i in range(5):
+                timestamp += 1
+                b = mineBlockAt(testChain.head, timestamp, genesis.difficulty)
+                testChain.addBlock(b)
+                blocks.append(b)
+                if i == 2:
+                    testChain.writeSnapshot(snapshotPath)
+            testChain.close()
+
+            # Only the blocks after the snapshot are connected.
+            with mock.patch.object(
+                    chain.UTXOManager,
+                    "connectBlock",
+                    autospec=True,
+                    side_effect=chain.UTXOManager.connectBlock) as connect:
+                loadedChain = chain.Chain(path, snapshotFilename=snapshotPath)
+                connected = [
+                    call[0][1][0].hash for call in connect.call_args_list]
+
+            self.assertEqual(loadedChain.head, blocks[-1])
+            self.assertEqual(
+                connected,
+                [b.transactions[0].hash for b in blocks[3:]])
+            self.assertEqual(utxoState(loadedChain), utxoState(testChain))
+
+            # The blocks before the snapshot were connected when they were
+            # added, so their stored undo records let the main chain be
+            # reorganized past it.
+            parent = blocks[1]
+            for i in range(4):
+                timestamp += 1
+                parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+                loadedChain.addBlock(parent)
+            self.assertEqual(loadedChain.head, parent)
+            reorganizedState = utxoState(loadedChain)
+            loadedChain.close()
+
+            # A corrupt snapshot is ignored and every block is connected.
+            with open(snapshotPath, "r+b") as f:
+                f.seek(-1, os.SEEK_END)
+                f.write(b"\x00")
+            replayedChain = chain.Chain(path, snapshotFilename=snapshotPath)
+            self.assertEqual(utxoState(replayedChain), reorganizedState)
+            replayedChain.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
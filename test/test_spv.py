@@ -0,0 +1,116 @@
+import itertools
+import time
+import unittest
+from core import block, chain, spv
+from test import mineBlockAt, mineBlocks
+
+
+class TestSPVClient(unittest.TestCase):
+    def setUp(self):
+        self.chain = chain.Chain()
+        self.genesis = self.chain.head
+        self.clock = itertools.count(time.time())
+
+    def mineBlocks(self, parent, count):
+        return mineBlocks(
+            parent, count, self.clock, self.genesis.difficulty, self.chain)
+
+    def test_confirmations(self):
+        blocks = self.mineBlocks(self.genesis, 3)
+        source = spv.ChainProofSource(self.chain)
+        client = spv.SPVClient(confirmations=3)
+
+        payment = blocks[0].transactions[1].hash
+        client.watchTransaction(payment)
+        client.sync(source)
+        self.assertEqual(client.head, blocks[-1].getHeader())
+        self.assertEqual(client.watched[payment], blocks[0].hash)
+        self.assertEqual(client.getConfirmations(payment), 3)
+        self.assertTrue(client.isConfirmed(payment))
+
+        # Only headers after the last common block are sent again.
+        locator = client.getLocator()
+        self.assertEqual(locator[0], blocks[-1].hash)
+        self.assertEqual(locator[-1], self.genesis.hash)
+        self.assertEqual(source.getHeaders(locator), [])
+
+        # A fork replacing the payment's block unconfirms it, and the
+        # proof is requested again from the new main chain.
+        fork = self.mineBlocks(self.genesis, 4)
+        client.sync(source)
+        self.assertEqual(client.head, fork[-1].getHeader())
+        self.assertEqual(client.getConfirmations(payment), 0)
+        self.assertIsNone(client.watched[payment])
+
+        forkPayment = fork[1].transactions[1].hash
+        client.watchTransaction(forkPayment)
+        client.sync(source)
+        self.assertEqual(client.getConfirmations(forkPayment), 3)
+        source.close()
+
+    def test_invalidProofs(self):
+        blocks = self.mineBlocks(self.genesis, 2)
+        client = spv.SPVClient()
+        client.addHeaders([b.getHeader() for b in blocks])
+
+        payment = blocks[0].transactions[1].hash
+        proof = blocks[0].getTransactionProof(payment)
+        with self.assertRaises(spv.SPVException):
+            client.addTransactionProof(payment, blocks[1].hash, proof)
+        with self.assertRaises(spv.SPVException):
+            client.addTransactionProof(payment, "ab" * 32, proof)
+
+        client.addTransactionProof(payment, blocks[0].hash, proof)
+        self.assertEqual(client.getConfirmations(payment), 2)
+
+        # Headers must link to the chain and have a valid proof of work.
+        header = blocks[1].getHeader()
+        unmined = block.BlockHeader(
+            header.index + 1,
+            header.timestamp + 1,
+            header.noonce,
+            header.hash,
+            header.transactionsRoot,
+            header.difficulty + 1)
+        with self.assertRaises(spv.SPVException):
+            client.addHeader(unmined)
+        with self.assertRaises(spv.SPVException):
+            client.addHeader(mineBlockAt(
+                unmined, next(self.clock) + 10, header.difficulty).getHeader())
+
+
+    def test_incompleteProofSource(self):
+        # A source missing one of the requests fails when it is created,
+        # not while syncing.
+        class HeadersOnly(spv.ProofSource):
+            def getHeaders(self, locator):
+                return []
+        with self.assertRaises(TypeError):
+            HeadersOnly()
+
+    def test_sharedHeaderRules(self):
+        blocks = self.mineBlocks(self.genesis, 3)
+        client = spv.SPVClient()
+        client.addHeaders([b.getHeader() for b in blocks])
+
+        # Full chains and SPV clients verify headers with the same rules,
+        # such as the timestamp having to be after the window's median.
+        early = mineBlockAt(
+            blocks[-1], blocks[0].timestamp, self.genesis.difficulty)
+        with self.assertRaises(chain.ChainException):
+            self.chain.addHeader(early.getHeader())
+        with self.assertRaises(spv.SPVException):
+            client.addHeader(early.getHeader())
+
+        valid = self.mineBlocks(blocks[-1], 1)[0]
+        client.addHeader(valid.getHeader())
+        self.assertEqual(client.head, valid.getHeader())
+        self.assertEqual(
+            client.chainWork[valid.hash], self.chain.chainWork[valid.hash])
+        self.assertEqual(
+            client.windows[valid.hash].timestamps,
+            self.chain.windows[valid.hash].timestamps)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import tempfile
+import time
+import unittest
+from core import block, chain, mine, store, transaction
+from test import private1, public1, public2
+from test import mineBlockAt
+
+
+class TestBlockStore(unittest.TestCase):
+    def test_appendAndRead(self):
+        with tempfile.TemporaryDirectory() as directory:
+            genesis = block.genesisBlock()
+            timestamp = time.time()
+            b1 = mineBlockAt(genesis, timestamp, genesis.difficulty)
+            b2 = mineBlockAt(b1, timestamp + 1, genesis.difficulty)
+
+            # A small segment size puts every block in its own segment.
+            blockStore = store.BlockStore(directory, segmentSize=1)
+            headers = [blockStore.append(b) for b in [genesis, b1, b2]]
+            self.assertEqual([h.segment for h in headers], [0, 1, 2])
+            self.assertEqual(blockStore.read(headers[1]), b1)
+            blockStore.remove(headers[2])
+            blockStore.close()
+
+            blockStore = store.BlockStore(directory, segmentSize=1)
+            blockMap = store.BlockMap(blockStore, cacheSize=1)
+            self.assertEqual(list(blockMap), [genesis.hash, b1.hash])
+            self.assertNotIn(b2.hash, blockMap)
+            self.assertEqual(
+                blockMap.headers[b1.hash].previousHash, genesis.hash)
+            self.assertEqual(
+                blockMap.headers[genesis.hash].previousHash, "")
+            self.assertEqual(blockMap[b1.hash], b1)
+            self.assertEqual(blockMap[genesis.hash], genesis)
+            self.assertEqual(len(blockMap._cache), 1)
+            self.assertEqual(
+                [h.hash for h in blockMap.getHeaderChain(b1.hash)],
+                [genesis.hash, b1.hash])
+
+            # New blocks go to a new segment after the existing ones.
+            self.assertEqual(blockStore.append(b2).segment, 3)
+            blockMap.close()
+
+    def test_partialIndexRecord(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain")
+            testChain = chain.Chain(path)
+            difficulty = testChain.head.difficulty
+            timestamp = time.time()
+            for i in range(2):
+                timestamp += 1
+                testChain.addBlock(
+                    mineBlockAt(testChain.head, timestamp, difficulty))
+            testChain.close()
+
+            # A crash while writing leaves part of an index record.
+            with open(os.path.join(path, store.INDEX_FILENAME), "ab") as f:
+                f.write(b"\x00" * 7)
+
+            loadedChain = chain.Chain(path)
+            self.assertEqual(loadedChain.head.index, 2)
+            for i in range(2):
+                timestamp += 1
+                loadedChain.addBlock(
+                    mineBlockAt(loadedChain.head, timestamp, difficulty))
+            head = loadedChain.head
+            loadedChain.close()
+
+            # The records written after it are still read back.
+            self.assertEqual(
+                os.path.getsize(os.path.join(path, store.INDEX_FILENAME)) %
+                store.INDEX_RECORD.size,
+                0)
+            reloadedChain = chain.Chain(path)
+            self.assertEqual(reloadedChain.head, head)
+            self.assertEqual(reloadedChain.head.index, 4)
+            reloadedChain.close()
+
+    def test_persistentChain(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain")
+            testChain = chain.Chain(path)
+            difficulty = testChain.head.difficulty
+            timestamp = time.time()
+
+            mainBlocks = []
+            for i in range(3):
+                timestamp += 1
+                b = mineBlockAt(testChain.head, timestamp, difficulty)
+                testChain.addBlock(b)
+                mainBlocks.append(b)
+
+            fork = mineBlockAt(mainBlocks[0], timestamp + 1, difficulty)
+            testChain.addBlock(fork)
+            expectedUTXO = {
+                outpoint: output.amount
+                for outpoint, output in testChain.utxo.utxo.items()
+            }
+            testChain.close()
+
+            loadedChain = chain.Chain(path)
+            self.assertEqual(loadedChain.head, mainBlocks[-1])
+            self.assertEqual(
+                loadedChain.mainChain, testChain.mainChain)
+            self.assertIn(fork.hash, loadedChain.blocks)
+            self.assertEqual(
+                loadedChain.chainWork[fork.hash],
+                testChain.chainWork[fork.hash])
+            self.assertEqual(
+                {
+                    outpoint: output.amount
+                    for outpoint, output in loadedChain.utxo.utxo.items()
+                },
+                expectedUTXO)
+
+            timestamp += 1
+            b = mineBlockAt(loadedChain.head, timestamp, difficulty)
+            loadedChain.addBlock(b)
+            self.assertEqual(loadedChain.head, b)
+
+            # Undo records are read back from the store, so a reorganization
+            # after a restart does not verify the old blocks again.
+            self.assertIsInstance(loadedChain.undo, chain.UndoMap)
+            self.assertIn(mainBlocks[1].hash, loadedChain.undo)
+            self.assertNotIn(fork.hash, loadedChain.undo)
+            undo = loadedChain.undo[b.hash]
+            self.assertEqual(
+                chain.createUndoFromBytes(undo.asBytes()).created,
+                undo.created)
+            loadedChain.close()
+
+    def test_reverifyStoredBlocks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain")
+            testChain = chain.Chain(path)
+            genesis = testChain.head
+            timestamp = time.time() - 10
+            b1 = mineBlockAt(genesis, timestamp, genesis.difficulty)
+            testChain.addBlock(b1)
+            testChain.close()
+
+            # Blocks stored without an undo record, as if the node stopped
+            # before connecting them: a valid block and an invalid child
+            # that spends an output that does not exist.
+            b2 = mineBlockAt(b1, timestamp + 1, genesis.difficulty)
+            coinbase = transaction.createTransaction(
+                [public1], [1000], timestamp)
+            badTx = transaction.createTransaction(
+                outputAddresses=[public2],
+                outputAmounts=[1000],
+                timestamp=timestamp,
+                previousTransactionHashes=[coinbase.hash],
+                previousOutputIndices=[1],
+                privateKeys=[private1]
+            )
+            badBlock = mine.generateNextBlock(b2, [coinbase, badTx])
+
+            blockStore = store.BlockStore(path)
+            blockStore.append(b2)
+            blockStore.append(badBlock)
+            blockStore.close()
+
+            loadedChain = chain.Chain(path)
+            self.assertEqual(loadedChain.head, b2)
+            self.assertIn(b2.hash, loadedChain.undo)
+            self.assertNotIn(badBlock.hash, loadedChain.blocks)
+            loadedChain.close()
+
+            # The invalid block stays removed after another restart.
+            loadedChain = chain.Chain(path)
+            self.assertEqual(loadedChain.head, b2)
+            self.assertNotIn(badBlock.hash, loadedChain.blocks)
+            loadedChain.close()
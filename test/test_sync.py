@@ -0,0 +1,73 @@
+import io
+import time
+import unittest
+from core import chain, sync
+from test import mineBlockAt
+
+
+class TestSync(unittest.TestCase):
+    def test_exportImport(self):
+        testChain = chain.Chain()
+        difficulty = testChain.head.difficulty
+        timestamp = time.time()
+        for i in range(5):
+            timestamp += 1
+            testChain.addBlock(
+                mineBlockAt(testChain.head, timestamp, difficulty))
+
+        # Blocks off the main chain are not exported.
+        fork = mineBlockAt(
+            testChain.getPreviousBlock(testChain.head),
+            timestamp + 1,
+            difficulty)
+        testChain.addBlock(fork)
+
+        stream = io.BytesIO()
+        self.assertEqual(sync.exportChain(testChain, stream), 6)
+
+        stream.seek(0)
+        importedChain = chain.Chain()
+        self.assertEqual(
+            sync.importChain(importedChain, stream, queueSize=2), 5)
+        self.assertEqual(importedChain.head, testChain.head)
+        self.assertNotIn(fork.hash, importedChain.blocks)
+
+        # Importing the same stream again adds nothing.
+        stream.seek(0)
+        self.assertEqual(sync.importChain(importedChain, stream), 0)
+
+    def test_invalidStream(self):
+        testChain = chain.Chain()
+        difficulty = testChain.head.difficulty
+        for i in range(2):
+            testChain.addBlock(mineBlockAt(
+                testChain.head, time.time() + i, difficulty))
+
+        stream = io.BytesIO()
+        sync.exportChain(testChain, stream)
+        data = stream.getvalue()
+
+        with self.assertRaises(sync.SyncException):
+            sync.importChain(chain.Chain(), io.BytesIO(data[:-1]))
+
+        with self.assertRaises(sync.SyncException):
+            sync.importChain(chain.Chain(), io.BytesIO(b"XXXX" + data[4:]))
+
+        # A length prefix past the maximum block size is rejected before
+        # anything is read for it.
+        stream = io.BytesIO()
+        stream.write(sync.STREAM_MAGIC + bytes([sync.STREAM_VERSION]))
+        stream.write(sync.RECORD_LENGTH.pack(0xffffffff))
+        stream.seek(0)
+        with self.assertRaisesRegex(sync.SyncException, "too large"):
+            list(sync.readChain(stream))
+
+        # A block whose parent is missing stops the import.
+        payload = testChain.head.asBytes()
+        stream = io.BytesIO()
+        stream.write(sync.STREAM_MAGIC + bytes([sync.STREAM_VERSION]))
+        stream.write(sync.RECORD_LENGTH.pack(len(payload)))
+        stream.write(payload)
+        stream.seek(0)
+        with self.assertRaises(chain.NoParentException):
+            sync.importChain(chain.Chain(), stream)
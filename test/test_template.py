@@ -0,0 +1,100 @@
+import unittest
+import time
+from core import block, chain, mempool, template, transaction
+from test import private1, private2, public1, public3
+from test import mineBlockAt
+
+
+class TestTemplateBuilder(unittest.TestCase):
+    def setUp(self):
+        self.chain = chain.Chain()
+        self.timestamp = time.time()
+        self.funding = mineBlockAt(
+            self.chain.head,
+            self.timestamp,
+            self.chain.getNextDifficulty(self.chain.head))
+        self.chain.addBlock(self.funding)
+        self.mempool = mempool.Mempool(self.chain)
+        self.builder = template.TemplateBuilder(
+            self.chain, self.mempool, public3, workSize=1000)
+
+        # The second transaction of the block pays 1000 to public2.
+        self.payment = transaction.createTransaction(
+            [public1], [1000], self.timestamp,
+            [self.funding.transactions[1].hash], [0], [private2])
+
+    def tearDown(self):
+        self.builder.close()
+        self.mempool.close()
+
+    def test_incrementalTemplate(self):
+        # A block with only a coinbase is invalid, so there is no work
+        # while the mempool is empty.
+        self.assertIsNone(self.builder.getWork())
+        self.assertEqual(self.builder.rebuilds, 1)
+        self.assertEqual(len(self.builder.header.transactions), 1)
+
+        # A new transaction extends the template without rebuilding it.
+        self.mempool.addTransaction(self.payment)
+        first = self.builder.getWork()
+        self.assertEqual(len(first.header.transactions), 2)
+        self.assertEqual(first.header.transactions[1], self.payment)
+        self.assertEqual(first.header.previousHash, self.funding.hash)
+        self.assertEqual(first.start, 0)
+        self.assertEqual(self.builder.rebuilds, 1)
+        self.assertEqual(self.builder.extensions, 1)
+
+        second = self.builder.getWork()
+        self.assertEqual(second.templateId, first.templateId)
+        self.assertEqual(second.start, first.end)
+
+        # A pending transaction spending the first one extends it again.
+        child = transaction.createTransaction(
+            [public3], [1000], self.timestamp,
+            [self.payment.hash], [0], [private1])
+        self.mempool.addTransaction(child)
+        extended = self.builder.getWork()
+        self.assertNotEqual(extended.templateId, first.templateId)
+        self.assertEqual(extended.start, 0)
+        self.assertEqual(self.builder.rebuilds, 1)
+        self.assertEqual(self.builder.extensions, 2)
+
+        header = extended.header
+        self.assertEqual(header.transactions[1:], [self.payment, child])
+        self.assertEqual(
+            header.hash(7),
+            block.MiningHeader(
+                header.index,
+                header.timestamp,
+                header.transactions,
+                header.previousHash,
+                header.difficulty).hash(7))
+
+        # Removing a transaction of the template rebuilds it, and with the
+        # mempool empty again there is no work.
+        self.mempool.removeTransaction(self.payment.hash)
+        self.assertIsNone(self.builder.getWork())
+        self.assertEqual(self.builder.rebuilds, 2)
+
+    def test_newTip(self):
+        self.mempool.addTransaction(self.payment)
+
+        noonce = None
+        while noonce is None:
+            unit = self.builder.getWork()
+            noonce = template.searchWorkUnit(unit)
+
+        self.assertFalse(self.builder.isStale(unit))
+        newBlock = self.builder.submit(unit, noonce)
+        self.assertEqual(self.chain.head, newBlock)
+        self.assertEqual(len(self.mempool), 0)
+        self.assertTrue(self.builder.isStale(unit))
+
+        # The mined transaction left the mempool, so there is no work on
+        # the new head yet.
+        self.assertIsNone(self.builder.getWork())
+        self.assertEqual(self.builder.header.previousHash, newBlock.hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
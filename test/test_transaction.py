@@ -105,3 +105,119 @@ class TestTransaction(unittest.TestCase):
                 outputAddresses=[public1],
                 outputAmounts=[0],
                 timestamp=time.time())
+
+    def test_binarySerialization(self):
+        firstTransaction = transaction.createTransaction(
+            outputAddresses=[public1],
+            outputAmounts=[1000],
+            timestamp=time.time())
+        nextTransaction = transaction.createTransaction(
+            outputAddresses=[public2, public3],
+            outputAmounts=[700, 300],
+            timestamp=time.time(),
+            previousTransactionHashes=[firstTransaction.hash],
+            previousOutputIndices=[0],
+            privateKeys=[private1]
+        )
+
+        for tx in [firstTransaction, nextTransaction]:
+            decoded = transaction.createFromBytes(tx.asBytes())
+            self.assertEqual(decoded.hash, tx.hash)
+            self.assertEqual(decoded.asDict(), tx.asDict())
+
+        self.assertTrue(
+            transaction.verifyTransactionInput(
+                firstTransaction,
+                transaction.createFromBytes(nextTransaction.asBytes()),
+                0)[0])
+
+        with self.assertRaises(ValueError):
+            transaction.createFromBytes(nextTransaction.asBytes() + b"\x00")
+
+    def test_malformedAddress(self):
+        tx1 = transaction.createTransaction(["00"], [1000], time.time())
+        tx2 = transaction.createTransaction(
+            [public2], [1000], time.time(), [tx1.hash], [0], [private1])
+        self.assertEqual(
+            transaction.verifyInputSignature(tx1.outputs[0], tx2, 0),
+            (False, "Signature not valid"))
+        self.assertFalse(transaction.verifySignature("", b"", ""))
+        self.assertFalse(transaction.verifySignature(public1, b"", "zz"))
+
+    def test_keyCache(self):
+        firstTransaction = transaction.createTransaction(
+            outputAddresses=[public1, public1],
+            outputAmounts=[500, 500],
+            timestamp=time.time())
+        nextTransaction = transaction.createTransaction(
+            outputAddresses=[public2],
+            outputAmounts=[1000],
+            timestamp=time.time(),
+            previousTransactionHashes=[firstTransaction.hash] * 2,
+            previousOutputIndices=[0, 1],
+            privateKeys=[private1, private1]
+        )
+
+        cache = transaction.keyCache
+        cache.clear()
+        for i in range(2):
+            self.assertTrue(
+                transaction.verifyTransactionInput(
+                    firstTransaction, nextTransaction, i)[0])
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+
+        cache = transaction.KeyCache(maxSize=1)
+        cache.getVerifier(public1)
+        cache.getVerifier(public2)
+        cache.getVerifier(public1)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.hits, 0)
+        cache.getVerifier(public1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_signatureCache(self):
+        firstTransaction = transaction.createTransaction(
+            outputAddresses=[public1],
+            outputAmounts=[1000],
+            timestamp=time.time())
+        nextTransaction = transaction.createTransaction(
+            outputAddresses=[public2],
+            outputAmounts=[1000],
+            timestamp=time.time(),
+            previousTransactionHashes=[firstTransaction.hash],
+            previousOutputIndices=[0],
+            privateKeys=[private1]
+        )
+        badTransaction = transaction.createTransaction(
+            outputAddresses=[public2],
+            outputAmounts=[1000],
+            timestamp=time.time(),
+            previousTransactionHashes=[firstTransaction.hash],
+            previousOutputIndices=[0],
+            privateKeys=[private2]
+        )
+
+        cache = transaction.signatureCache
+        cache.clear()
+        for i in range(3):
+            self.assertTrue(
+                transaction.verifyTransactionInput(
+                    firstTransaction, nextTransaction, 0)[0])
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.verifications, 1)
+        self.assertGreater(cache.timeSaved, 0)
+
+        # Invalid signatures are never cached.
+        for i in range(2):
+            self.assertFalse(
+                transaction.verifyTransactionInput(
+                    firstTransaction, badTransaction, 0)[0])
+        self.assertEqual(cache.misses, 3)
+
+        cache = transaction.SignatureCache(maxSize=1)
+        cache.add(nextTransaction.hash, 0)
+        cache.add(badTransaction.hash, 0)
+        self.assertFalse(cache.contains(nextTransaction.hash, 0))
+        self.assertTrue(cache.contains(badTransaction.hash, 0))
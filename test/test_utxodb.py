@@ -0,0 +1,156 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from core import chain, transaction, utxodb
+from test import public1, public2
+from test import mineBlockAt
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "utxo.sqlite")
+
+    def test_dictionarySemantics(self):
+        backend = utxodb.SQLiteBackend(self.path, cacheSize=1, flushSize=2)
+        first = ("ab" * 32, 0)
+        second = ("cd" * 32, 1)
+
+        backend[first] = transaction.TransactionOutput(1000, public1)
+        backend.blockBoundary("ab" * 32)
+        self.assertEqual(len(backend._dirty), 1)
+
+        backend[second] = transaction.TransactionOutput(500, public2)
+        backend.blockBoundary("ab" * 32)
+        self.assertEqual(len(backend._dirty), 0)
+
+        self.assertIn(first, backend)
+        self.assertEqual(backend[second].amount, 500)
+        self.assertEqual(backend[first].address, public1)
+        self.assertIsNone(backend.get(("ef" * 32, 0), None))
+        self.assertEqual(set(backend), {first, second})
+
+        output = backend.pop(first)
+        self.assertEqual(output.amount, 1000)
+        self.assertNotIn(first, backend)
+        self.assertIsNone(backend.pop(first, None))
+        with self.assertRaises(KeyError):
+            del backend[first]
+        self.assertEqual(len(backend), 1)
+
+        # Changes that have not been written are kept until closing.
+        backend.close()
+        backend = utxodb.SQLiteBackend(self.path)
+        self.assertEqual(list(backend), [second])
+        self.assertEqual(backend[second].address, public2)
+        backend.close()
+
+    def test_chainBackend(self):
+        def utxoState(testChain):
+            return {
+                outpoint: (output.amount, output.address)
+                for outpoint, output in testChain.utxo.utxo.items()
+            }
+
+        backend = utxodb.SQLiteBackend(self.path, cacheSize=4, flushSize=4)
+        testChain = chain.Chain(utxoBackend=backend)
+        memoryChain = chain.Chain()
+
+        genesis = testChain.head
+        timestamp = time.time()
+        mainBlocks = []
+        parent = genesis
+        for i in range(3):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            mainBlocks.append(parent)
+
+        forkBlocks = []
+        parent = genesis
+        for i in range(4):
+            timestamp += 1
+            parent = mineBlockAt(parent, timestamp, genesis.difficulty)
+            forkBlocks.append(parent)
+
+        for newBlock in mainBlocks + forkBlocks:
+            testChain.addBlock(newBlock)
+            memoryChain.addBlock(newBlock)
+
+        self.assertEqual(testChain.head, forkBlocks[-1])
+        self.assertEqual(utxoState(testChain), utxoState(memoryChain))
+        testChain.close()
+
+        # The database holds the UTXO once it is closed.
+        backend = utxodb.SQLiteBackend(self.path)
+        self.assertEqual(
+            {outpoint: backend[outpoint].amount for outpoint in backend},
+            {
+                outpoint: output.amount
+                for outpoint, output in memoryChain.utxo.utxo.items()
+            })
+        backend.close()
+
+    def test_resumeFromBackend(self):
+        def utxoState(testChain):
+            return {
+                outpoint: (output.amount, output.address)
+                for outpoint, output in testChain.utxo.utxo.items()
+            }
+
+        def openChain(path):
+            backend = utxodb.SQLiteBackend(self.path, flushSize=1000)
+            with mock.patch.object(
+                    chain.UTXOManager,
+                    "connectBlock",
+                    autospec=True,
+                    side_effect=chain.UTXOManager.connectBlock) as connect:
+                testChain = chain.Chain(path, utxoBackend=backend)
+            return testChain, [
+                call[0][1][0].hash for call in connect.call_args_list]
+
+        directory = os.path.dirname(self.path)
+        path = os.path.join(directory, "chain")
+        testChain, connected = openChain(path)
+        genesis = testChain.head
+        self.assertEqual(connected, [genesis.transactions[0].hash])
+
+        timestamp = time.time()
+        blocks = []
+        for i in range(4):
+            timestamp += 1
+            blocks.append(
+                mineBlockAt(testChain.head, timestamp, genesis.difficulty))
+            testChain.addBlock(blocks[-1])
+            if i == 1:
+                testChain.close()
+                testChain, connected = openChain(path)
+
+                # The backend was written at the head when it was closed,
+                # so no block is connected again.
+                self.assertEqual(connected, [])
+                self.assertEqual(testChain.head, blocks[-1])
+        expectedState = utxoState(testChain)
+
+        # Stopping without writing the last blocks' changes leaves the
+        # backend at the block it was closed at, and only the blocks
+        # after it are connected.
+        testChain.blocks.close()
+        testChain.utxo.utxo._connection.close()
+        testChain, connected = openChain(path)
+        self.assertEqual(
+            connected, [b.transactions[0].hash for b in blocks[2:]])
+        self.assertEqual(utxoState(testChain), expectedState)
+        testChain.close()
+
+        # A backend for a block that is not in the stored chain is rebuilt.
+        otherChain, connected = openChain(os.path.join(directory, "other"))
+        self.assertEqual(connected, [genesis.transactions[0].hash])
+        self.assertEqual(len(otherChain.utxo.utxo), 1)
+        otherChain.close()
+
+
+if __name__ == '__main__':
+    unittest.main()